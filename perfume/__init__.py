@@ -2,7 +2,8 @@
 
 """Top-level package for perfume."""
 
-from .perfume import bench  # noqa: F401
+from .perfume import bench, bench_async  # noqa: F401
+from .scaling import sweep  # noqa: F401
 from ._version import get_versions
 
 __version__ = get_versions()["version"]
@@ -10,4 +11,4 @@ del get_versions
 
 __author__ = """Leif Walsh"""
 __email__ = "leif.walsh@gmail.com"
-__all__ = ["bench"]
+__all__ = ["bench", "bench_async", "sweep"]
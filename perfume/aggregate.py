@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.aggregate` summarizes samples instead of keeping them.
+
+For soak tests that run for hours, every raw timestamp is more than
+anyone needs, but the quantiles over the whole run, and how they
+drift, still matter.  An :class:`Aggregate` passed to
+:func:`perfume.bench` records each function's latencies into
+:class:`~perfume.histogram.Histogram` s, one for the whole run and one
+per time window, and keeps a fixed-size random sample of the raw
+samples for plots.  Samples are then dropped from memory, so memory
+only grows with the number of windows.
+"""
+
+import collections
+import threading
+
+import numpy as np
+import pandas as pd
+
+from perfume.histogram import FunctionHistograms
+from perfume.histogram import Histogram
+from perfume.histogram import describe
+from perfume.histogram import ks_test
+from perfume.samples import SampleBuffer
+
+
+class Aggregate(FunctionHistograms):
+    """Histograms of each function's latencies, per time window.
+
+    A sample falls in the window its call ended in, counting from the
+    start of the first sample.  Like
+    :class:`~perfume.histogram.FunctionHistograms`, which this extends
+    with the histograms of the whole run, samples flagged as warm-up
+    are left out.
+
+    Alongside, a reservoir of ``reservoir`` samples per function is
+    kept, each recorded sample being equally likely to be in it, with
+    all its fields, for the plots and analyses that need raw samples.
+
+    It's safe to read an aggregate from another thread while it's
+    being updated.
+
+    Parameters
+    ----------
+    window_seconds : float
+        Length of each time window.
+    significant_digits : int
+        Precision of the histograms.
+    reservoir : int
+        Number of raw samples to keep per function.
+    recent : int
+        Number of the most recent samples :func:`perfume.bench` keeps
+        in memory for the display, after recording them.
+    seed : int
+        Seed for choosing the samples kept in the reservoir.
+    """
+
+    def __init__(
+        self,
+        window_seconds=60.,
+        significant_digits=3,
+        reservoir=1000,
+        recent=10000,
+        seed=None,
+    ):
+        if window_seconds <= 0:
+            raise ValueError("window_seconds must be positive")
+
+        super(Aggregate, self).__init__(significant_digits)
+        self.window_ns = int(window_seconds * 1e9)
+        self.reservoir = reservoir
+        self.recent = recent
+        self.lock = threading.Lock()
+        self._rng = np.random.RandomState(seed)
+        self._origin = None
+        self._windows = collections.OrderedDict()
+        self._fields = None
+        self._kept = None
+        self._kept_rows = None
+        self._offered = None
+
+    @property
+    def rows(self):
+        """The number of each function's samples read so far."""
+        return list(self._rows) if self._rows is not None else None
+
+    def update(self, buf):
+        """Records new samples from a :class:`~perfume.samples.SampleBuffer`.
+
+        Returns the list of histograms of the whole run, one per
+        function.
+        """
+        with self.lock:
+            if self._kept is None:
+                self._start(buf.names)
+                self._fields = buf.fields
+                width = len(self._fields)
+                self._kept = [
+                    np.empty((self.reservoir, width), dtype=np.int64)
+                    for _ in buf.names
+                ]
+                self._kept_rows = [
+                    np.empty(self.reservoir, dtype=np.int64)
+                    for _ in buf.names
+                ]
+                self._offered = [0] * len(buf.names)
+            before = list(self._rows)
+            super(Aggregate, self).update(buf)
+            for i, start in enumerate(before):
+                count = self._rows[i] - start
+                if count:
+                    self._record(buf, i, start, count)
+        return self.histograms
+
+    def _record(self, buf, index, start, count):
+        # Adds samples the histograms of the whole run just read to
+        # their windows and the reservoir.
+        fields = self._fields
+        rows = buf.function_view(index, start)[:count]
+        timings = buf.function_timings(index, start)[:count]
+        numbers = np.arange(start, start + count)
+        if "warmup" in fields:
+            steady = rows[:, fields.index("warmup")] == 0
+            rows, timings, numbers = (
+                rows[steady], timings[steady], numbers[steady]
+            )
+        if not len(rows):
+            return
+
+        if self._origin is None:
+            self._origin = int(rows[:, fields.index("begin")].min())
+        windows = (rows[:, fields.index("end")] - self._origin) // (
+            self.window_ns
+        )
+        for window in np.unique(windows):
+            histograms = self._windows.get(int(window))
+            if histograms is None:
+                histograms = [
+                    Histogram(self.significant_digits) for _ in self.names
+                ]
+                self._windows[int(window)] = histograms
+            histograms[index].record(timings[windows == window])
+        self._sample(index, rows, numbers)
+
+    def _sample(self, index, rows, numbers):
+        # Reservoir sampling: the n'th sample offered replaces a random
+        # one with probability reservoir / n.
+        kept, kept_rows = self._kept[index], self._kept_rows[index]
+        offered = self._offered[index]
+        fill = min(max(self.reservoir - offered, 0), len(rows))
+        kept[offered:offered + fill] = rows[:fill]
+        kept_rows[offered:offered + fill] = numbers[:fill]
+        n = offered + np.arange(fill, len(rows)) + 1
+        slots = (self._rng.random_sample(len(n)) * n).astype(np.int64)
+        for i in np.flatnonzero(slots < self.reservoir):
+            kept[slots[i]] = rows[fill + i]
+            kept_rows[slots[i]] = numbers[fill + i]
+        self._offered[index] = offered + len(rows)
+
+    def describe(self, window=None):
+        """Returns descriptive statistics of each function's latencies.
+
+        These are over the whole run, or over the ``window``'th window
+        if given.  See :func:`perfume.histogram.describe`.
+        """
+        with self.lock:
+            if window is None:
+                return describe(self.names, self.histograms)
+
+            return describe(self.names, self._windows[window])
+
+    def ks_test(self, window=None):
+        """Runs the Kolmogorov-Smirnov test across functions.
+
+        This is over the whole run, or over the ``window``'th window if
+        given.  See :func:`perfume.histogram.ks_test`.
+        """
+        with self.lock:
+            if window is None:
+                return ks_test(self.names, self.histograms)
+
+            return ks_test(self.names, self._windows[window])
+
+    @property
+    def windows(self):
+        """The numbers of the windows samples fell in, in order."""
+        with self.lock:
+            return sorted(self._windows)
+
+    def quantiles(self, q):
+        """Returns the ``q``'th quantile of each function's latency in
+        each window.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Indexed by the time each window starts, since the first
+            sample, with a column per function.
+        """
+        with self.lock:
+            windows = sorted(self._windows)
+            ret = pd.DataFrame(
+                [
+                    [h.quantile(q) for h in self._windows[window]]
+                    for window in windows
+                ],
+                index=pd.to_timedelta(
+                    np.array(windows, dtype=np.int64) * self.window_ns,
+                    unit="ns",
+                ),
+                columns=self.names,
+            )
+        ret.index.name = "time"
+        return ret
+
+    def reservoir_frame(self):
+        """Returns the samples kept in the reservoir as a DataFrame.
+
+        Each function's samples are in the order they were taken, so
+        the frame can be passed to :mod:`perfume.analyze`, but the
+        rows of different functions weren't taken together.
+        """
+        with self.lock:
+            if self._kept is None:
+                return pd.DataFrame()
+
+            buf = SampleBuffer(self.names, self._fields, self.reservoir)
+            for i, offered in enumerate(self._offered):
+                size = min(offered, self.reservoir)
+                order = np.argsort(self._kept_rows[i][:size], kind="stable")
+                buf.extend_function(i, self._kept[i][:size][order])
+        return buf.to_frame()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.aio` benchmarks coroutine functions.
+
+An :class:`AsyncCollector` awaits coroutine functions from inside a
+running event loop, optionally from several concurrent tasks, and
+measures, alongside, how long the loop takes to get around to other
+work, so slow calls can be told apart from a saturated loop.
+:func:`perfume.bench_async` drives one.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+from perfume.collect import Timer
+
+
+class _LagProbe(object):
+    # Every interval, schedules a callback and records how long the
+    # loop took to run it, behind whatever other work was ready.
+
+    def __init__(self, loop, interval):
+        self._loop = loop
+        self._interval = interval
+        self._handle = None
+        self.lags = []
+
+    def start(self):
+        self._handle = self._loop.call_soon(self._tick)
+
+    def stop(self):
+        self._handle.cancel()
+
+    def _tick(self):
+        self._handle = self._loop.call_soon(
+            self._tock, time.perf_counter_ns()
+        )
+
+    def _tock(self, ticked):
+        self.lags.append(time.perf_counter_ns() - ticked)
+        self._handle = self._loop.call_later(self._interval, self._tick)
+
+    def lag(self, start):
+        # The worst lag since the start'th, or else the latest.
+        lags = self.lags[start:] or self.lags[-1:]
+        return max(lags) if lags else 0
+
+
+class AsyncCollector(object):
+    """Awaits coroutine functions and appends samples to a buffer.
+
+    Each of ``concurrency`` tasks calls every function in turn, and
+    appends a sample once it has called them all, with its index in
+    the ``worker`` column if ``buf`` has one.  With a single task, the
+    calls are awaited directly, without creating a task per call.
+
+    If ``buf`` has a ``lag`` column, every ``lag_interval`` seconds a
+    callback is scheduled, and the nanoseconds until the loop runs it
+    are measured.  Each call records the worst of these measured while
+    it was in flight, or else the latest one before it ended.  This is
+    how long ready work kept the loop busy, independently of the calls
+    being timed: a call that never yields doesn't count towards its
+    own lag, but does towards other calls' lag.
+
+    Parameters
+    ----------
+    fns : list of coroutine function
+        Functions to benchmark.
+    buf : perfume.samples.SampleBuffer
+        Where to record samples, with columns for
+        :func:`perfume.collect.fields`.
+    concurrency : int
+        Number of tasks calling the functions concurrently.
+    overhead_ns : int
+        If given, subtracted from every sample's ``end``.
+    chunk_seconds : float
+        How long each call to :meth:`collect` keeps collecting.
+    lag_interval : float
+        How often to measure the loop's lag.
+    """
+
+    def __init__(
+        self,
+        fns,
+        buf,
+        concurrency=1,
+        overhead_ns=0,
+        chunk_seconds=0.05,
+        lag_interval=0.001,
+    ):
+        self._fns = list(fns)
+        self._buf = buf
+        self._concurrency = concurrency
+        self._overhead_ns = overhead_ns
+        self._chunk_ns = int(chunk_seconds * 1e9)
+        self._lag_interval = lag_interval
+        fields = buf.fields
+        self._width = len(fields)
+        self._lag_col = fields.index("lag") if "lag" in fields else None
+        self._samples = np.zeros(
+            (concurrency, len(buf.columns)), dtype=np.int64
+        )
+        if "worker" in fields:
+            self._samples[:, fields.index("worker")::self._width] = (
+                np.arange(concurrency)[:, np.newaxis]
+            )
+        if "warmup" in fields:
+            self._samples[:, fields.index("warmup")::self._width] = 1
+
+    async def _rounds(self, worker, deadline, probe):
+        sample = self._samples[worker]
+        lag_col = self._lag_col
+        while True:
+            for i, fn in enumerate(self._fns):
+                col = i * self._width
+                if probe is not None:
+                    start = len(probe.lags)
+                with Timer() as timer:
+                    await fn()
+                sample[col] = timer.begin
+                sample[col + 1] = max(
+                    timer.end - self._overhead_ns, timer.begin
+                )
+                if probe is not None:
+                    sample[col + lag_col] = probe.lag(start)
+            self._buf.append(sample)
+            if time.perf_counter_ns() >= deadline:
+                return
+
+    async def collect(self):
+        """Collects samples from every task for ``chunk_seconds``."""
+        deadline = time.perf_counter_ns() + self._chunk_ns
+        probe = None
+        if self._lag_col is not None:
+            probe = _LagProbe(asyncio.get_running_loop(), self._lag_interval)
+            probe.start()
+        try:
+            if self._concurrency == 1:
+                await self._rounds(0, deadline, probe)
+            else:
+                await asyncio.gather(
+                    *(
+                        self._rounds(worker, deadline, probe)
+                        for worker in range(self._concurrency)
+                    )
+                )
+        finally:
+            if probe is not None:
+                probe.stop()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.allocate` decides which functions to call each round.
+
+By default, :func:`perfume.bench` calls every function once per round.
+When some functions are much slower or much noisier than others, that
+wastes calls on the ones whose results are already clear.  The
+strategies here instead give each function a weight, based on how
+uncertain its results still are, and call it in proportion to that
+weight.
+"""
+
+import itertools
+
+import numpy as np
+
+from perfume.histogram import FunctionHistograms
+
+
+class Allocation(object):
+    """Base class for sample allocation strategies.
+
+    Each round, every function's credit grows by its weight, and the
+    functions with a full unit of credit are called.  Weights are
+    recomputed by :meth:`weights` every time the number of samples
+    grows by ``update_growth``, and the largest is always 1, so the
+    least certain function is called every round.
+
+    Parameters
+    ----------
+    min_samples : int
+        Call every function each round until each has this many
+        samples.
+    floor : float
+        Smallest weight, so no function is starved.
+    update_growth : float
+        Relative growth in samples between updates of the weights.
+    significant_digits : int
+        Precision of the histograms the weights are computed from.
+    """
+
+    def __init__(
+        self,
+        min_samples=100,
+        floor=0.01,
+        update_growth=0.05,
+        significant_digits=3,
+    ):
+        self.min_samples = min_samples
+        self.floor = floor
+        self.update_growth = update_growth
+        self._histograms = FunctionHistograms(significant_digits)
+        self._weights = None
+        self._credits = None
+        self._next_update = min_samples
+
+    def weights(self, histograms):
+        """Returns each function's weight, given their histograms."""
+        raise NotImplementedError
+
+    def _update(self, buf):
+        histograms = self._histograms.histograms
+        if min(self._histograms.counts) < self.min_samples:
+            return
+
+        weights = np.nan_to_num(
+            np.asarray(self.weights(histograms), dtype=np.float64)
+        )
+        if weights.max() <= 0:
+            weights[:] = 1.
+        self._weights = np.maximum(weights / weights.max(), self.floor)
+
+    def choose(self, buf):
+        """Returns the indices of the functions to call this round."""
+        if self._credits is None:
+            self._credits = np.zeros(len(buf.names))
+        # Read every round, so no sample is missed if the buffer
+        # discards old ones.
+        self._histograms.update(buf)
+        if len(buf) >= self._next_update:
+            self._update(buf)
+            self._next_update = max(
+                len(buf) + 1, int(len(buf) * (1 + self.update_growth))
+            )
+        if self._weights is None:
+            return range(len(buf.names))
+
+        self._credits += self._weights
+        chosen = np.flatnonzero(self._credits >= 1.)
+        self._credits[chosen] -= 1.
+        return chosen
+
+
+class QuantileUncertainty(Allocation):
+    """Calls the functions whose ``quantile`` is least certain most.
+
+    A function's weight is the square of the relative width of the
+    confidence interval of its ``quantile`` (see
+    :meth:`perfume.histogram.Histogram.quantile_interval`), since the
+    number of samples needed to narrow the interval grows with its
+    square.  Over time, this evens out the intervals' widths, instead
+    of oversampling functions that are already known precisely.
+    """
+
+    def __init__(self, quantile=0.5, z=1.96, **kwargs):
+        super(QuantileUncertainty, self).__init__(**kwargs)
+        self.quantile = quantile
+        self.z = z
+
+    def weights(self, histograms):
+        ret = []
+        for histogram in histograms:
+            low, high = histogram.quantile_interval(self.quantile, self.z)
+            estimate = (low + high) / 2
+            ret.append(((high - low) / estimate) ** 2 if estimate else 0.)
+        return ret
+
+
+class KsUncertainty(Allocation):
+    """Calls the functions in the least certain K-S comparisons most.
+
+    For each pair of functions, the K-S :math:`Z` (see
+    :func:`perfume.analyze.ks_test`) is computed from their
+    histograms.  A pair whose :math:`Z` is still below ``threshold``
+    hasn't been told apart yet, and has uncertainty 1; above it,
+    uncertainty falls off with :math:`(threshold / Z)^2`.  Within a
+    pair, more samples help the side with fewer samples most, so each
+    function's weight is the largest, over its pairs, of the pair's
+    uncertainty times :math:`(m / (n + m))^2`, where :math:`n` is its
+    number of samples and :math:`m` the other's.
+    """
+
+    def __init__(self, threshold=1.36, **kwargs):
+        super(KsUncertainty, self).__init__(**kwargs)
+        self.threshold = threshold
+
+    def weights(self, histograms):
+        ret = np.zeros(len(histograms))
+        for i, j in itertools.combinations(range(len(histograms)), 2):
+            n, m = histograms[i].count, histograms[j].count
+            d = histograms[i].ks_distance(histograms[j])
+            z = d / np.sqrt((n + m) / (n * m))
+            uncertainty = min(1., (self.threshold / z) ** 2) if z else 1.
+            ret[i] = max(ret[i], uncertainty * (m / (n + m)) ** 2)
+            ret[j] = max(ret[j], uncertainty * (n / (n + m)) ** 2)
+        return ret
+
+
+def allocation(strategy):
+    """Returns the :class:`Allocation` named by ``strategy``.
+
+    ``strategy`` is ``"quantile"``, ``"ks"``, or an :class:`Allocation`
+    to use as is.
+    """
+    if strategy is None or isinstance(strategy, Allocation):
+        return strategy
+
+    if strategy == "quantile":
+        return QuantileUncertainty()
+
+    if strategy == "ks":
+        return KsUncertainty()
+
+    raise ValueError("Unknown allocation strategy: {!r}".format(strategy))
@@ -6,33 +6,375 @@ These functions mostly take as input the samples collected by
 :func:`perfume.bench`.
 """
 
-import bokeh.io as bi
-import bokeh.models as bm
-import bokeh.plotting as bp
+import collections
+
 import numpy as np
 import pandas as pd
 from scipy import stats
 
-from perfume import colors
+from perfume.sketch import KLL
+
+
+#: Units timings can be reported in, with their size in nanoseconds.
+UNITS = collections.OrderedDict(
+    [("ns", 1), ("us", 10 ** 3), ("ms", 10 ** 6), ("s", 10 ** 9)]
+)
+
+
+def pick_unit(t):
+    """Picks a unit to report timings ``t``, in nanoseconds, in.
+
+    This is the largest of :data:`UNITS` in which the median timing is
+    at least 1.
+    """
+    median = np.nanmedian(np.asarray(t, dtype=np.float64))
+    unit = "ns"
+    for name, size in UNITS.items():
+        if median >= size:
+            unit = name
+    return unit
+
+
+def in_unit(t, unit):
+    """Converts timings ``t`` from nanoseconds to ``unit``."""
+    return t / UNITS[unit]
+
+
+def near_resolution(t, resolution_ns, factor=100):
+    """Finds functions too fast to trust given the clock's resolution.
+
+    Returns the names of the columns of timings ``t`` whose median is
+    within ``factor`` times ``resolution_ns``.
+    """
+    medians = t.median()
+    return list(medians.index[medians < factor * resolution_ns])
+
+
+def _has_field(samples, field):
+    return field in samples.columns.unique(level=1)
+
+
+def warmup_flags(samples):
+    """Returns whether each sample was taken during warm-up.
+
+    Samples collected without ``warmup`` (see :func:`perfume.bench`)
+    are never flagged.
+    """
+    if _has_field(samples, "warmup"):
+        return samples.xs("warmup", axis=1, level=1) > 0
+
+    return pd.DataFrame(
+        False, index=samples.index, columns=samples.columns.unique(level=0)
+    )
+
+
+def durations(samples):
+    """Converts samples to the time spent taking each sample.
+
+    For batched samples (see :func:`perfume.bench`), this covers all
+    the calls in the batch.  Samples flagged as warm-up are NaN.
+    """
+    ret = samples.xs("end", axis=1, level=1) - samples.xs(
+        "begin", axis=1, level=1
+    )
+    if _has_field(samples, "warmup"):
+        return ret.mask(warmup_flags(samples))
+
+    return ret
+
+
+def fixture_durations(samples):
+    """Returns the nanoseconds each sample spent in setup and teardown.
+
+    Samples collected without fixtures (see :func:`perfume.bench`)
+    spent none.
+    """
+    if _has_field(samples, "fixture"):
+        return samples.xs("fixture", axis=1, level=1)
+
+    return pd.DataFrame(
+        0, index=samples.index, columns=samples.columns.unique(level=0)
+    )
+
+
+def memory_use(samples):
+    """Returns the memory each sample used.
+
+    Requires samples collected with ``memory`` (see
+    :func:`perfume.bench`): in bytes at peak for ``"tracemalloc"``, or
+    in net blocks allocated for ``"blocks"``.  Batched samples give
+    the use of the whole batch, and warm-up samples are NaN.
+    """
+    ret = samples.xs("memory", axis=1, level=1)
+    if _has_field(samples, "warmup"):
+        return ret.mask(warmup_flags(samples))
+
+    return ret
+
+
+def batch_sizes(samples):
+    """Returns the number of calls timed in each sample."""
+    if _has_field(samples, "batch"):
+        return samples.xs("batch", axis=1, level=1)
+
+    return pd.DataFrame(
+        1, index=samples.index, columns=samples.columns.unique(level=0)
+    )
+
+
+def service_times(samples):
+    """Converts samples to the time each call took once it started.
+
+    For batched samples, each observation is the mean latency of one
+    call in the batch.
+    """
+    if _has_field(samples, "batch"):
+        return durations(samples) / batch_sizes(samples)
+
+    return durations(samples)
 
 
 def timings(samples):
-    """Converts samples to sample times per observation."""
-    groups = samples.groupby(axis=1, level=0)
-    return groups.apply(lambda group: group.iloc[:, 1] - group.iloc[:, 0])
+    """Converts samples to sample times per observation.
+
+    For batched samples, each observation is the mean latency of one
+    call in the batch.
+
+    Samples from an open loop (see :class:`perfume.load.OpenLoop`)
+    record when each call was ``intended`` to start, and are timed
+    from then, so time spent waiting for a free thread counts.  Use
+    :func:`service_times` for the time from the actual start.
+    """
+    if _has_field(samples, "intended"):
+        ret = samples.xs("end", axis=1, level=1) - samples.xs(
+            "intended", axis=1, level=1
+        )
+        return ret.mask(warmup_flags(samples))
+
+    return service_times(samples)
+
 
+def gc_durations(samples):
+    """Returns the nanoseconds each sample spent collecting garbage.
 
-def _remove_other_timings(group):
-    other_timings = (
-        (group.iloc[:, 0] - group.iloc[:, 1].shift(1)).fillna(0).cumsum()
+    Requires samples collected with ``gc="record"`` (see
+    :func:`perfume.bench`).
+    """
+    return sum(
+        samples.xs("gc{}".format(generation), axis=1, level=1)
+        for generation in range(3)
     )
-    ret = group.groupby(axis=1, level=1).apply(
-        lambda x: x.iloc[:, 0] - other_timings
+
+
+def gc_generations(samples):
+    """Returns the oldest generation collected during each sample.
+
+    Samples without any collection get -1.  Requires samples collected
+    with ``gc="record"``.
+    """
+    ret = pd.DataFrame(
+        -1, index=samples.index, columns=samples.columns.unique(level=0)
     )
-    ret.columns = group.columns
+    for generation in range(3):
+        collected = samples.xs("gc{}".format(generation), axis=1, level=1)
+        ret = ret.mask(collected > 0, generation)
     return ret
 
 
+def split_gc(samples, generation=0):
+    """Splits timings into clean samples and those hit by GC.
+
+    A sample is hit if it collected ``generation`` or an older
+    generation; for example, ``generation=2`` separates out the
+    samples hit by full collections.
+
+    Returns
+    -------
+    (pandas.DataFrame, pandas.DataFrame)
+        The clean and the hit timings, each shaped like
+        :func:`timings`, with NaN in place of samples from the other
+        set.
+    """
+    t = timings(samples)
+    hit = gc_generations(samples) >= generation
+    return t.mask(hit), t.where(hit)
+
+
+def _positions(samples):
+    t = timings(samples)
+    positions = samples.xs("position", axis=1, level=1)
+    return {
+        name: pd.DataFrame(
+            {"position": positions[name], "time": t[name]}
+        ).dropna()
+        for name in t.columns
+    }
+
+
+def position_timings(samples):
+    """Returns each function's median timing at each call position.
+
+    Requires samples collected with an ``order`` other than
+    ``"fixed"`` (see :func:`perfume.bench`).  The row index is the
+    call's index within its round, and there is a column per
+    function.
+    """
+    return pd.DataFrame(
+        {
+            name: frame.groupby("position")["time"].median()
+            for name, frame in _positions(samples).items()
+        }
+    )
+
+
+def order_effects(samples):
+    """Tests whether a function's timings depend on its call position.
+
+    Runs a Kruskal-Wallis H-test per function, comparing the timings
+    it got at each position within a round.  A small p-value means
+    the position matters, for instance because caches are warmed by
+    whatever ran just before, and that a fixed call order would have
+    biased the comparison.
+
+    Returns a DataFrame with the ``statistic`` and ``pvalue`` for each
+    function, NaN for functions only seen at one position.
+    """
+    data = {}
+    for name, frame in _positions(samples).items():
+        groups = [
+            group.values
+            for _, group in frame.groupby("position")["time"]
+        ]
+        if len(groups) < 2:
+            data[name] = (np.nan, np.nan)
+        else:
+            result = stats.kruskal(*groups)
+            data[name] = (result.statistic, result.pvalue)
+    return pd.DataFrame(
+        data, index=pd.Index(["statistic", "pvalue"], name="order effect")
+    ).T
+
+
+def cpu_times(samples, clock="thread"):
+    """Returns the CPU time spent per call.
+
+    Requires samples collected with ``cpu_time=True`` (see
+    :func:`perfume.bench`).  ``clock`` picks the CPU time of the
+    ``"thread"`` making the calls, or of the whole ``"process"``.
+    Like :func:`service_times`, batched samples give the mean per call
+    and warm-up samples are NaN.
+    """
+    ret = samples.xs("{}_end".format(clock), axis=1, level=1) - samples.xs(
+        "{}_begin".format(clock), axis=1, level=1
+    )
+    if _has_field(samples, "warmup"):
+        ret = ret.mask(warmup_flags(samples))
+    if _has_field(samples, "batch"):
+        return ret / batch_sizes(samples)
+
+    return ret
+
+
+def split_cpu(samples):
+    """Splits each call's time into on-CPU and off-CPU time.
+
+    On-CPU time is the CPU time of the thread making the call.  The
+    rest of the call's wall-clock time, off-CPU, was spent blocked on
+    I/O or locks, sleeping, or waiting for the scheduler to run it.
+
+    Returns
+    -------
+    (pandas.DataFrame, pandas.DataFrame)
+        The on-CPU and off-CPU times, each shaped like
+        :func:`service_times`.
+    """
+    on = cpu_times(samples)
+    off = (service_times(samples) - on).clip(lower=0)
+    return on, off
+
+
+def preempted(samples):
+    """Returns whether each sample was preempted by the OS.
+
+    A sample was preempted if its thread was involuntarily context
+    switched out at least once.  Requires samples collected with
+    ``rusage=True`` (see :func:`perfume.bench`).
+    """
+    return samples.xs("nivcsw", axis=1, level=1) > 0
+
+
+def page_faulted(samples, minor=False):
+    """Returns whether each sample took a page fault.
+
+    By default only major faults, which had to wait for I/O, count.
+    With ``minor``, so do minor faults, which the OS serves from
+    memory, such as on first touching freshly allocated pages.
+    Requires samples collected with ``rusage=True``.
+    """
+    ret = samples.xs("majflt", axis=1, level=1) > 0
+    if minor:
+        ret |= samples.xs("minflt", axis=1, level=1) > 0
+    return ret
+
+
+def split_os_noise(samples, minor_faults=False):
+    """Splits timings into clean samples and those hit by the OS.
+
+    A sample is hit if it was :func:`preempted` or
+    :func:`page_faulted`.
+
+    Returns
+    -------
+    (pandas.DataFrame, pandas.DataFrame)
+        The clean and the hit timings, each shaped like
+        :func:`timings`, with NaN in place of samples from the other
+        set.
+    """
+    t = timings(samples)
+    hit = preempted(samples) | page_faulted(samples, minor=minor_faults)
+    return t.mask(hit), t.where(hit)
+
+
+def os_noise_in_tail(samples, q=0.99, minor_faults=False):
+    """Compares how often the OS hit the tail and the rest.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by function, with the fraction of samples at or above
+        the ``q``'th quantile that were :func:`preempted` or
+        :func:`page_faulted`, and the same fractions for the samples
+        below it.  If the tail is hit much more often, the OS explains
+        the tail.
+    """
+    t = timings(samples)
+    flags = {
+        "preempted": preempted(samples),
+        "faulted": page_faulted(samples, minor=minor_faults),
+    }
+    tail = t.ge(t.quantile(q))
+    body = t.notnull() & ~tail
+    rows = {}
+    for name in t.columns:
+        row = {}
+        for flag, hit in flags.items():
+            row["tail_" + flag] = hit[name][tail[name]].mean()
+            row["body_" + flag] = hit[name][body[name]].mean()
+        rows[name] = row
+    return pd.DataFrame.from_dict(rows, orient="index")[
+        ["tail_preempted", "body_preempted", "tail_faulted", "body_faulted"]
+    ]
+
+
+def _isolate(begin, end):
+    # Time spent outside this function accumulates between one call's
+    # end and the next call's begin.
+    other = np.zeros_like(begin)
+    np.cumsum(begin[1:] - end[:-1], out=other[1:])
+    offset = begin[0] + other
+    return begin - offset, end - offset
+
+
 def isolate(samples):
     """For each function, isolates its begin and end times.
 
@@ -40,19 +382,34 @@ def isolate(samples):
     to the previous end.  This gives a sequence of begins and ends as
     if each function were run in isolation with no benchmarking
     overhead.
-    """
-    zeroed = samples.groupby(axis=1, level=0).apply(
-        lambda group: group - group.iloc[0, 0]
-    )
-    return zeroed.groupby(axis=1, level=0).apply(_remove_other_timings)
 
-
-def _timing_in_context(group):
-    time_col = pd.DataFrame(data=group.iloc[:, 1].values, columns=["time"])
-    values = pd.DataFrame(data=timings(group), columns=[group.columns[0][0]])
-    time_col = pd.to_timedelta(time_col["time"], unit="s")
-    values = values.assign(time=time_col)
-    return values.set_index("time")
+    If samples have a ``worker`` column, calls from different workers
+    may overlap, so each worker's calls are isolated separately, as
+    if each worker ran alone.
+    """
+    isolated = samples.copy()
+    has_worker = _has_field(samples, "worker")
+    for name in samples.columns.unique(level=0):
+        begin = samples[(name, "begin")].values.copy()
+        end = samples[(name, "end")].values.copy()
+        # Functions sampled independently may be missing trailing
+        # samples.
+        n = samples[(name, "end")].count()
+        if has_worker:
+            worker = samples[(name, "worker")].values[:n]
+            for w in np.unique(worker):
+                rows = np.flatnonzero(worker == w)
+                begin[rows], end[rows] = _isolate(begin[rows], end[rows])
+        else:
+            begin[:n], end[:n] = _isolate(begin[:n], end[:n])
+        if _has_field(samples, "intended"):
+            # Keep each call's wait for its start.
+            isolated[(name, "intended")] -= (
+                samples[(name, "begin")].values - begin
+            )
+        isolated[(name, "begin")] = begin
+        isolated[(name, "end")] = end
+    return isolated
 
 
 def timings_in_context(samples):
@@ -60,22 +417,100 @@ def timings_in_context(samples):
 
     Each cell contains the timing observed, at the time when it was
     observed.  Therefore, each row will have NaNs except for the
-    function whose sample completed at that time.
+    function whose sample completed at that time.  Overlapping calls
+    from different workers that complete at the same time get rows
+    of their own.
     """
     iso = isolate(samples)
-    t = iso.groupby(axis=1, level=0).apply(_timing_in_context)
-    t.columns = t.columns.droplevel(0)
-    return t
+    t = timings(iso)
+    long = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "time": iso[(name, "end")][t[name].notnull()].values,
+                    "function": name,
+                    "timing": t[name].dropna().values,
+                }
+            )
+            for name in t.columns
+        ],
+        ignore_index=True,
+    )
+    long["repeat"] = long.groupby(["time", "function"]).cumcount()
+    ret = long.pivot(
+        index=["time", "repeat"], columns="function", values="timing"
+    )
+    ret = ret.reindex(columns=t.columns)
+    ret.index = pd.to_timedelta(
+        ret.index.get_level_values("time"), unit="ns"
+    ).rename("time")
+    ret.columns.name = None
+    return ret
+
+
+def _busy_ns(begin, end):
+    # Length of the union of the [begin, end) intervals.
+    order = np.argsort(begin, kind="mergesort")
+    begin = begin[order]
+    reach = np.maximum.accumulate(end[order])
+    gaps = np.maximum(begin[1:] - reach[:-1], 0).sum()
+    return reach[-1] - begin[0] - gaps
+
+
+def throughput(samples):
+    """Returns each function's calls per second.
+
+    Calls are counted while at least one call of the function was in
+    flight, so this is the throughput under whatever concurrency the
+    samples were collected with, not counting time spent on other
+    functions or on benchmarking overhead.  Samples flagged as
+    warm-up are left out.
+
+    This is the rate calls are served at while busy, not the rate they
+    were started at: for an open loop (see
+    :class:`perfume.load.OpenLoop`), a function that keeps up with the
+    rate spends most of its time idle, and serves calls much faster
+    than they come in.
+    """
+    t = timings(samples)
+    batches = batch_sizes(samples)
+    data = {}
+    for name in t.columns:
+        steady = t[name].notnull().values
+        if not steady.any():
+            data[name] = np.nan
+            continue
+
+        busy = _busy_ns(
+            samples[(name, "begin")].values[steady],
+            samples[(name, "end")].values[steady],
+        )
+        calls = batches[name].values[steady].sum()
+        data[name] = calls / busy * 1e9 if busy > 0 else np.nan
+    return pd.Series(data, name="busy calls/s")
 
 
 def bucket_resample_timings(
     samples, sample_size=10, agg=np.mean, sample_count=1000
 ):
+    """Resamples timings into ``sample_count`` buckets of ``sample_size``.
+
+    Each bucket is summarized with ``agg``.  Batched samples are drawn
+    in proportion to their batch size, so every call weighs the same.
+    """
+    batches = batch_sizes(samples)
 
     def _meat_axe(s):
+        s = s.dropna()
+        weights = batches[s.name][s.index].values
+        p = weights / weights.sum()
         return pd.Series(
             [
-                agg(np.random.choice(s.values, size=sample_size, replace=True))
+                agg(
+                    np.random.choice(
+                        s.values, size=sample_size, replace=True, p=p
+                    )
+                )
                 for _ in range(sample_count)
             ]
         )
@@ -119,7 +554,7 @@ def ks_test(t):
     data = {
         name: (
             [
-                _ks_Z(t[name].values, t[t.columns[j]].values)
+                _ks_Z(t[name].dropna().values, t[t.columns[j]].dropna().values)
                 for j in range(i + 1)
             ]
             + ([np.nan] * (len(t.columns) - 2 - i))
@@ -130,6 +565,77 @@ def ks_test(t):
     return pd.DataFrame(data, index=idx)
 
 
+def sketches(samples, k=200, seed=None):
+    """Summarizes each function's timings in a :class:`~perfume.sketch.KLL`.
+
+    Unlike the samples, sketches of the same functions from several
+    runs, processes or hosts merge cheaply, with
+    :func:`merge_sketches`, and :func:`describe_sketches` tabulates
+    them.
+
+    Returns
+    -------
+    pandas.Series
+        A sketch per function, indexed by name.
+    """
+    t = timings(samples)
+    ret = pd.Series(
+        [KLL(k, seed=seed) for _ in t.columns], index=t.columns, dtype=object
+    )
+    for name, sketch in ret.items():
+        sketch.update(t[name].values)
+    return ret
+
+
+def merge_sketches(*runs):
+    """Merges sketches of the same functions from several runs.
+
+    Each run is a :class:`~pandas.Series` of sketches, as from
+    :func:`sketches`.  The runs aren't changed.
+
+    Returns
+    -------
+    pandas.Series
+        A sketch per function of any run, summarizing its timings
+        from every run.
+    """
+    names = []
+    for run in runs:
+        names.extend(name for name in run.index if name not in names)
+    ret = pd.Series(index=names, dtype=object)
+    for name in names:
+        merged = None
+        for run in runs:
+            if name in run.index:
+                if merged is None:
+                    merged = KLL(run[name].k)
+                merged.merge(run[name])
+        ret[name] = merged
+    return ret
+
+
+def describe_sketches(sketches, percentiles=(.25, .5, .75)):
+    """Returns descriptive statistics of sketched timings.
+
+    The table is laid out like :meth:`pandas.DataFrame.describe` lays
+    out timings, with a column per function, but the percentiles are
+    estimated.
+    """
+    index = ["count", "mean", "std", "min"]
+    index.extend("{:g}%".format(p * 100) for p in percentiles)
+    index.append("max")
+    return pd.DataFrame(
+        {
+            name: [sketch.count, sketch.mean, sketch.std, sketch.min]
+            + list(sketch.quantile(np.asarray(percentiles)))
+            + [sketch.max]
+            for name, sketch in sketches.items()
+        },
+        index=index,
+        columns=sketches.index,
+    )
+
+
 def _cumulative_quantiles(group, rng):
     group = isolate(group)
     t = timings(group)
@@ -160,11 +666,26 @@ def cumulative_quantiles(samples, rng=None):
 
 
 def cumulative_quantiles_plot(
-    samples, plot_width=960, plot_height=480, show_samples=True
+    samples, plot_width=960, plot_height=480, show_samples=True, unit=None
 ):
     """Plots the cumulative quantiles along with a scatter plot of
-    observations."""
+    observations.
+
+    Timings are shown in ``unit`` (one of :data:`UNITS`), which is
+    picked automatically by default, and time in seconds.
+    """
+    # Imported here so the rest of this module works without Bokeh.
+    import bokeh.io as bi
+    import bokeh.models as bm
+    import bokeh.plotting as bp
+
+    from perfume import colors
+
+    if unit is None:
+        unit = pick_unit(timings(samples))
     plot = bp.figure(plot_width=960, plot_height=480)
+    plot.xaxis.axis_label = "seconds"
+    plot.yaxis.axis_label = unit
 
     names = samples.columns.levels[0]
     _colors = {
@@ -175,7 +696,8 @@ def cumulative_quantiles_plot(
         name = group.columns[0][0]
         color = _colors[name]
         group.columns = group.columns.droplevel(0)
-        group = group.dropna()
+        group = in_unit(group.dropna(), unit)
+        group.index = in_unit(group.index, "s")
         quantile_source = bm.ColumnDataSource(
             pd.DataFrame(
                 data={"lower": group["25%"], "upper": group["75%"]},
@@ -224,7 +746,9 @@ def cumulative_quantiles_plot(
             name = group.columns[0][0]
             color = _colors[name]
             group = isolate(group)
-            t = timings(group).set_index(group.iloc[:, 1])
+            t = in_unit(timings(group), unit).set_index(
+                in_unit(group.iloc[:, 1], "s")
+            )
             t.index.name = "time"
             t.columns = ["value"]
             source = bm.ColumnDataSource(t.reset_index())
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.cli` runs benchmarks from the command line.
+
+The ``perfume`` command benchmarks functions defined in a Python
+module with :func:`perfume.bench`, without Jupyter, Bokeh or IPython.
+While it runs, a :class:`TerminalDisplay` keeps a compact summary up
+to date on stderr, and when it stops, the final summary is printed to
+stdout and the raw samples can be saved to a file for analysis
+elsewhere.
+"""
+
+import argparse
+import functools
+import importlib
+import inspect
+import os
+import sys
+import time
+
+import pandas as pd
+
+from perfume import analyze
+from perfume.aggregate import Aggregate
+from perfume.collect import Timer
+from perfume.histogram import FunctionHistograms
+from perfume.perfume import bench
+
+#: Quantiles of latency shown in summaries.
+QUANTILES = (0.5, 0.9, 0.99)
+
+#: Formats samples can be saved in, by file extension.
+FORMATS = {".csv": "to_csv", ".pkl": "to_pickle", ".pickle": "to_pickle"}
+
+
+def summarize(samples, histograms=None):
+    """Summarizes each function's samples in a table.
+
+    If ``histograms`` (a
+    :class:`~perfume.histogram.FunctionHistograms`) are given, they
+    have recorded ``samples``, and the latencies are read from them
+    instead, to the histograms' precision.
+
+    Returns
+    -------
+    (pandas.DataFrame, str)
+        The table, indexed by function, with the number of samples,
+        :data:`QUANTILES` and the maximum of the latency, and calls
+        per second, and the unit latencies are in.
+    """
+    if histograms is not None:
+        names = histograms.names
+        ret = pd.DataFrame({"samples": histograms.counts}, index=names)
+        for q in QUANTILES:
+            ret["p{:g}".format(q * 100)] = [
+                histogram.quantile(q) for histogram in histograms.histograms
+            ]
+        ret["max"] = [
+            histogram.max for histogram in histograms.histograms
+        ]
+        unit = analyze.pick_unit(ret["p50"])
+        ret.iloc[:, 1:] = analyze.in_unit(ret.iloc[:, 1:].astype(float), unit)
+    else:
+        t = analyze.timings(samples)
+        unit = analyze.pick_unit(t)
+        latency = analyze.in_unit(t, unit)
+        ret = pd.DataFrame({"samples": t.count()})
+        for q in QUANTILES:
+            ret["p{:g}".format(q * 100)] = latency.quantile(q)
+        ret["max"] = latency.max()
+    ret["busy calls/s"] = analyze.throughput(samples)
+    return ret, unit
+
+
+def _format(table, unit):
+    return "latency in {}\n{}".format(
+        unit, table.to_string(float_format="{:.4g}".format)
+    )
+
+
+class TerminalDisplay(object):
+    """Prints a compact summary of samples while benchmarking.
+
+    Takes the place of :class:`perfume.display.Display` for
+    :func:`perfume.bench`.  The summary is printed at most every
+    ``interval`` seconds.  On a terminal, each summary replaces the
+    last one, and otherwise they are printed one after another, as a
+    log.
+
+    Parameters
+    ----------
+    names, initial_size, calibration, parallelism, memory, samples, aggregate
+        As for :class:`perfume.display.Display`.  Like it, the summary
+        is kept in histograms that only read new samples, or in the
+        ``aggregate``'s.
+    stream : file
+        Where to print, by default :data:`sys.stderr`.
+    interval : float
+        Least number of seconds between summaries.
+    """
+
+    def __init__(
+        self,
+        names,
+        initial_size,
+        calibration=None,
+        parallelism=1,
+        memory=None,
+        samples=None,
+        aggregate=None,
+        stream=None,
+        interval=1.0,
+    ):
+        self._initial_size = initial_size
+        self._aggregate = aggregate
+        self._histograms = aggregate
+        if aggregate is None:
+            self._histograms = FunctionHistograms()
+            if samples is not None:
+                self._histograms.update_frame(samples)
+        self._calibration = calibration
+        self._stream = sys.stderr if stream is None else stream
+        self._interval = interval
+        self._start = time.perf_counter()
+        self._last = self._start
+        self._lines = 0
+        self._elapsed_rendering_seconds = 0.0
+
+    def elapsed_rendering_ratio(self):
+        elapsed = time.perf_counter() - self._start
+        return self._elapsed_rendering_seconds / elapsed
+
+    def update(self, samples):
+        now = time.perf_counter()
+        if now - self._last < self._interval:
+            return
+
+        self._last = now
+        with Timer() as timer:
+            elapsed = now - self._start
+            num_samples = len(samples.index)
+            if num_samples:
+                # Rows are numbered from the first sample still in
+                # memory.
+                num_samples += samples.index[0]
+            title = (
+                "{} samples, {:.1f} sec elapsed, {:.1f} samples/sec"
+            ).format(
+                num_samples,
+                elapsed,
+                (num_samples - self._initial_size) / elapsed,
+            )
+            if self._calibration is not None:
+                title += ", {}".format(self._calibration)
+            if self._aggregate is None:
+                self._histograms.update_frame(samples)
+            table = summarize(samples, self._histograms)
+            text = "{}\n{}\n".format(title, _format(*table))
+            if self._lines and self._stream.isatty():
+                # Move back up over the last summary and clear it.
+                self._stream.write("\x1b[{}F\x1b[J".format(self._lines))
+            self._stream.write(text)
+            self._stream.flush()
+            self._lines = text.count("\n")
+        self._elapsed_rendering_seconds += timer.elapsed_seconds()
+
+
+def load_functions(module, names=None, prefix="bench_"):
+    """Finds functions to benchmark in a module.
+
+    Parameters
+    ----------
+    module : str
+        Path to a Python file, or name of a module to import.  Either
+        way, the module is imported by name, with its directory (or
+        the current one) first on :data:`sys.path`, so worker
+        processes can import it too.
+    names : list of str
+        Names of the functions to benchmark.  By default, every
+        function defined in the module whose name starts with
+        ``prefix``, in the order they're defined.
+    prefix : str
+        Prefix of the names of the functions to find by default.
+
+    Returns
+    -------
+    (module, list of callable)
+        The module and the functions found.
+    """
+    if module.endswith(".py") or os.path.sep in module:
+        path = os.path.abspath(module)
+        directory, filename = os.path.split(path)
+        module = os.path.splitext(filename)[0]
+    else:
+        directory = os.getcwd()
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    module = importlib.import_module(module)
+
+    if names:
+        missing = [name for name in names if not hasattr(module, name)]
+        if missing:
+            raise ValueError(
+                "No {} in {}".format(", ".join(missing), module.__name__)
+            )
+
+        return module, [getattr(module, name) for name in names]
+
+    fns = [
+        fn
+        for name, fn in vars(module).items()
+        if name.startswith(prefix)
+        and inspect.isfunction(fn)
+        and fn.__module__ == module.__name__
+    ]
+    if not fns:
+        raise ValueError(
+            "No functions named {}* in {}".format(prefix, module.__name__)
+        )
+
+    return module, fns
+
+
+def save(samples, path):
+    """Saves samples to ``path``, in the format its extension names.
+
+    See :data:`FORMATS`.  A CSV file has two header rows, and can be
+    read back with ``pandas.read_csv(path, header=[0, 1],
+    index_col=0)``.
+    """
+    getattr(samples, FORMATS[os.path.splitext(path)[1]])(path)
+
+
+def _batch(value):
+    return value if value == "auto" else int(value)
+
+
+def parser():
+    """Builds the :class:`argparse.ArgumentParser` for :func:`main`."""
+    ret = argparse.ArgumentParser(
+        prog="perfume",
+        description=(
+            "Benchmark functions from a Python module, until interrupted "
+            "or a stop condition is met."
+        ),
+    )
+    ret.add_argument(
+        "module", help="path to a Python file, or name of a module"
+    )
+    ret.add_argument(
+        "functions",
+        nargs="*",
+        metavar="function",
+        help="functions to benchmark (default: every bench_* function)",
+    )
+    stops = ret.add_argument_group("stop conditions")
+    stops.add_argument(
+        "--max-samples", type=int, help="stop after this many per function"
+    )
+    stops.add_argument(
+        "--max-seconds", type=float, help="stop after this many seconds"
+    )
+    stops.add_argument(
+        "--converge",
+        nargs=2,
+        type=float,
+        metavar=("QUANTILE", "REL_TOL"),
+        help="stop once every function's quantile is this precise",
+    )
+    collection = ret.add_argument_group("collection")
+    collection.add_argument(
+        "--setup", help="function whose result is passed to each call"
+    )
+    collection.add_argument(
+        "--teardown", help="function called with setup's result after"
+    )
+    collection.add_argument(
+        "--batch", type=_batch, help="calls per sample, or 'auto'"
+    )
+    collection.add_argument(
+        "--processes", type=int, help="worker processes per function"
+    )
+    collection.add_argument(
+        "--cpus", action="store_true", help="pin each worker to a core"
+    )
+    collection.add_argument(
+        "--threads", type=int, help="threads calling each function"
+    )
+    collection.add_argument(
+        "--rate", type=float, help="calls to start per second"
+    )
+    collection.add_argument(
+        "--arrivals", choices=("constant", "poisson"), default="constant"
+    )
+    collection.add_argument("--gc", choices=("disable", "record"))
+    collection.add_argument("--allocation", choices=("quantile", "ks"))
+    collection.add_argument(
+        "--order",
+        choices=("fixed", "shuffle", "latin", "blocked"),
+        default="fixed",
+    )
+    collection.add_argument(
+        "--warmup", action="store_true", help="flag warm-up samples"
+    )
+    collection.add_argument("--memory", choices=("tracemalloc", "blocks"))
+    collection.add_argument(
+        "--cpu-time", action="store_true", help="record CPU time"
+    )
+    collection.add_argument(
+        "--rusage", action="store_true", help="record OS counters"
+    )
+    collection.add_argument(
+        "--no-calibrate",
+        dest="calibrate",
+        action="store_false",
+        help="don't measure the timer first",
+    )
+    output = ret.add_argument_group("output")
+    output.add_argument(
+        "-o",
+        "--output",
+        help="save samples here ({})".format(", ".join(sorted(FORMATS))),
+    )
+    output.add_argument(
+        "--store", help="directory to stream samples into as they come"
+    )
+    output.add_argument(
+        "--aggregate",
+        type=float,
+        metavar="WINDOW_SECONDS",
+        help="keep histograms per time window instead of every sample",
+    )
+    output.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds between live summaries",
+    )
+    output.add_argument(
+        "-q", "--quiet", action="store_true", help="no live summary"
+    )
+    return ret
+
+
+def main(argv=None):
+    """Runs the ``perfume`` command."""
+    parser_ = parser()
+    args = parser_.parse_args(argv)
+    if (
+        args.output is not None
+        and os.path.splitext(args.output)[1] not in FORMATS
+    ):
+        parser_.error(
+            "Can't save samples as {!r}, use one of: {}".format(
+                args.output, ", ".join(sorted(FORMATS))
+            )
+        )
+
+    try:
+        _, fns = load_functions(args.module, args.functions)
+        setup, teardown = (
+            None if name is None else load_functions(args.module, [name])[1][0]
+            for name in (args.setup, args.teardown)
+        )
+    except (ImportError, ValueError) as e:
+        parser_.error(str(e))
+
+    aggregate = None
+    if args.aggregate is not None:
+        aggregate = Aggregate(window_seconds=args.aggregate)
+    if args.quiet:
+        display = functools.partial(TerminalDisplay, interval=float("inf"))
+    else:
+        display = functools.partial(TerminalDisplay, interval=args.interval)
+    try:
+        samples = bench(
+            *fns,
+            calibrate=args.calibrate,
+            processes=args.processes,
+            cpus=args.cpus,
+            threads=args.threads,
+            rate=args.rate,
+            arrivals=args.arrivals,
+            batch=args.batch,
+            gc=args.gc,
+            max_samples=args.max_samples,
+            max_seconds=args.max_seconds,
+            converge=args.converge,
+            allocation=args.allocation,
+            order=args.order,
+            warmup=args.warmup,
+            setup=setup,
+            teardown=teardown,
+            memory=args.memory,
+            cpu_time=args.cpu_time,
+            rusage=args.rusage,
+            display=display,
+            store=args.store,
+            aggregate=aggregate,
+        )
+    except ValueError as e:
+        # Options that don't go together, or a store already in use.
+        parser_.error(str(e))
+
+    if args.output is not None:
+        save(samples, args.output)
+    if aggregate is None:
+        print(_format(*summarize(samples)))
+    else:
+        table, unit = summarize(samples, aggregate)
+        print(_format(table, unit))
+        p99 = analyze.in_unit(aggregate.quantiles(0.99), unit)
+        print(
+            "p99 by window, in {}\n{}".format(
+                unit, p99.to_string(float_format="{:.4g}".format)
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,685 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.collect` runs functions under test and records samples.
+
+Nothing in here depends on Bokeh or IPython, so it can drive
+benchmarks outside of a notebook too.
+"""
+
+import gc
+import itertools
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+class Timer(object):
+    """Context manager recording integer nanosecond timestamps.
+
+    Uses :func:`time.perf_counter_ns`, so no precision is lost to
+    floating point no matter how long the host has been up.
+    """
+
+    def __enter__(self):
+        self._begin = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._end = time.perf_counter_ns()
+
+    @property
+    def begin(self):
+        return self._begin
+
+    @property
+    def end(self):
+        return self._end
+
+    def elapsed_ns(self):
+        return self.end - self.begin
+
+    def elapsed_seconds(self):
+        return self.elapsed_ns() / 1e9
+
+    @classmethod
+    def time(cls, fn, *args, **kwargs):
+        with cls() as timer:
+            fn(*args, **kwargs)
+        return timer.elapsed_seconds()
+
+
+class Calibration(object):
+    """Cost and resolution of a :class:`Timer` on this machine.
+
+    Parameters
+    ----------
+    overhead_ns : numpy.ndarray
+        Nanoseconds measured by empty :class:`Timer` blocks.
+    resolution_ns : float
+        Resolution of the clock, from :func:`time.get_clock_info`.
+    """
+
+    def __init__(self, overhead_ns, resolution_ns):
+        self.overhead_ns = np.asarray(overhead_ns, dtype=np.int64)
+        self.resolution_ns = resolution_ns
+
+    @classmethod
+    def measure(cls, count=10000, warmup=1000):
+        """Times ``count`` empty :class:`Timer` blocks."""
+        overhead_ns = np.empty(count, dtype=np.int64)
+        for _ in range(warmup):
+            with Timer():
+                pass
+        for i in range(count):
+            with Timer() as timer:
+                pass
+            overhead_ns[i] = timer.elapsed_ns()
+        resolution = time.get_clock_info("perf_counter").resolution
+        return cls(overhead_ns, resolution * 1e9)
+
+    @property
+    def median_overhead_ns(self):
+        return int(np.median(self.overhead_ns))
+
+    def __str__(self):
+        return "timer overhead {} ns, resolution {:g} ns".format(
+            self.median_overhead_ns, self.resolution_ns
+        )
+
+
+class Autorange(object):
+    """Picks how many back-to-back calls to time in each sample.
+
+    Like :meth:`timeit.Timer.autorange`, but continuous: it keeps a
+    moving average of the latency of one call, and picks a power of
+    two number of calls that take at least ``target_ns`` together.
+    The count only changes when a batch drifts out of
+    :math:`[target / 2, 4 \\cdot target)`, so it stays put while the
+    function's speed is steady.
+
+    Parameters
+    ----------
+    target_ns : int
+        Shortest duration to aim for, for one timed batch.
+    alpha : float
+        Weight of each new observation in the moving average.
+    """
+
+    def __init__(self, target_ns=10000, alpha=0.1):
+        self.target_ns = target_ns
+        self.batch = 1
+        self._alpha = alpha
+        self._per_call_ns = None
+
+    def calibrate(self, fn):
+        """Grows the batch until it takes at least ``target_ns``."""
+        while True:
+            elapsed_ns = time_batch(fn, self.batch)
+            if elapsed_ns >= self.target_ns:
+                self._per_call_ns = elapsed_ns / self.batch
+                return self.batch
+
+            self.batch *= 2
+
+    def observe(self, elapsed_ns, batch):
+        """Records how long a batch took, and adjusts the batch size."""
+        per_call_ns = elapsed_ns / batch
+        if self._per_call_ns is None:
+            self._per_call_ns = per_call_ns
+        else:
+            self._per_call_ns += self._alpha * (
+                per_call_ns - self._per_call_ns
+            )
+        expected_ns = self.batch * self._per_call_ns
+        if not (self.target_ns / 2 <= expected_ns < 4 * self.target_ns):
+            want = self.target_ns / max(self._per_call_ns, 1)
+            self.batch = 1 << max(0, math.ceil(math.log2(want)))
+        return self.batch
+
+
+class GcRecorder(object):
+    """Records time spent in garbage collection, per generation.
+
+    While installed in :data:`gc.callbacks`, accumulates in
+    :attr:`durations_ns` the nanoseconds spent collecting each
+    generation since the last :meth:`reset`.
+    """
+
+    def __init__(self):
+        self.durations_ns = [0, 0, 0]
+        self._begin = None
+
+    def __call__(self, phase, info):
+        now = time.perf_counter_ns()
+        if phase == "start":
+            self._begin = now
+        elif self._begin is not None:
+            self.durations_ns[info["generation"]] += now - self._begin
+            self._begin = None
+
+    def reset(self):
+        self.durations_ns[:] = (0, 0, 0)
+
+    def install(self):
+        gc.callbacks.append(self)
+
+    def uninstall(self):
+        gc.callbacks.remove(self)
+
+
+class Probe(object):
+    """Base class for extra measurements taken around each timed call.
+
+    A :class:`Collector` calls :meth:`before` just before timing each
+    sample and :meth:`after` just after, and records the values
+    :meth:`after` returns in the probe's :attr:`fields`.
+    """
+
+    #: Names of the fields the probe records.
+    fields = ()
+
+    def before(self):
+        pass
+
+    def after(self):
+        return ()
+
+    def close(self):
+        pass
+
+
+class TracemallocProbe(Probe):
+    """Records the peak memory traced by :mod:`tracemalloc` per sample.
+
+    The ``memory`` field gets the most bytes allocated at once during
+    the sample, beyond what was already allocated before it.  Tracing
+    is started if it isn't already, and slows down allocation a lot.
+    """
+
+    fields = ("memory",)
+
+    def __init__(self):
+        if not hasattr(tracemalloc, "reset_peak"):
+            raise ValueError("Tracing peak memory requires Python 3.9")
+
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        self._current = 0
+
+    def before(self):
+        tracemalloc.reset_peak()
+        self._current = tracemalloc.get_traced_memory()[0]
+
+    def after(self):
+        return (tracemalloc.get_traced_memory()[1] - self._current,)
+
+    def close(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+
+class BlocksProbe(Probe):
+    """Records the net number of memory blocks allocated per sample.
+
+    The ``memory`` field gets the change in
+    :func:`sys.getallocatedblocks`, which is cheap to read, but only
+    counts what's still allocated when the sample ends.  That includes
+    a few blocks the collector itself allocates, the same for every
+    sample, so compare functions to each other or to a no-op.
+    """
+
+    fields = ("memory",)
+
+    def __init__(self):
+        self._blocks = 0
+
+    def before(self):
+        self._blocks = sys.getallocatedblocks()
+
+    def after(self):
+        return (sys.getallocatedblocks() - self._blocks,)
+
+
+class CpuTimeProbe(Probe):
+    """Records CPU time readings around each sample.
+
+    Like ``begin`` and ``end``, the ``thread_begin`` and
+    ``thread_end`` fields get readings of
+    :func:`time.thread_time_ns`, and ``process_begin`` and
+    ``process_end`` of :func:`time.process_time_ns`.  The process's
+    CPU time includes every thread's, not just the one benchmarking.
+    """
+
+    fields = ("thread_begin", "thread_end", "process_begin", "process_end")
+
+    def __init__(self):
+        self._thread = 0
+        self._process = 0
+
+    def before(self):
+        self._process = time.process_time_ns()
+        self._thread = time.thread_time_ns()
+
+    def after(self):
+        thread = time.thread_time_ns()
+        process = time.process_time_ns()
+        return (self._thread, thread, self._process, process)
+
+
+class RusageProbe(Probe):
+    """Records OS counters from :func:`resource.getrusage` per sample.
+
+    Each field gets how much its counter grew during the sample:
+    ``minflt`` and ``majflt`` count minor and major page faults,
+    ``nvcsw`` and ``nivcsw`` voluntary and involuntary context
+    switches, and ``inblock`` and ``oublock`` block reads and writes.
+    An involuntary context switch means the thread was preempted.
+
+    The counters are the calling thread's where the OS keeps them per
+    thread (``RUSAGE_THREAD``, on Linux), and the whole process's
+    elsewhere.
+    """
+
+    fields = ("minflt", "majflt", "nvcsw", "nivcsw", "inblock", "oublock")
+
+    def __init__(self):
+        if resource is None:
+            raise ValueError("getrusage isn't available on this platform")
+
+        self._who = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+        self._before = None
+
+    def before(self):
+        self._before = resource.getrusage(self._who)
+
+    def after(self):
+        usage = resource.getrusage(self._who)
+        before = self._before
+        return (
+            usage.ru_minflt - before.ru_minflt,
+            usage.ru_majflt - before.ru_majflt,
+            usage.ru_nvcsw - before.ru_nvcsw,
+            usage.ru_nivcsw - before.ru_nivcsw,
+            usage.ru_inblock - before.ru_inblock,
+            usage.ru_oublock - before.ru_oublock,
+        )
+
+
+def probes(memory=None, cpu_time=False, rusage=False):
+    """Builds the probes for a :class:`Collector`.
+
+    ``memory`` may be ``"tracemalloc"`` for a :class:`TracemallocProbe`
+    or ``"blocks"`` for a :class:`BlocksProbe`.  If ``rusage``, adds a
+    :class:`RusageProbe`, and if ``cpu_time``, a :class:`CpuTimeProbe`.
+    """
+    ret = []
+    if memory == "tracemalloc":
+        ret.append(TracemallocProbe())
+    elif memory == "blocks":
+        ret.append(BlocksProbe())
+    elif memory is not None:
+        raise ValueError("Unknown memory mode: {!r}".format(memory))
+    if rusage:
+        ret.append(RusageProbe())
+    # Later probes are read closer to the timed call, and CPU time is
+    # most sensitive to the others' overhead.
+    if cpu_time:
+        ret.append(CpuTimeProbe())
+    return ret
+
+
+def collect_due_garbage():
+    """Runs the collection the GC would have run by now, if any.
+
+    Used while the GC is disabled, to keep garbage from piling up
+    between samples.
+    """
+    generation = -1
+    for i, (count, threshold) in enumerate(
+        zip(gc.get_count(), gc.get_threshold())
+    ):
+        if threshold and count > threshold:
+            generation = i
+    if generation >= 0:
+        gc.collect(generation)
+
+
+def time_batch(fn, batch):
+    """Returns how many nanoseconds ``batch`` calls to ``fn`` take."""
+    with Timer() as timer:
+        for _ in itertools.repeat(None, batch):
+            fn()
+    return timer.elapsed_ns()
+
+
+def _with_fixtures(fn, setup, teardown):
+    # Calls fn the way Collector does, for calibration.
+    if setup is None and teardown is None:
+        return fn
+
+    def call():
+        if setup is None:
+            fn()
+            teardown()
+            return
+
+        arg = setup()
+        fn(arg)
+        if teardown is not None:
+            teardown(arg)
+
+    return call
+
+
+def fields(
+    batch=None,
+    worker=False,
+    gc_mode=None,
+    order="fixed",
+    warmup=False,
+    lag=False,
+    intended=False,
+    fixture=False,
+    memory=None,
+    cpu_time=False,
+    rusage=False,
+):
+    """Returns the fields recorded per function in each sample."""
+    ret = ("begin", "end")
+    if batch is not None:
+        ret += ("batch",)
+    if worker:
+        ret += ("worker",)
+    if gc_mode == "record":
+        ret += ("gc0", "gc1", "gc2")
+    if order != "fixed":
+        ret += ("position",)
+    if lag:
+        ret += ("lag",)
+    if intended:
+        ret += ("intended",)
+    if fixture:
+        ret += ("fixture",)
+    if memory is not None:
+        ret += ("memory",)
+    if rusage:
+        ret += RusageProbe.fields
+    if cpu_time:
+        ret += CpuTimeProbe.fields
+    if warmup:
+        ret += ("warmup",)
+    return ret
+
+
+def parse_order(order):
+    """Splits an ordering strategy into its name and block size."""
+    if isinstance(order, tuple):
+        name, block = order
+    else:
+        name, block = order, 10 if order == "blocked" else 1
+    if name not in ("fixed", "shuffle", "latin", "blocked"):
+        raise ValueError("Unknown order: {!r}".format(name))
+
+    if name != "blocked":
+        block = 1
+    return name, block
+
+
+class Collector(object):
+    """Calls functions under test and appends samples to a buffer.
+
+    Parameters
+    ----------
+    fns : list of callable
+        Functions to benchmark.
+    buf : perfume.samples.SampleBuffer
+        Where to record samples, with columns for :func:`fields`.
+    batch : int or "auto"
+        If ``None``, each sample times one call.  If an int, each
+        sample times that many back-to-back calls.  If ``"auto"``,
+        the number of calls is picked and adjusted per function by an
+        :class:`Autorange`.
+    overhead_ns : int
+        If given, subtracted from every sample's ``end``, to remove the
+        cost of the :class:`Timer` itself (see :class:`Calibration`).
+    worker : int
+        Recorded in every sample's ``worker`` column, if ``buf`` has
+        one.
+    gc_mode : str
+        If ``None``, the garbage collector is left alone.  If
+        ``"disable"``, it is disabled during timed calls, and any
+        collections that came due are run between samples.  If
+        ``"record"``, a :class:`GcRecorder` records the nanoseconds
+        spent collecting each generation during each sample, in the
+        ``gc0``, ``gc1`` and ``gc2`` columns.
+    allocation : perfume.allocate.Allocation
+        If given, decides which functions to call each round, and each
+        function's samples are appended independently.  Otherwise,
+        every function is called once per round.
+    order : str or tuple
+        The order functions are called in within each round.
+        ``"fixed"`` always calls them in the order given.
+        ``"shuffle"`` shuffles them every round.  ``"latin"`` rotates
+        them by one every round, so each function takes every
+        position equally often.  ``"blocked"`` calls each function
+        several times in a row (10, or ``k`` with ``("blocked", k)``)
+        before moving on to the next, each call giving its own
+        sample.  Unless ``"fixed"``, each call's index within its
+        round is recorded in the ``position`` column.
+    setups : list of callable
+        If given, one per function (or ``None``), called before each
+        call outside the timed region.  Its return value is passed as
+        the only argument to the function under test, and to the
+        matching teardown.
+    teardowns : list of callable
+        If given, one per function (or ``None``), called after each
+        call outside the timed region.
+    memory : str
+        If given, record memory use per sample in the ``memory``
+        column: ``"tracemalloc"`` records peak bytes allocated (see
+        :class:`TracemallocProbe`), and ``"blocks"`` the net number of
+        blocks allocated (see :class:`BlocksProbe`).
+    cpu_time : bool
+        If true, record thread and process CPU time readings around
+        each sample (see :class:`CpuTimeProbe`).
+    rusage : bool
+        If true, record how much OS counters such as page faults and
+        context switches grew during each sample (see
+        :class:`RusageProbe`).
+
+    Call :meth:`close` when done, to restore the garbage collector and
+    stop any tracing.
+    """
+
+    def __init__(
+        self,
+        fns,
+        buf,
+        batch=None,
+        overhead_ns=0,
+        worker=0,
+        gc_mode=None,
+        allocation=None,
+        order="fixed",
+        setups=None,
+        teardowns=None,
+        memory=None,
+        cpu_time=False,
+        rusage=False,
+    ):
+        if gc_mode not in (None, "disable", "record"):
+            raise ValueError("Unknown gc mode: {!r}".format(gc_mode))
+
+        self._fns = list(fns)
+        self._overhead_ns = overhead_ns
+        self._buf = buf
+        self._allocation = allocation
+        self._order, block = parse_order(order)
+        self._rounds = 0
+        self._random = random.Random()
+        fields = buf.fields
+        self._width = len(fields)
+        self._samples = np.zeros((block, len(buf.columns)), dtype=np.int64)
+        if "worker" in fields:
+            self._samples[:, fields.index("worker")::self._width] = worker
+        if "warmup" in fields:
+            # Samples count as warm-up until a WarmupDetector says
+            # otherwise.
+            self._samples[:, fields.index("warmup")::self._width] = 1
+        self._position_col = (
+            fields.index("position") if "position" in fields else None
+        )
+        self._setups = list(setups or [None] * len(self._fns))
+        self._teardowns = list(teardowns or [None] * len(self._fns))
+        self._fixture_col = (
+            fields.index("fixture") if "fixture" in fields else None
+        )
+        if batch == "auto":
+            self._autoranges = [Autorange() for _ in self._fns]
+            self._batches = [
+                autorange.calibrate(_with_fixtures(fn, setup, teardown))
+                for autorange, fn, setup, teardown in zip(
+                    self._autoranges, self._fns, self._setups, self._teardowns
+                )
+            ]
+        else:
+            self._autoranges = None
+            self._batches = [batch or 1] * len(self._fns)
+        self._batch_col = fields.index("batch") if batch is not None else None
+        self._probes = probes(
+            memory=memory, cpu_time=cpu_time, rusage=rusage
+        )
+        # Read in reverse after the call, so each probe's readings
+        # bracket the ones after it.
+        self._probe_cols = [
+            (probe, fields.index(probe.fields[0]))
+            for probe in reversed(self._probes)
+        ]
+        self._gc_disable = gc_mode == "disable" and gc.isenabled()
+        self._gc_recorder = None
+        if gc_mode == "record":
+            self._gc_col = fields.index("gc0")
+            self._gc_recorder = GcRecorder()
+            self._gc_recorder.install()
+
+    def close(self):
+        if self._gc_recorder is not None:
+            self._gc_recorder.uninstall()
+            self._gc_recorder = None
+        for probe in self._probes:
+            probe.close()
+
+    def _ordered(self, indices):
+        if self._order == "shuffle":
+            indices = list(indices)
+            self._random.shuffle(indices)
+        elif self._order == "latin":
+            indices = list(indices)
+            shift = self._rounds % len(indices) if indices else 0
+            indices = indices[shift:] + indices[:shift]
+        return indices
+
+    def collect(self):
+        """Takes samples of every function chosen for this round."""
+        samples = self._samples
+        recorder = self._gc_recorder
+        if self._allocation is None:
+            indices = range(len(self._fns))
+        else:
+            indices = self._allocation.choose(self._buf)
+        indices = self._ordered(indices)
+        position = 0
+        for i in indices:
+            fn = self._fns[i]
+            col = i * self._width
+            setup = self._setups[i]
+            teardown = self._teardowns[i]
+            for sample in samples:
+                batch = self._batches[i]
+                fixture_ns = 0
+                if setup is not None:
+                    with Timer() as fixture:
+                        args = [
+                            setup() for _ in itertools.repeat(None, batch)
+                        ]
+                    fixture_ns += fixture.elapsed_ns()
+                if self._gc_disable:
+                    gc.disable()
+                elif recorder is not None:
+                    recorder.reset()
+                try:
+                    # Replacing the last timer frees it before probes
+                    # start measuring memory.
+                    timer = Timer()
+                    for probe in self._probes:
+                        probe.before()
+                    if setup is not None:
+                        with timer:
+                            for arg in args:
+                                fn(arg)
+                    elif batch == 1:
+                        with timer:
+                            fn()
+                    else:
+                        with timer:
+                            for _ in itertools.repeat(None, batch):
+                                fn()
+                    for probe, probe_col in self._probe_cols:
+                        probe_col += col
+                        sample[probe_col:probe_col + len(probe.fields)] = (
+                            probe.after()
+                        )
+                    # Before teardown, whose collections aren't the
+                    # sample's.
+                    if recorder is not None:
+                        gc_col = col + self._gc_col
+                        sample[gc_col:gc_col + 3] = recorder.durations_ns
+                finally:
+                    if self._gc_disable:
+                        gc.enable()
+                if teardown is not None:
+                    with Timer() as fixture:
+                        if setup is not None:
+                            for arg in args:
+                                teardown(arg)
+                        else:
+                            for _ in itertools.repeat(None, batch):
+                                teardown()
+                    fixture_ns += fixture.elapsed_ns()
+                if self._fixture_col is not None:
+                    sample[col + self._fixture_col] = fixture_ns
+                sample[col] = timer.begin
+                sample[col + 1] = max(
+                    timer.end - self._overhead_ns, timer.begin
+                )
+                if self._position_col is not None:
+                    sample[col + self._position_col] = position
+                    position += 1
+                if self._batch_col is not None:
+                    sample[col + self._batch_col] = batch
+                    if self._autoranges is not None:
+                        self._batches[i] = self._autoranges[i].observe(
+                            timer.elapsed_ns(), batch
+                        )
+        self._rounds += 1
+        if self._gc_disable:
+            collect_due_garbage()
+        if self._allocation is None:
+            self._buf.extend(samples)
+        else:
+            width = self._width
+            for i in indices:
+                self._buf.extend_function(
+                    i, samples[:, i * width:(i + 1) * width]
+                )
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.display` shows live results in a Jupyter notebook.
+
+A :class:`Display` plots each function's latency distribution with
+Bokeh, and keeps tables of descriptive statistics and pairwise K-S
+tests up to date under it.  This is the only module that needs Bokeh
+and IPython to benchmark, so :mod:`perfume.cli` can run without them.
+"""
+
+import collections
+import contextlib
+import time
+import uuid
+
+from bokeh import io as bi
+from bokeh import layouts as bl
+from bokeh import models as bm
+import bokeh.palettes
+from bokeh import plotting as bp
+from IPython import display as ipdisplay
+import numpy as np
+
+from perfume import analyze
+from perfume import colors
+from perfume.collect import Timer
+from perfume.histogram import FunctionHistograms
+
+
+class Display(object):
+    """Plots and tabulates samples in a notebook as they come in.
+
+    :func:`perfume.bench` calls :meth:`update` with every sample so
+    far whenever it's time to render, and uses
+    :meth:`elapsed_rendering_ratio` to decide when that is.
+
+    The distributions, the table of descriptive statistics and the
+    K-S tests are drawn from histograms (see
+    :class:`perfume.histogram.FunctionHistograms`) that only read the
+    samples new since the last update.  When resuming, ``samples``
+    are the ones collected before, read once up front.  With an
+    ``aggregate`` (see :class:`perfume.aggregate.Aggregate`), its
+    histograms are used instead.
+
+    The density estimates and the bucketed K-S test need raw samples,
+    so they only read a random ``subsample`` of at most that many
+    samples, or the aggregate's reservoir.
+    """
+
+    def __init__(
+        self,
+        names,
+        initial_size,
+        calibration=None,
+        parallelism=1,
+        memory=None,
+        samples=None,
+        aggregate=None,
+        subsample=10000,
+        width=900,
+        height=480,
+    ):
+        # Call this once to raise an error early if necessary:
+        self._colors = colors.colors(len(names))
+        self._calibration = calibration
+        self._parallelism = parallelism
+        self._memory = memory
+
+        self._start = time.perf_counter()
+        self._initial_size = initial_size
+        self._aggregate = aggregate
+        self._subsample = subsample
+        self._rng = np.random.RandomState()
+        self._histograms = aggregate
+        if aggregate is None:
+            self._histograms = FunctionHistograms()
+            if samples is not None:
+                self._histograms.update_frame(samples)
+        self._sources = collections.OrderedDict(
+            [
+                (
+                    name,
+                    {
+                        "hist": bm.ColumnDataSource(
+                            data={"top": [], "left": [], "right": []}
+                        ),
+                        "pdf": bm.ColumnDataSource(data={"x": [], "y": []}),
+                        "stddev": bm.ColumnDataSource(
+                            data={"base": [], "lower": [], "upper": []}
+                        ),
+                        "median": bm.ColumnDataSource(data={"x": [], "y": []}),
+                        "memory": bm.ColumnDataSource(
+                            data={"top": [], "left": [], "right": []}
+                        ),
+                    },
+                )
+                for name in names
+            ]
+        )
+        self._width = width
+        self._height = height
+        self._plot = None
+        self._memory_plot = None
+        self._unit = None
+        self._elapsed_rendering_seconds = 0.0
+        self._describe_widget = ipdisplay.HTML("")
+        self._display_id = str(uuid.uuid1())
+
+    def elapsed_rendering_ratio(self):
+        elapsed = time.perf_counter() - self._start
+        return self._elapsed_rendering_seconds / elapsed
+
+    def initialize_plot(self, title):
+        with Timer() as timer:
+            plot = bp.figure(
+                title=title, plot_width=self._width, plot_height=self._height
+            )
+            plot.xaxis.axis_label = self._unit
+            plot.yaxis.visible = False
+            _colors = iter(self._colors)
+            for name, sources in self._sources.items():
+                color = next(_colors)
+                plot.quad(
+                    top="top",
+                    bottom=0,
+                    left="left",
+                    right="right",
+                    source=sources["hist"],
+                    alpha=0.3,
+                    fill_color=color,
+                    line_color=color,
+                )
+                plot.line(
+                    "x",
+                    "y",
+                    source=sources["pdf"],
+                    legend=name,
+                    alpha=0.5,
+                    line_color=color,
+                    line_width=4,
+                )
+                stddev = bm.Whisker(
+                    base="base",
+                    lower="lower",
+                    upper="upper",
+                    source=sources["stddev"],
+                    dimension="width",
+                    line_alpha=0.7,
+                    line_color=color,
+                    line_width=2,
+                )
+                for head in (stddev.lower_head, stddev.upper_head):
+                    head.line_color = color
+                    head.line_width = 2
+                    head.line_alpha = 0.7
+                plot.add_layout(stddev)
+                median = bm.Whisker(
+                    base="y",
+                    lower="x",
+                    upper="x",
+                    source=sources["median"],
+                    dimension="width",
+                    line_alpha=0.7,
+                    line_color=color,
+                    line_width=2,
+                )
+                for head in (median.lower_head, median.upper_head):
+                    head.line_color = color
+                    head.line_width = 2
+                    head.line_alpha = 0.7
+                plot.add_layout(median)
+
+        self._elapsed_rendering_seconds -= timer.elapsed_seconds()
+        return plot
+
+    def initialize_memory_plot(self, unit):
+        plot = bp.figure(
+            title="Memory use per sample",
+            plot_width=self._width,
+            plot_height=self._height // 2,
+        )
+        plot.xaxis.axis_label = unit
+        plot.yaxis.visible = False
+        for color, (name, sources) in zip(
+            self._colors, self._sources.items()
+        ):
+            plot.quad(
+                top="top",
+                bottom=0,
+                left="left",
+                right="right",
+                source=sources["memory"],
+                alpha=0.3,
+                fill_color=color,
+                line_color=color,
+                legend=name,
+            )
+        return plot
+
+    @staticmethod
+    def _ks_style(s):
+        if np.isnan(s):
+            return "visibility: hidden"
+
+        else:
+            thresholds = [1.22, 1.36, 1.48, 1.63, 1.73, 1.95]
+            cs = list(reversed(bokeh.palettes.RdYlGn[len(thresholds) + 1]))
+            color = cs[np.searchsorted(thresholds, s)]
+            return "background-color: {}".format(color)
+
+    def update(self, samples):
+        # If this is a module-level import, readthedocs fails because
+        # this triggers an import of _tkinter, which isn't built in to
+        # the python that they use.
+        import seaborn as sns
+
+        with Timer() as timer:
+            # Raw samples to estimate densities from.
+            kept = samples
+            if self._aggregate is None:
+                self._histograms.update_frame(samples)
+            else:
+                reservoir = self._aggregate.reservoir_frame()
+                if len(reservoir.index):
+                    kept = reservoir
+            if len(kept.index) > self._subsample:
+                rows = self._rng.randint(len(kept.index), size=self._subsample)
+                kept = kept.iloc[np.unique(rows)]
+            raw_timings = analyze.timings(kept)
+            if self._unit is None:
+                self._unit = analyze.pick_unit(raw_timings)
+            timings = analyze.in_unit(raw_timings, self._unit)
+            bucketed_timings = analyze.in_unit(
+                analyze.bucket_resample_timings(kept), self._unit
+            )
+            described = self._histograms.describe()
+            stats = analyze.in_unit(described, self._unit)
+            stats.loc["count"] = described.loc["count"]
+            lock = contextlib.nullcontext()
+            if self._aggregate is not None:
+                lock = self._aggregate.lock
+            with lock:
+                densities = [h.density() for h in self._histograms.histograms]
+            size = analyze.UNITS[self._unit]
+            for (hist, edges), (name, sources) in zip(
+                densities, self._sources.items()
+            ):
+                array = timings[name].dropna().values
+                x, y = [], []
+                if len(array) > 1:
+                    x, y = sns.distributions._statsmodels_univariate_kde(
+                        array,
+                        "gau",
+                        "scott",
+                        200,
+                        3,
+                        (-np.inf, np.inf),
+                        cumulative=False,
+                    )
+                whisker_height = np.max(y) / 2 if len(y) else 0
+                lower, median, upper = stats[name][["25%", "50%", "75%"]]
+
+                sources["hist"].data = {
+                    "top": hist * size,
+                    "left": edges[:-1] / size,
+                    "right": edges[1:] / size,
+                }
+                sources["pdf"].data = {"x": x, "y": y}
+                sources["stddev"].data = {
+                    "base": [whisker_height],
+                    "lower": [lower],
+                    "upper": [upper],
+                }
+                sources["median"].data = {"x": [median], "y": [whisker_height]}
+
+            memory = None
+            if "memory" in kept.columns.unique(level=1):
+                memory = analyze.memory_use(kept)
+                for name, sources in self._sources.items():
+                    array = memory[name].dropna().values
+                    if len(array):
+                        hist, edges = np.histogram(
+                            array, density=True, bins="auto"
+                        )
+                        sources["memory"].data = {
+                            "top": hist,
+                            "left": edges[:-1],
+                            "right": edges[1:],
+                        }
+
+            caption = "Descriptive Timing Statistics"
+            if self._calibration is not None:
+                too_fast = analyze.near_resolution(
+                    raw_timings, self._calibration.resolution_ns
+                )
+                if too_fast:
+                    caption += " (near timer resolution: {})".format(
+                        ", ".join(too_fast)
+                    )
+            stats.loc["busy calls/s"] = analyze.throughput(samples)
+            describe_html = (
+                stats.style.set_precision(3).set_caption(caption).render()
+            )
+            if len(self._sources) > 1:
+                ks_frame = self._histograms.ks_test()
+                ks_bk_frame = analyze.ks_test(bucketed_timings)
+                ks_html = (
+                    ks_frame.style.applymap(self._ks_style).set_precision(
+                        3
+                    ).set_caption(
+                        "K-S test"
+                    ).render()
+                )
+                ks_bk_html = (
+                    ks_bk_frame.style.applymap(self._ks_style).set_precision(
+                        2
+                    ).set_caption(
+                        "Bucketed K-S test"
+                    ).render()
+                )
+                html = describe_html + ks_html + ks_bk_html
+                self._describe_widget.data = html.replace(
+                    "table", 'table style="display:inline"'
+                )
+            else:
+                self._describe_widget.data = describe_html
+
+            # Setup and teardown are part of running the functions
+            # under test, not overhead.
+            busy = analyze.durations(samples) + analyze.fixture_durations(
+                samples
+            )
+            elapsed = time.perf_counter() - self._start
+            first = samples.index[0] if len(samples.index) else 0
+            num_samples = first + len(samples.index)
+            if first:
+                # Older samples were moved to a store, so measure
+                # efficiency over the time the rest span.
+                span = (
+                    samples.xs("end", axis=1, level=1).max().max()
+                    - samples.xs("begin", axis=1, level=1).min().min()
+                ) / 1e9
+                efficiency = busy.sum().sum() / 1e9 / span
+            else:
+                total_bench_time = busy[self._initial_size:].sum().sum() / 1e9
+                efficiency = total_bench_time / elapsed
+            title = (
+                "{} samples, {:.2f} sec elapsed, {:.2f} samples/sec, "
+                "{:.2f}% efficiency"
+            ).format(
+                num_samples,
+                elapsed,
+                (num_samples - self._initial_size) / elapsed,
+                100. * efficiency / self._parallelism
+            )
+            if self._calibration is not None:
+                title += ", {}".format(self._calibration)
+
+            if self._plot is None:
+                self._plot = self.initialize_plot(title)
+                layout = self._plot
+                if memory is not None:
+                    self._memory_plot = self.initialize_memory_plot(
+                        "blocks (net)"
+                        if self._memory == "blocks"
+                        else "bytes (peak)"
+                    )
+                    layout = bl.column(self._plot, self._memory_plot)
+                bi.show(layout, notebook_handle=True)
+                ipdisplay.display(
+                    self._describe_widget, display_id=self._display_id
+                )
+            else:
+                self._plot.title.text = title
+                bi.push_notebook()
+                ipdisplay.update_display(
+                    self._describe_widget, display_id=self._display_id
+                )
+        self._elapsed_rendering_seconds += timer.elapsed_seconds()
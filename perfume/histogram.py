@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.histogram` contains a bucketed latency histogram.
+
+A :class:`Histogram` summarizes any number of timings in a fixed
+amount of memory, while still answering quantile queries to a chosen
+relative precision, in the style of HdrHistogram.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from perfume import analyze
+
+
+class Histogram(object):
+    """Log-linear histogram of non-negative integer values.
+
+    Values below ``sub_buckets`` (a power of two, at least
+    :math:`2 \\cdot 10^{digits}`) get a bucket each.  Above that, each
+    power of two range is split into ``sub_buckets / 2`` equal
+    buckets, so a bucket is never wider than :math:`10^{-digits}`
+    times the values in it.  Memory grows with the logarithm of the
+    largest value recorded, not with the number of values.
+
+    Exact count, sum, sum of squares, minimum and maximum are kept on
+    the side, so the mean and standard deviation aren't approximated.
+
+    Parameters
+    ----------
+    significant_digits : int
+        Number of significant decimal digits to preserve.
+    """
+
+    def __init__(self, significant_digits=3):
+        self.significant_digits = significant_digits
+        self._magnitude = int(
+            math.ceil(math.log2(2 * 10 ** significant_digits))
+        )
+        self._sub_buckets = 1 << self._magnitude
+        self._half = self._sub_buckets // 2
+        self._counts = np.zeros(self._sub_buckets, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.
+        self.sum_of_squares = 0.
+        self.min = None
+        self.max = None
+
+    def _indices(self, values):
+        # floor(log2(v)) from frexp is exact for values below 2**53,
+        # which covers over 100 days of nanoseconds.
+        exponent = np.frexp(values.astype(np.float64))[1] - 1
+        shift = np.maximum(exponent - (self._magnitude - 1), 0)
+        mantissa = values >> shift
+        return np.where(
+            shift == 0,
+            values,
+            self._sub_buckets + (shift - 1) * self._half + mantissa
+            - self._half,
+        )
+
+    def _lower_bounds(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        shift = np.maximum(
+            (indices - self._sub_buckets) // self._half + 1, 0
+        )
+        mantissa = np.where(
+            shift == 0,
+            indices,
+            indices - self._sub_buckets - (shift - 1) * self._half
+            + self._half,
+        )
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def record(self, values):
+        """Adds an array of values to the histogram."""
+        values = np.asarray(values)
+        if not len(values):
+            return
+
+        if values.dtype.kind == "f":
+            values = np.rint(values)
+        values = np.maximum(values, 0).astype(np.int64)
+        indices = self._indices(values)
+        top = int(indices.max()) + 1
+        if top > len(self._counts):
+            self._counts = np.concatenate(
+                [self._counts, np.zeros(top - len(self._counts), np.int64)]
+            )
+        self._counts += np.bincount(indices, minlength=len(self._counts))
+        self.count += len(values)
+        as_float = values.astype(np.float64)
+        self.sum += as_float.sum()
+        self.sum_of_squares += np.square(as_float).sum()
+        low, high = int(values.min()), int(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other):
+        """Adds all the values recorded in ``other`` to this one."""
+        if other.significant_digits != self.significant_digits:
+            raise ValueError("Can't merge histograms of different precision")
+
+        if not other.count:
+            return
+
+        size = max(len(self._counts), len(other._counts))
+        counts = np.zeros(size, dtype=np.int64)
+        counts[:len(self._counts)] += self._counts
+        counts[:len(other._counts)] += other._counts
+        self._counts = counts
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_of_squares += other.sum_of_squares
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def buckets(self):
+        """Returns the lower bounds, upper bounds and counts of the
+        non-empty buckets."""
+        indices = np.flatnonzero(self._counts)
+        lower, upper = self._lower_bounds(indices)
+        return lower, upper, self._counts[indices]
+
+    def density(self, max_bins=200):
+        """Regroups the buckets into even bins across the values, like
+        :func:`numpy.histogram` with ``density=True``.
+
+        As with ``bins="auto"``, the number of bins is the larger of
+        Sturges' and the Freedman-Diaconis estimators, but at most
+        ``max_bins``.  Each bucket falls in the bin its midpoint does.
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+            The density in each bin, and the bins' edges.
+        """
+        if not self.count:
+            return np.empty(0), np.empty(0)
+
+        lower, upper, counts = self.buckets()
+        midpoints = np.clip((lower + upper - 1) / 2, self.min, self.max)
+        bins = math.log2(self.count) + 1
+        iqr = self.quantile(0.75) - self.quantile(0.25)
+        if iqr > 0:
+            bins = max(
+                bins,
+                (self.max - self.min) * self.count ** (1 / 3) / (2 * iqr),
+            )
+        return np.histogram(
+            midpoints,
+            bins=int(min(math.ceil(bins), max_bins)),
+            range=(self.min, self.max),
+            weights=counts,
+            density=True,
+        )
+
+    def value_at_rank(self, rank, side="mid"):
+        """Returns the value of the ``rank``'th smallest value recorded.
+
+        The value is only known to within its bucket: ``side`` picks
+        the bucket's ``"lower"`` or ``"upper"`` bound, or ``"mid"``.
+        Ranks count from 1.
+        """
+        if not self.count:
+            return np.nan
+
+        rank = min(max(rank, 1), self.count)
+        index = int(np.searchsorted(np.cumsum(self._counts), rank))
+        lower, upper = self._lower_bounds(index)
+        if side == "lower":
+            value = lower
+        elif side == "upper":
+            value = upper - 1
+        else:
+            value = (lower + upper - 1) / 2
+        return min(max(value, self.min), self.max)
+
+    def quantile(self, q, side="mid"):
+        """Returns the ``q``'th quantile of the values recorded."""
+        return self.value_at_rank(int(math.ceil(q * self.count)), side)
+
+    def quantile_interval(self, q, z=1.96):
+        """Returns a confidence interval for the ``q``'th quantile.
+
+        This is the distribution-free interval between the order
+        statistics at ranks :math:`nq \\pm z \\sqrt{nq(1 - q)}`, widened
+        to the bounds of their buckets.  The default ``z`` gives 95%
+        confidence.
+        """
+        n = self.count
+        spread = z * math.sqrt(n * q * (1 - q))
+        low_rank = int(math.floor(n * q - spread))
+        high_rank = int(math.ceil(n * q + spread))
+        return (
+            self.value_at_rank(low_rank, side="lower"),
+            self.value_at_rank(high_rank, side="upper"),
+        )
+
+    def ks_distance(self, other):
+        """Returns the Kolmogorov-Smirnov distance to ``other``.
+
+        This is the largest difference between the two empirical CDFs,
+        compared at bucket boundaries, so it is exact for values
+        rounded to their buckets.
+        """
+        if other.significant_digits != self.significant_digits:
+            raise ValueError("Can't compare histograms of different precision")
+
+        if not self.count or not other.count:
+            return np.nan
+
+        size = max(len(self._counts), len(other._counts))
+        cdfs = []
+        for histogram in (self, other):
+            counts = np.zeros(size, dtype=np.int64)
+            counts[:len(histogram._counts)] = histogram._counts
+            cdfs.append(np.cumsum(counts) / histogram.count)
+        return np.abs(cdfs[0] - cdfs[1]).max()
+
+    def cdf(self, value):
+        """Returns the fraction of values recorded at most ``value``.
+
+        Values sharing a bucket with ``value`` count as smaller.
+        """
+        if not self.count:
+            return np.nan
+
+        index = int(self._indices(np.array([max(int(value), 0)]))[0])
+        return self._counts[:index + 1].sum() / self.count
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        """Sample standard deviation, like :meth:`pandas.Series.std`."""
+        if self.count < 2:
+            return np.nan
+
+        variance = (self.sum_of_squares - self.sum ** 2 / self.count) / (
+            self.count - 1
+        )
+        return math.sqrt(max(variance, 0.))
+
+
+class FunctionHistograms(object):
+    """Keeps a :class:`Histogram` of each function's latencies.
+
+    Each call to :meth:`update` reads only the samples added to the
+    buffer since the last one, and :meth:`update_frame` does the same
+    for frames of samples.  Samples flagged as warm-up (see
+    :mod:`perfume.warmup`) are left out, and while a function's latest
+    sample is still flagged, none of its new samples are read, since
+    they may yet turn out to be steady.
+
+    Parameters
+    ----------
+    significant_digits : int
+        Precision of the histograms.
+    """
+
+    def __init__(self, significant_digits=3):
+        self.significant_digits = significant_digits
+        self.names = None
+        self.histograms = None
+        self.counts = None
+        self._rows = None
+
+    def _start(self, names):
+        if self.histograms is None:
+            self.names = list(names)
+            self.histograms = [
+                Histogram(self.significant_digits) for _ in names
+            ]
+            self.counts = [0] * len(names)
+            self._rows = [0] * len(names)
+
+    def update(self, buf):
+        """Records new samples from a :class:`~perfume.samples.SampleBuffer`.
+
+        Returns the list of histograms, one per function.
+        """
+        self._start(buf.names)
+        warmup = "warmup" in buf.fields
+        for i, histogram in enumerate(self.histograms):
+            timings = buf.function_timings(i, self._rows[i])
+            rows = len(timings)
+            if warmup and rows:
+                flags = buf.function_field(i, "warmup", self._rows[i])[:rows]
+                if flags[-1]:
+                    continue
+                timings = timings[flags == 0]
+            histogram.record(timings)
+            self.counts[i] += len(timings)
+            self._rows[i] += rows
+        return self.histograms
+
+    def update_frame(self, samples):
+        """Records new samples from a frame, as :func:`perfume.bench`
+        returns.
+
+        Samples are told apart by their row number in the index, so
+        successive frames may overlap, and may leave out samples
+        already recorded.  Returns the list of histograms.
+        """
+        self._start(samples.columns.unique(level=0))
+        new = samples.loc[min(self._rows):]
+        if not len(new.index):
+            return self.histograms
+
+        t = analyze.timings(new)
+        flags = analyze.warmup_flags(new)
+        recorded = new.xs("end", axis=1, level=1).notnull()
+        for i, name in enumerate(self.names):
+            rows = recorded[name].loc[self._rows[i]:]
+            rows = rows.index[rows.values]
+            if not len(rows) or flags[name].loc[rows[-1]]:
+                continue
+
+            timings = t[name].loc[rows[0]:rows[-1]].dropna().values
+            self.histograms[i].record(timings)
+            self.counts[i] += len(timings)
+            self._rows[i] = int(rows[-1]) + 1
+        return self.histograms
+
+    def describe(self):
+        """Returns descriptive statistics of each function's latencies.
+
+        See :func:`describe`.
+        """
+        return describe(self.names, self.histograms)
+
+    def ks_test(self):
+        """Runs the Kolmogorov-Smirnov test across functions.
+
+        See :func:`ks_test`.
+        """
+        return ks_test(self.names, self.histograms)
+
+
+def describe(names, histograms):
+    """Returns descriptive statistics of latencies in histograms.
+
+    The table is laid out like :meth:`pandas.DataFrame.describe` lays
+    out timings, with a column per name, but quantiles are only known
+    to the histograms' precision.
+    """
+    return pd.DataFrame(
+        {
+            name: [
+                histogram.count,
+                histogram.mean,
+                histogram.std,
+                np.nan if histogram.min is None else histogram.min,
+                histogram.quantile(0.25),
+                histogram.quantile(0.5),
+                histogram.quantile(0.75),
+                np.nan if histogram.max is None else histogram.max,
+            ]
+            for name, histogram in zip(names, histograms)
+        },
+        index=["count", "mean", "std", "min", "25%", "50%", "75%", "max"],
+        columns=list(names),
+    )
+
+
+def _ks_Z(a, b):
+    n, m = a.count, b.count
+    if not n or not m:
+        return np.nan
+
+    return a.ks_distance(b) / math.sqrt((n + m) / (n * m))
+
+
+def ks_test(names, histograms):
+    """Runs the Kolmogorov-Smirnov test across histograms.
+
+    The table is laid out like :func:`perfume.analyze.ks_test`'s, with
+    the :math:`Z` value of each pair, but :math:`D` is compared at
+    bucket boundaries (see :meth:`Histogram.ks_distance`).
+    """
+    names = list(names)
+    data = {
+        name: (
+            [_ks_Z(histograms[i + 1], histograms[j]) for j in range(i + 1)]
+            + ([np.nan] * (len(names) - 2 - i))
+        )
+        for i, name in enumerate(names[1:])
+    }
+    idx = pd.Index(names[:-1], name="K-S test Z")
+    return pd.DataFrame(data, index=idx, columns=names[1:])
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.load` benchmarks functions under concurrent load.
+
+A function's latency with one caller says little about its latency
+with many.  The drivers here call each function from several threads
+at once, and record every call's begin and end along with the thread
+that made it, so :mod:`perfume.analyze` can report throughput as well
+as latency.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from perfume import collect
+from perfume.samples import SampleBuffer
+
+
+class _LoadThread(threading.Thread):
+    # Keeps what its target raised, for the thread that started it to
+    # re-raise, rather than printing it and carrying on without it.
+
+    def __init__(self, target, args, name):
+        super(_LoadThread, self).__init__(
+            target=target, args=args, name=name, daemon=True
+        )
+        self.error = None
+
+    def run(self):
+        try:
+            super(_LoadThread, self).run()
+        except BaseException as e:
+            self.error = e
+
+
+def _join(threads):
+    # Waits for every thread, then raises the first error among them.
+    for thread in threads:
+        thread.join()
+    for thread in threads:
+        if thread.error is not None:
+            raise thread.error
+
+
+class ClosedLoop(object):
+    """Calls each function from ``threads`` threads in a closed loop.
+
+    Each thread calls the function again as soon as its previous call
+    returns.  Functions take turns: each call to :meth:`collect` loads
+    the next function for ``chunk_seconds``, then appends the samples
+    its threads took, so functions under test never compete with each
+    other.  For functions that hold the GIL, use worker processes
+    instead (see :class:`perfume.workers.WorkerPool`).
+
+    Parameters
+    ----------
+    fns : list of callable
+        Functions to benchmark.
+    buf : perfume.samples.SampleBuffer
+        Where to record samples, with columns for
+        :func:`perfume.collect.fields` including ``worker``.  Samples
+        from thread ``t`` of function ``i`` get worker
+        ``i * threads + t``.
+    threads : int
+        Number of threads calling each function at once.
+    chunk_seconds : float
+        How long each function is loaded per call to :meth:`collect`.
+    options : dict
+        Passed to each thread's :class:`perfume.collect.Collector`.
+    """
+
+    def __init__(self, fns, buf, threads=1, chunk_seconds=0.05, **options):
+        if options.get("gc_mode") is not None:
+            raise ValueError("GC modes are process-wide, so can't be threaded")
+
+        setups = options.pop("setups", None) or [None] * len(fns)
+        teardowns = options.pop("teardowns", None) or [None] * len(fns)
+        self._fns = list(fns)
+        self._buf = buf
+        self._threads = threads
+        self._chunk_seconds = chunk_seconds
+        self._next = 0
+        self._buffers = [
+            [
+                SampleBuffer([name], buf.fields)
+                for _ in range(threads)
+            ]
+            for name in buf.names
+        ]
+        self._collectors = [
+            [
+                collect.Collector(
+                    [fn],
+                    thread_buf,
+                    worker=i * threads + t,
+                    setups=[setups[i]],
+                    teardowns=[teardowns[i]],
+                    **options
+                )
+                for t, thread_buf in enumerate(buffers)
+            ]
+            for i, (fn, buffers) in enumerate(zip(self._fns, self._buffers))
+        ]
+
+    def __len__(self):
+        return self._threads
+
+    @staticmethod
+    def _drive(collector, deadline, start):
+        start.wait()
+        while time.perf_counter() < deadline:
+            collector.collect()
+
+    def collect(self):
+        """Loads the next function for ``chunk_seconds``."""
+        i = self._next
+        self._next = (i + 1) % len(self._fns)
+        start = threading.Event()
+        deadline = time.perf_counter() + self._chunk_seconds
+        threads = [
+            _LoadThread(
+                target=self._drive,
+                args=(collector, deadline, start),
+                name="perfume-load-{}".format(t),
+            )
+            for t, collector in enumerate(self._collectors[i])
+        ]
+        for thread in threads:
+            thread.start()
+        start.set()
+        _join(threads)
+        rows = [thread_buf.view() for thread_buf in self._buffers[i]]
+        self._buf.extend_function(i, np.concatenate(rows))
+        for thread_buf in self._buffers[i]:
+            thread_buf.clear()
+
+
+#: How long before a call is due :class:`OpenLoop` stops sleeping
+#: and spins on the clock instead, since sleeps overshoot.
+SPIN_NS = 200000
+
+
+class _Schedule(object):
+    # Hands out intended start times to a function's threads.  The
+    # schedule runs on across turns, so calls due but not started by
+    # the end of one turn are the first ones started in the next.
+
+    def __init__(self, rate, arrivals, begin_ns, rng):
+        self._interval_ns = 1e9 / rate
+        self._poisson = arrivals == "poisson"
+        self._rng = rng
+        self._next_ns = float(begin_ns)
+        self._lock = threading.Lock()
+
+    def shift(self, ns):
+        # Skips time the function wasn't being loaded, keeping how far
+        # behind it was.
+        with self._lock:
+            self._next_ns += ns
+
+    def next(self, end_ns):
+        with self._lock:
+            intended = self._next_ns
+            if intended >= end_ns:
+                return None
+
+            if self._poisson:
+                self._next_ns += self._rng.exponential(self._interval_ns)
+            else:
+                self._next_ns += self._interval_ns
+            return int(intended)
+
+
+class OpenLoop(object):
+    """Starts calls to each function at a fixed rate, in an open loop.
+
+    Unlike a :class:`ClosedLoop`, calls are started on a schedule
+    rather than when the previous call returns, so a slow call doesn't
+    hold back the ones after it.  If every thread is busy when a call
+    is due, the call starts late, and since each sample records when
+    the call was ``intended`` to start, the time spent waiting counts
+    towards its latency, as it would for a real client.  This corrects
+    for coordinated omission.
+
+    Like a :class:`ClosedLoop`, functions take turns: each call to
+    :meth:`collect` starts calls to the next function for
+    ``chunk_seconds``, and waits for the calls in flight to finish.
+    Each function's schedule carries on from one turn to its next, as
+    if the time in between hadn't passed, so calls that were due but
+    not yet started when its turn ended are started first, just as
+    late, and a function that can't keep up falls further and further
+    behind.
+
+    Threads sleep until shortly before each call is due, then spin on
+    the clock (see :data:`SPIN_NS`), so that a late wake-up isn't
+    counted as latency.
+
+    Parameters
+    ----------
+    fns : list of callable
+        Functions to benchmark.
+    buf : perfume.samples.SampleBuffer
+        Where to record samples, with columns for
+        :func:`perfume.collect.fields` including ``worker`` and
+        ``intended``.
+    rate : float
+        Calls to start per second.
+    arrivals : str
+        ``"constant"`` starts calls at even intervals, and
+        ``"poisson"`` at exponentially distributed ones, with the same
+        mean.
+    threads : int
+        Number of threads making calls, so the most calls in flight
+        at once.
+    overhead_ns : int
+        If given, subtracted from every sample's ``end``.
+    chunk_seconds : float
+        How long each function is loaded per call to :meth:`collect`.
+    setups, teardowns : list of callable
+        As for :class:`perfume.collect.Collector`.  Each setup runs
+        before its thread waits for the call to be due, so it only
+        delays the call if it takes longer than the wait.
+    """
+
+    def __init__(
+        self,
+        fns,
+        buf,
+        rate,
+        arrivals="constant",
+        threads=1,
+        overhead_ns=0,
+        chunk_seconds=0.05,
+        setups=None,
+        teardowns=None,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        if arrivals not in ("constant", "poisson"):
+            raise ValueError("Unknown arrivals: {!r}".format(arrivals))
+
+        self._fns = list(fns)
+        self._buf = buf
+        self._rate = rate
+        self._arrivals = arrivals
+        self._threads = threads
+        self._overhead_ns = overhead_ns
+        self._chunk_ns = int(chunk_seconds * 1e9)
+        self._rng = np.random.RandomState()
+        self._next = 0
+        # Each function's schedule, and when its last turn ended.
+        self._schedules = [None] * len(self._fns)
+        self._paused_ns = [None] * len(self._fns)
+        fields = buf.fields
+        self._width = len(fields)
+        self._worker_col = fields.index("worker")
+        self._intended_col = fields.index("intended")
+        self._warmup = "warmup" in fields
+        self._setups = list(setups or [None] * len(self._fns))
+        self._teardowns = list(teardowns or [None] * len(self._fns))
+        self._fixture_col = (
+            fields.index("fixture") if "fixture" in fields else None
+        )
+
+    def __len__(self):
+        return self._threads
+
+    def _drive(self, i, schedule, end_ns, worker, rows):
+        fn = self._fns[i]
+        setup = self._setups[i]
+        teardown = self._teardowns[i]
+        sample = np.zeros(self._width, dtype=np.int64)
+        sample[self._worker_col] = worker
+        if self._warmup:
+            sample[self._buf.fields.index("warmup")] = 1
+        while time.perf_counter_ns() < end_ns:
+            # Calls due later, or not started by the end of this turn,
+            # are left for the next one.
+            intended = schedule.next(end_ns)
+            if intended is None:
+                return
+
+            fixture_ns = 0
+            if setup is not None:
+                with collect.Timer() as fixture:
+                    arg = setup()
+                fixture_ns += fixture.elapsed_ns()
+            delay = intended - SPIN_NS - time.perf_counter_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+            while time.perf_counter_ns() < intended:
+                pass
+            if setup is not None:
+                with collect.Timer() as timer:
+                    fn(arg)
+            else:
+                with collect.Timer() as timer:
+                    fn()
+            if teardown is not None:
+                with collect.Timer() as fixture:
+                    if setup is not None:
+                        teardown(arg)
+                    else:
+                        teardown()
+                fixture_ns += fixture.elapsed_ns()
+            if self._fixture_col is not None:
+                sample[self._fixture_col] = fixture_ns
+            sample[0] = timer.begin
+            sample[1] = max(timer.end - self._overhead_ns, timer.begin)
+            sample[self._intended_col] = intended
+            rows.append(sample.copy())
+
+    def collect(self):
+        """Loads the next function for ``chunk_seconds``."""
+        i = self._next
+        self._next = (i + 1) % len(self._fns)
+        begin = time.perf_counter_ns()
+        schedule = self._schedules[i]
+        if schedule is None:
+            schedule = _Schedule(self._rate, self._arrivals, begin, self._rng)
+            self._schedules[i] = schedule
+        else:
+            schedule.shift(begin - self._paused_ns[i])
+        rows = [[] for _ in range(self._threads)]
+        threads = [
+            _LoadThread(
+                target=self._drive,
+                args=(
+                    i,
+                    schedule,
+                    begin + self._chunk_ns,
+                    i * self._threads + t,
+                    rows[t],
+                ),
+                name="perfume-load-{}".format(t),
+            )
+            for t in range(self._threads)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            _join(threads)
+        finally:
+            self._paused_ns[i] = time.perf_counter_ns()
+        rows = [row for thread_rows in rows for row in thread_rows]
+        if rows:
+            rows.sort(key=lambda row: row[self._intended_col])
+            self._buf.extend_function(i, np.array(rows))
@@ -2,275 +2,497 @@
 
 """Main module."""
 
-import collections
+import functools
+import inspect
+import threading
 import time
-import uuid
-
-from bokeh import io as bi
-from bokeh import models as bm
-import bokeh.palettes
-from bokeh import plotting as bp
-from IPython import display as ipdisplay
-import numpy as np
+
 import pandas as pd
 
-from perfume import analyze
-from perfume import colors
-
-
-class Timer(object):
-
-    def __enter__(self):
-        self._begin = time.perf_counter()
-        return self
-
-    def __exit__(self, *exc_info):
-        self._end = time.perf_counter()
-
-    @property
-    def begin(self):
-        return self._begin
-
-    @property
-    def end(self):
-        return self._end
-
-    def elapsed_seconds(self):
-        return self.end - self.begin
-
-    @classmethod
-    def time(cls, fn, *args, **kwargs):
-        with cls() as timer:
-            fn(*args, **kwargs)
-        return timer.elapsed_seconds()
-
-
-class Display(object):
-
-    def __init__(self, names, initial_size, width=900, height=480):
-        # Call this once to raise an error early if necessary:
-        self._colors = colors.colors(len(names))
-
-        self._start = time.perf_counter()
-        self._initial_size = initial_size
-        self._sources = collections.OrderedDict(
-            [
-                (
-                    name,
-                    {
-                        "hist": bm.ColumnDataSource(
-                            data={"top": [], "left": [], "right": []}
-                        ),
-                        "pdf": bm.ColumnDataSource(data={"x": [], "y": []}),
-                        "stddev": bm.ColumnDataSource(
-                            data={"base": [], "lower": [], "upper": []}
-                        ),
-                        "median": bm.ColumnDataSource(data={"x": [], "y": []}),
-                    },
-                )
-                for name in names
-            ]
+from perfume import aio
+from perfume import allocate
+from perfume import collect
+from perfume import load
+from perfume import stop
+from perfume import workers
+from perfume.collect import Timer
+from perfume.samples import SampleBuffer
+from perfume.store import SampleStore
+from perfume.warmup import detector as warmup_detector
+
+
+def __getattr__(name):
+    # Display used to live here, but importing it needs Bokeh and
+    # IPython, so only do that for code that still asks for it.
+    if name == "Display":
+        from perfume.display import Display
+
+        return Display
+
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
+
+
+class RenderThread(threading.Thread):
+    """Updates a :class:`Display` from snapshots of a sample buffer.
+
+    Used by :func:`bench` with ``render="thread"``, so that the
+    benchmark loop never waits on analysis or Bokeh.  After each
+    update, the thread sleeps long enough that it spends at most
+    :math:`1 - efficiency` of its time rendering.
+    """
+
+    def __init__(self, disp, buf, efficiency, min_interval=0.1):
+        super(RenderThread, self).__init__(name="perfume-render", daemon=True)
+        self._disp = disp
+        self._buf = buf
+        self._efficiency = efficiency
+        self._min_interval = min_interval
+        self._stopped = threading.Event()
+        # Held while taking a frame, so the buffer isn't discarding
+        # samples at the same time.
+        self.lock = threading.Lock()
+        self.error = None
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                pause = self._min_interval
+                if len(self._buf) > 10:
+                    with Timer() as timer:
+                        with self.lock:
+                            samples = self._buf.frame()
+                        self._disp.update(samples)
+                    pause = max(
+                        pause,
+                        timer.elapsed_seconds()
+                        * self._efficiency
+                        / (1. - self._efficiency),
+                    )
+                self._stopped.wait(pause)
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+class _Session(object):
+    """Shows results and checks when to stop, between steps of
+    :func:`bench` and :func:`bench_async`."""
+
+    def __init__(
+        self,
+        buf,
+        calibration,
+        efficiency,
+        render,
+        parallelism,
+        max_samples,
+        max_seconds,
+        converge,
+        warmup,
+        memory=None,
+        display=None,
+        aggregate=None,
+    ):
+        if display is None:
+            # Imported here so benchmarking outside a notebook doesn't
+            # need Bokeh or IPython.
+            from perfume.display import Display as display
+
+        self._buf = buf
+        self._efficiency = efficiency
+        self._disp = display(
+            buf.names,
+            len(buf),
+            calibration,
+            parallelism=parallelism,
+            memory=memory,
+            samples=buf.frame() if len(buf) else None,
+            aggregate=aggregate,
         )
-        self._width = width
-        self._height = height
-        self._plot = None
-        self._elapsed_rendering_seconds = 0.0
-        self._describe_widget = ipdisplay.HTML("")
-        self._display_id = str(uuid.uuid1())
-
-    def elapsed_rendering_ratio(self):
-        elapsed = time.perf_counter() - self._start
-        return self._elapsed_rendering_seconds / elapsed
-
-    def initialize_plot(self, title):
-        with Timer() as timer:
-            plot = bp.figure(
-                title=title, plot_width=self._width, plot_height=self._height
+        self._renderer = None
+        if render == "thread":
+            self._renderer = RenderThread(self._disp, buf, efficiency)
+            self._renderer.start()
+        self._detector = warmup_detector(warmup)
+        self._stops = stop.conditions(max_samples, max_seconds, converge)
+        self._max_samples = max_samples
+        self._initial_size = len(buf)
+        self._store = None
+        self._aggregate = aggregate
+        self._seen = 0
+        self._next_drain = 0
+        self._next_drain_time = 0.
+
+    def stream(self, store):
+        """Writes samples to ``store`` from now on."""
+        self._store = store
+
+    def check(self):
+        """Returns whether to stop, rendering first if it's time."""
+        buf = self._buf
+        if self._detector is not None:
+            self._detector(buf)
+        stopped = any(condition(buf) for condition in self._stops)
+
+        if (
+            self._renderer is None
+            and len(buf) > 10
+            and (
+                stopped
+                or self._disp.elapsed_rendering_ratio()
+                < (1. - self._efficiency)
             )
-            plot.xaxis.axis_label = "millis"
-            plot.yaxis.visible = False
-            _colors = iter(self._colors)
-            for name, sources in self._sources.items():
-                color = next(_colors)
-                plot.quad(
-                    top="top",
-                    bottom=0,
-                    left="left",
-                    right="right",
-                    source=sources["hist"],
-                    alpha=0.3,
-                    fill_color=color,
-                    line_color=color,
-                )
-                plot.line(
-                    "x",
-                    "y",
-                    source=sources["pdf"],
-                    legend=name,
-                    alpha=0.5,
-                    line_color=color,
-                    line_width=4,
-                )
-                stddev = bm.Whisker(
-                    base="base",
-                    lower="lower",
-                    upper="upper",
-                    source=sources["stddev"],
-                    dimension="width",
-                    line_alpha=0.7,
-                    line_color=color,
-                    line_width=2,
-                )
-                for head in (stddev.lower_head, stddev.upper_head):
-                    head.line_color = color
-                    head.line_width = 2
-                    head.line_alpha = 0.7
-                plot.add_layout(stddev)
-                median = bm.Whisker(
-                    base="y",
-                    lower="x",
-                    upper="x",
-                    source=sources["median"],
-                    dimension="width",
-                    line_alpha=0.7,
-                    line_color=color,
-                    line_width=2,
-                )
-                for head in (median.lower_head, median.upper_head):
-                    head.line_color = color
-                    head.line_width = 2
-                    head.line_alpha = 0.7
-                plot.add_layout(median)
-
-        self._elapsed_rendering_seconds -= timer.elapsed_seconds()
-        return plot
-
-    @staticmethod
-    def _ks_style(s):
-        if np.isnan(s):
-            return "visibility: hidden"
-
-        else:
-            thresholds = [1.22, 1.36, 1.48, 1.63, 1.73, 1.95]
-            cs = list(reversed(bokeh.palettes.RdYlGn[len(thresholds) + 1]))
-            color = cs[np.searchsorted(thresholds, s)]
-            return "background-color: {}".format(color)
-
-    def update(self, samples):
-        # If this is a module-level import, readthedocs fails because
-        # this triggers an import of _tkinter, which isn't built in to
-        # the python that they use.
-        import seaborn as sns
-
-        with Timer() as timer:
-            timings = analyze.timings(samples)
-            bucketed_timings = analyze.bucket_resample_timings(samples)
-            for name, sources in self._sources.items():
-                array = timings[name].values
-                hist, edges = np.histogram(array, density=True, bins="auto")
-                x, y = sns.distributions._statsmodels_univariate_kde(
-                    array,
-                    "gau",
-                    "scott",
-                    200,
-                    3,
-                    (-np.inf, np.inf),
-                    cumulative=False,
-                )
-                whisker_height = np.max(y) / 2
-                lower, median, upper = np.percentile(array, [25., 50., 75.])
-
-                sources["hist"].data = {
-                    "top": hist, "left": edges[:-1], "right": edges[1:]
-                }
-                sources["pdf"].data = {"x": x, "y": y}
-                sources["stddev"].data = {
-                    "base": [whisker_height],
-                    "lower": [lower],
-                    "upper": [upper],
-                }
-                sources["median"].data = {"x": [median], "y": [whisker_height]}
-
-            describe_html = (
-                timings.describe().style.set_precision(3).set_caption(
-                    "Descriptive Timing Statistics"
-                ).render()
+        ):
+            self._disp.update(buf.frame())
+        # Once stopped, close drains what's left, past max_samples.
+        if (
+            not stopped
+            and (self._store is not None or self._aggregate is not None)
+            and (
+                len(buf) >= self._next_drain
+                or time.perf_counter() >= self._next_drain_time
             )
-            if len(self._sources) > 1:
-                ks_frame = analyze.ks_test(timings)
-                ks_bk_frame = analyze.ks_test(bucketed_timings)
-                ks_html = (
-                    ks_frame.style.applymap(self._ks_style).set_precision(
-                        3
-                    ).set_caption(
-                        "K-S test"
-                    ).render()
-                )
-                ks_bk_html = (
-                    ks_bk_frame.style.applymap(self._ks_style).set_precision(
-                        2
-                    ).set_caption(
-                        "Bucketed K-S test"
-                    ).render()
-                )
-                html = describe_html + ks_html + ks_bk_html
-                self._describe_widget.data = html.replace(
-                    "table", 'table style="display:inline"'
-                )
+        ):
+            self._drain()
+        return stopped
+
+    def _drain(self):
+        # Writes whole chunks to the store, records samples in the
+        # aggregate, and drops samples from memory once both are done
+        # with them and so is every reader, keeping some to display.
+        buf = self._buf
+        store = self._store
+        settled = True
+        if self._detector is not None:
+            settled = None not in self._detector.boundaries
+        done = self._seen
+        keep = 0
+        if store is not None:
+            if self._detector is not None:
+                store.warmup = self._detector.boundaries
+            store.write(buf)
+            keep = store.chunk_rows
+            done = min(done, int(store.sizes.min()))
+        if self._aggregate is not None:
+            self._aggregate.update(buf)
+            keep = max(keep, self._aggregate.recent)
+            done = min(done, min(self._aggregate.rows))
+        done -= keep
+        if done - buf.first >= keep:
+            if self._renderer is not None:
+                with self._renderer.lock:
+                    buf.discard(done - buf.first)
             else:
-                self._describe_widget.data = describe_html
-
-            total_bench_time = timings[self._initial_size:].sum().sum() / 1000.
-            elapsed = time.perf_counter() - self._start
-            num_samples = len(timings.index)
-            title = (
-                "{} samples, {:.2f} sec elapsed, {:.2f} samples/sec, "
-                "{:.2f}% efficiency"
-            ).format(
-                num_samples,
-                elapsed,
-                (num_samples - self._initial_size) / elapsed,
-                100. * total_bench_time / elapsed
-            )
+                buf.discard(done - buf.first)
+        # Samples are only surely seen by the allocation and stop
+        # conditions after the next step, and by the warm-up detector
+        # once every function is steady.
+        self._seen = int(buf.sizes.min()) if settled else 0
+        # Aggregates are drained more often, and at least every
+        # second, so the display's statistics keep up.
+        if self._aggregate is not None:
+            keep = max(keep // 10, 1)
+        self._next_drain = len(buf) + keep
+        self._next_drain_time = time.perf_counter() + 1.
+
+    def close(self):
+        if self._renderer is not None:
+            self._renderer.stop()
+        if self._max_samples is not None:
+            # Steps add samples in chunks, so drop those past
+            # max_samples, but none from before or already stored.
+            size = max(self._max_samples, self._initial_size)
+            if self._store is not None:
+                size = max(size, int(self._store.sizes.max()))
+            self._buf.truncate(size)
+        if self._detector is not None:
+            # Flag whatever the last step added.
+            self._detector(self._buf)
+        if self._store is not None:
+            if self._detector is not None:
+                self._store.warmup = self._detector.boundaries
+            self._store.close(self._buf)
+        if self._aggregate is not None:
+            self._aggregate.update(self._buf)
+        if self._renderer is not None and len(self._buf) > 10:
+            # The thread may have last rendered a while before the end.
+            self._disp.update(self._buf.frame())
+
+    def samples(self):
+        """Returns every sample, from the store if there is one, or
+        the aggregate's reservoir."""
+        if self._store is not None:
+            return self._store.to_frame()
+
+        if self._aggregate is not None:
+            return self._aggregate.reservoir_frame()
+
+        return self._buf.to_frame()
+
+
+def _check_render(render):
+    if render not in ("inline", "thread"):
+        raise ValueError("Unknown render mode: {!r}".format(render))
+
+
+def _buffer(names, fields, samples):
+    # Returns the buffer to collect into, and the store it was read
+    # from, if it can go on streaming samples into it.
+    if samples is None:
+        return SampleBuffer(names, fields), None
+
+    defaults = {"batch": 1, "warmup": 1}
+    if isinstance(samples, pd.DataFrame):
+        return SampleBuffer.from_frame(samples, fields, defaults), None
+
+    if not isinstance(samples, SampleStore):
+        samples = SampleStore.open(samples)
+    if samples.fields != list(fields):
+        return (
+            SampleBuffer.from_frame(samples.to_frame(), fields, defaults),
+            None,
+        )
+
+    return samples.to_buffer(), samples
 
-            if self._plot is None:
-                self._plot = self.initialize_plot(title)
-                bi.show(self._plot, notebook_handle=True)
-                ipdisplay.display(
-                    self._describe_widget, display_id=self._display_id
-                )
-            else:
-                self._plot.title.text = title
-                bi.push_notebook()
-                ipdisplay.update_display(
-                    self._describe_widget, display_id=self._display_id
-                )
-        self._elapsed_rendering_seconds += timer.elapsed_seconds()
 
+def _store(store, buf):
+    if store is None or isinstance(store, SampleStore):
+        ret = store
+    else:
+        ret = SampleStore.create(store, buf.names, buf.fields)
+    if ret is not None and (
+        ret.names != buf.names or ret.fields != buf.fields
+    ):
+        raise ValueError("The store holds different functions or fields")
+
+    return ret
 
-def _flatten(l):
-    return [n for sublist in l for n in sublist]
 
+def _per_function(fixture, fns, name):
+    if fixture is None or callable(fixture):
+        return [fixture] * len(fns)
 
-def bench(*fns, samples=None, efficiency=.9):
+    fixture = list(fixture)
+    if len(fixture) != len(fns):
+        raise ValueError(
+            "Need one {} per function, got {}".format(name, len(fixture))
+        )
+
+    return fixture
+
+
+def _calibrate(calibrate, subtract_overhead):
+    calibration = None
+    overhead_ns = 0
+    if calibrate:
+        calibration = collect.Calibration.measure()
+        if subtract_overhead:
+            overhead_ns = calibration.median_overhead_ns
+    elif subtract_overhead:
+        raise ValueError("subtract_overhead requires calibrate")
+
+    return calibration, overhead_ns
+
+
+def bench(
+    *fns,
+    samples=None,
+    efficiency=.9,
+    batch=None,
+    calibrate=True,
+    subtract_overhead=False,
+    render="inline",
+    processes=None,
+    cpus=None,
+    threads=None,
+    rate=None,
+    arrivals="constant",
+    gc=None,
+    max_samples=None,
+    max_seconds=None,
+    converge=None,
+    allocation=None,
+    order="fixed",
+    warmup=False,
+    setup=None,
+    teardown=None,
+    memory=None,
+    cpu_time=False,
+    rusage=False,
+    display=None,
+    store=None,
+    aggregate=None
+):
     """Benchmarks functions, displaying results in a Jupyter notebook.
 
     Runs ``fns`` repeatedly, collecting timing information, until
-    :exc:`KeyboardInterrupt` is raised, at which point benchmarking
-    stops and the results so far are returned.
+    :exc:`KeyboardInterrupt` is raised or one of the stop conditions
+    given is met, at which point benchmarking stops and the results so
+    far are returned.
 
     Parameters
     ----------
     fns : list of callable
         A list of functions to benchmark and compare
-    samples : pandas.DataFrame
+    samples : pandas.DataFrame, str or perfume.store.SampleStore
         Optionally, pass the results of a previous call to
-        :func:`.bench` to continue from its already collected data.
+        :func:`.bench` to continue from its already collected data, or
+        a store (or its directory) it streamed them into.  They are
+        copied once into the buffer new samples are appended to.  A
+        store collected with the same options goes on receiving new
+        samples too, unless ``store`` is given.
     efficiency : float
         Number between 0 and 1.  Represents the target portion of time
         we aim to spend running the functions under test (so, we spend
         up to :math:`1 - efficiency` time analyzing and rendering
         plots).
+    batch : int or "auto"
+        For functions faster than the timer itself, time several
+        back-to-back calls per sample.  Pass an int to use a fixed
+        number of calls, or ``"auto"`` to pick and keep adjusting the
+        number per function (see :class:`perfume.collect.Autorange`).
+        Samples then get a ``batch`` column recording the number of
+        calls, and :func:`perfume.analyze.timings` reports the latency
+        per call.
+    calibrate : bool
+        Whether to first measure the cost of the timer and the clock's
+        resolution (see :class:`perfume.collect.Calibration`).  These
+        are shown in the plot title, and functions whose median is
+        within 100x of the resolution are flagged.
+    subtract_overhead : bool
+        Whether to subtract the median measured timer overhead from
+        each sample.  Requires ``calibrate``.
+    render : str
+        ``"inline"`` renders between samples, from the benchmark loop.
+        ``"thread"`` renders from a :class:`RenderThread` instead, so
+        the loop only runs the functions and records samples, and the
+        efficiency reported is that of the loop alone.  Rendering
+        still competes for the GIL, so expect some outliers.
+    display : callable
+        Makes what shows results while benchmarking.  Called like
+        :class:`perfume.display.Display`, which plots them in the
+        notebook, and is the default.  :mod:`perfume.cli` passes one
+        that prints a summary to the terminal instead.
+    store : str or perfume.store.SampleStore
+        Directory to stream samples into as they are collected, in
+        chunks (see :class:`perfume.store.SampleStore`), so a crash
+        loses at most the last chunk.  Samples that are safely stored
+        are dropped from memory, keeping a chunk's worth of the most
+        recent ones for the display, so memory stays flat however long
+        the benchmark runs.  The samples returned are read back from
+        the store.
+    aggregate : perfume.aggregate.Aggregate
+        Records latencies in histograms, per function and per time
+        window, instead of keeping every sample in memory.  Once
+        recorded, samples are dropped, except for the most recent ones
+        and a random reservoir of them, which the display plots, while
+        its statistics come from the histograms.  Without a
+        ``store``, the samples returned are the reservoir's, and the
+        aggregate has the quantiles over the whole run.
+    processes : int
+        If given, run each function in this many worker processes of
+        its own (see :class:`perfume.workers.WorkerPool`), instead of
+        taking turns in this one.  Samples then get a ``worker``
+        column, and each function collects samples at its own pace.
+    cpus : bool or list of int
+        With ``processes``, pin each worker process to a dedicated
+        CPU: pass ``True`` to pick them automatically, or a list of
+        CPUs to use.
+    threads : int
+        If given, call each function from this many threads at once,
+        in a closed loop, to see how it behaves under concurrent load
+        (see :class:`perfume.load.ClosedLoop`).  Functions take turns
+        being loaded.  Samples get a ``worker`` column, and the
+        statistics table shows each function's throughput.
+    rate : float
+        If given, start this many calls per second to each function,
+        in an open loop, from ``threads`` threads (or one), instead of
+        calling again whenever a call returns (see
+        :class:`perfume.load.OpenLoop`).  Samples get an ``intended``
+        column with when each call was scheduled to start, and
+        latencies are measured from then, so calls that had to wait
+        for a free thread aren't left out of the tail.
+    arrivals : str
+        With ``rate``, ``"constant"`` spaces calls evenly, and
+        ``"poisson"`` spaces them randomly, as independent clients
+        would.
+    gc : str
+        How to treat the garbage collector.  ``None`` leaves it alone.
+        ``"disable"`` disables it during each timed call, and runs
+        whatever collections came due between samples.  ``"record"``
+        records the nanoseconds spent collecting each generation
+        during each sample, in ``gc0``, ``gc1`` and ``gc2`` columns,
+        so :func:`perfume.analyze.split_gc` can separate samples hit
+        by a collection.
+    max_samples : int
+        Stop once every function has this many samples.
+    max_seconds : float
+        Stop after collecting for this long.
+    converge : tuple of (float, float) or perfume.stop.Converged
+        Stop once the 95% confidence interval of a quantile of every
+        function's latency is narrower than a relative tolerance.  For
+        example, ``(0.99, 0.05)`` waits until every p99 is known to
+        within 5%.
+    allocation : str or perfume.allocate.Allocation
+        Instead of calling every function once per round, call the
+        ones whose results are least certain more often.
+        ``"quantile"`` favors the functions whose median is least
+        certain, and ``"ks"`` those in the least certain pairwise K-S
+        comparisons (see :mod:`perfume.allocate`).  Each function
+        then has its own number of samples.
+    order : str or tuple
+        The order functions are called in each round, to keep one
+        function from always running right after another.
+        ``"fixed"`` keeps the order given, ``"shuffle"`` shuffles it
+        every round, ``"latin"`` rotates it every round, and
+        ``"blocked"`` (or ``("blocked", k)``) calls each function 10
+        (or ``k``) times in a row.  Otherwise, each sample records its
+        call's index within its round in a ``position`` column, and
+        :func:`perfume.analyze.order_effects` tests whether it
+        matters.
+    warmup : bool or perfume.warmup.WarmupDetector
+        If true, detect when each function reaches steady state, and
+        flag the samples before that in a ``warmup`` column.  They are
+        kept in the results, but left out of the live statistics, stop
+        conditions and allocation, and :mod:`perfume.analyze` treats
+        them as missing (see :mod:`perfume.warmup`).
+    setup : callable or list of callable
+        Called before each call, outside the timed region, to prepare
+        fresh input: either one callable for every function, or a
+        list with one (or ``None``) per function.  Its return value is
+        passed to the function under test as its only argument.
+    teardown : callable or list of callable
+        Called after each call, outside the timed region, with the
+        value ``setup`` returned, if any.  Time spent in setup and
+        teardown is recorded in a ``fixture`` column, and counts as
+        time spent benchmarking in the efficiency shown.
+    memory : str
+        Record each sample's memory use in a ``memory`` column, and
+        plot its distribution under the latencies.
+        ``"tracemalloc"`` records the peak bytes allocated during the
+        sample, but slows allocation down a lot.  ``"blocks"`` cheaply
+        records the net change in :func:`sys.getallocatedblocks`,
+        which shows leaks and caching, but not temporary churn.
+    cpu_time : bool
+        Record thread and process CPU time readings around each
+        sample, in ``thread_begin``, ``thread_end``, ``process_begin``
+        and ``process_end`` columns, so
+        :func:`perfume.analyze.split_cpu` can tell time spent
+        computing from time spent blocked or waiting to be scheduled.
+    rusage : bool
+        Record how much the OS's counters of page faults, context
+        switches and block I/O grew during each sample (see
+        :class:`perfume.collect.RusageProbe`), so
+        :func:`perfume.analyze.split_os_noise` can separate out
+        samples that were preempted or faulted.
 
     Returns
     -------
@@ -278,37 +500,227 @@ def bench(*fns, samples=None, efficiency=.9):
         A dataframe containing the results so far.  The row index is
         just an autoincrement integer, and the column index is a
         :class:`~pandas.MultiIndex` where the first level is function
-        name and the second level is ``begin`` or ``end``.
+        name and the second level is ``begin`` or ``end`` (and
+        ``batch`` if batching).  Times are integer nanoseconds from
+        :func:`time.perf_counter_ns`.
     """
-    if samples is None:
-        sample_records = []
+    _check_render(render)
+    if any(inspect.iscoroutinefunction(fn) for fn in fns):
+        raise TypeError("Use bench_async to benchmark coroutine functions")
+
+    if processes and threads:
+        raise ValueError("Pass either processes or threads, not both")
+    if rate is not None and (processes or batch is not None or gc):
+        raise ValueError("rate doesn't support processes, batch or gc")
+    if (threads or rate) and memory is not None:
+        raise ValueError("Memory is process-wide, so can't be threaded")
+    if rate is not None and (cpu_time or rusage):
+        raise ValueError("rate doesn't support cpu_time or rusage")
+
+    allocation = allocate.allocation(allocation)
+    if processes or threads or rate:
+        # Each function is called from several workers at once.
+        if allocation is not None:
+            raise ValueError("Concurrent calls don't support allocation")
+        if collect.parse_order(order)[0] != "fixed":
+            raise ValueError("Concurrent calls don't support call orders")
+
+    names = [fn.__name__ for fn in fns]
+    fields = collect.fields(
+        batch=batch,
+        worker=bool(processes or threads or rate),
+        gc_mode=gc,
+        order=order,
+        warmup=bool(warmup),
+        intended=rate is not None,
+        fixture=setup is not None or teardown is not None,
+        memory=memory,
+        cpu_time=cpu_time,
+        rusage=rusage,
+    )
+    fixtures = {}
+    if setup is not None or teardown is not None:
+        fixtures = {
+            "setups": _per_function(setup, fns, "setup"),
+            "teardowns": _per_function(teardown, fns, "teardown"),
+        }
+    calibration, overhead_ns = _calibrate(calibrate, subtract_overhead)
+    buf, resumed = _buffer(names, fields, samples)
+
+    pool = None
+    if processes:
+        pool = workers.WorkerPool(
+            fns,
+            buf,
+            replicas=processes,
+            cpus=cpus,
+            batch=batch,
+            overhead_ns=overhead_ns,
+            gc_mode=gc,
+            memory=memory,
+            cpu_time=cpu_time,
+            rusage=rusage,
+            **fixtures
+        )
+        step = functools.partial(pool.poll, 0.05)
+        collector = None
+    elif rate is not None:
+        driver = load.OpenLoop(
+            fns,
+            buf,
+            rate,
+            arrivals=arrivals,
+            threads=threads or 1,
+            overhead_ns=overhead_ns,
+            **fixtures
+        )
+        step = driver.collect
+        collector = None
+    elif threads:
+        driver = load.ClosedLoop(
+            fns,
+            buf,
+            threads=threads,
+            batch=batch,
+            overhead_ns=overhead_ns,
+            gc_mode=gc,
+            cpu_time=cpu_time,
+            rusage=rusage,
+            **fixtures
+        )
+        step = driver.collect
+        collector = None
     else:
-        sample_records = [tuple(r) for r in samples.to_records(index=False)]
+        collector = collect.Collector(
+            fns,
+            buf,
+            batch=batch,
+            overhead_ns=overhead_ns,
+            gc_mode=gc,
+            allocation=allocation,
+            order=order,
+            memory=memory,
+            cpu_time=cpu_time,
+            rusage=rusage,
+            **fixtures
+        )
+        step = collector.collect
+    session = None
+    stopped = False
+    try:
+        session = _Session(
+            buf,
+            calibration,
+            efficiency,
+            render,
+            len(pool) if pool else threads or 1,
+            max_samples,
+            max_seconds,
+            converge,
+            warmup,
+            memory=memory,
+            display=display,
+            aggregate=aggregate,
+        )
+        # Created once nothing else can fail, so that errors setting up
+        # leave no store behind.
+        session.stream(_store(resumed if store is None else store, buf))
+        while not stopped:
+            step()
+            stopped = session.check()
+    except KeyboardInterrupt:
+        if session is None:
+            raise
+    finally:
+        if pool is not None:
+            pool.stop()
+        if session is not None:
+            session.close()
+        if collector is not None:
+            collector.close()
+    return session.samples()
+
+
+async def bench_async(
+    *fns,
+    samples=None,
+    efficiency=.9,
+    concurrency=1,
+    lag=True,
+    calibrate=True,
+    subtract_overhead=False,
+    render="inline",
+    max_samples=None,
+    max_seconds=None,
+    converge=None,
+    warmup=False,
+    display=None,
+    store=None,
+    aggregate=None
+):
+    """Benchmarks coroutine functions, like :func:`bench`.
+
+    Must be awaited from a running event loop, for instance with a
+    top-level ``await`` in a notebook cell.  The functions are awaited
+    by an :class:`perfume.aio.AsyncCollector` on that loop, and each
+    sample times one call, from when the coroutine starts to when it
+    completes.
+
+    Parameters
+    ----------
+    fns : list of coroutine function
+        Functions to benchmark and compare.
+    concurrency : int
+        Number of tasks awaiting the functions at once.  Samples then
+        get a ``worker`` column with the index of the task that took
+        them, and calls from different tasks overlap.
+    lag : bool
+        Whether to record, in a ``lag`` column, how long the event loop
+        took to run callbacks while each call was in flight (see
+        :class:`perfume.aio.AsyncCollector`).  High lag means the loop
+        itself was saturated.
+
+    The other parameters are as for :func:`bench`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The samples, as for :func:`bench`.
+    """
+    _check_render(render)
+    if not all(inspect.iscoroutinefunction(fn) for fn in fns):
+        raise TypeError("bench_async only benchmarks coroutine functions")
+
     names = [fn.__name__ for fn in fns]
-    disp = Display(names, len(sample_records))
-    index = pd.MultiIndex(
-        levels=[names, ("begin", "end")],
-        labels=[
-            _flatten([(i, i) for i in range(len(names))]), [0, 1] * len(names)
-        ],
-        names=("function", "timing"),
+    fields = collect.fields(
+        worker=concurrency > 1, lag=lag, warmup=bool(warmup)
+    )
+    calibration, overhead_ns = _calibrate(calibrate, subtract_overhead)
+    buf, resumed = _buffer(names, fields, samples)
+    collector = aio.AsyncCollector(
+        fns, buf, concurrency=concurrency, overhead_ns=overhead_ns
+    )
+    session = _Session(
+        buf,
+        calibration,
+        efficiency,
+        render,
+        concurrency,
+        max_samples,
+        max_seconds,
+        converge,
+        warmup,
+        display=display,
+        aggregate=aggregate,
     )
+    stopped = False
     try:
-        while True:
-            sample = []
-            for fn in fns:
-                with Timer() as timer:
-                    fn()
-                sample.extend((timer.begin, timer.end))
-            sample_records.append(tuple(t * 1000 for t in sample))
-
-            if (
-                len(sample_records) > 10
-                and disp.elapsed_rendering_ratio() < (1. - efficiency)
-            ):
-                samples = pd.DataFrame.from_records(
-                    iter(sample_records), columns=index
-                )
-                disp.update(samples)
+        session.stream(_store(resumed if store is None else store, buf))
+        while not stopped:
+            await collector.collect()
+            stopped = session.check()
     except KeyboardInterrupt:
-        return pd.DataFrame.from_records(iter(sample_records), columns=index)
+        pass
+    finally:
+        session.close()
+    return session.samples()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.pytest_plugin` runs benchmarks as pytest tests.
+
+Installing perfume registers this plugin with pytest, which provides
+a ``perfume`` fixture.  Calling it benchmarks a function with
+:func:`perfume.bench`, without a live display and within a time
+budget, and returns a :class:`Result` to assert on::
+
+    def test_sort(perfume):
+        result = perfume(sorted, setup=shuffled, baseline=old_sort)
+        assert result.quantile(0.99) < 2e6  # 2 ms
+        result.assert_not_slower(alpha=0.01)
+
+Every benchmark runs in the process running its test, so with
+pytest-xdist, benchmarks are spread over the workers like any other
+test, and ``--perfume-pin`` gives each worker a CPU of its own.  A
+summary of each benchmark's latency is reported at the end of the
+session, including those run by xdist workers.
+
+Perfume itself is only imported once a benchmark runs, so having the
+plugin installed doesn't slow down test suites that don't use it.
+"""
+
+import os
+
+import pytest
+
+#: Quantiles of latency reported per benchmark, at the end of the
+#: session.
+QUANTILES = (0.5, 0.99)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("perfume", "perfume benchmarks")
+    group.addoption(
+        "--perfume-budget",
+        type=float,
+        default=2.0,
+        help="seconds each benchmark may run for (default: 2)",
+    )
+    group.addoption(
+        "--perfume-skip",
+        action="store_true",
+        help="skip tests that use the perfume fixture",
+    )
+    group.addoption(
+        "--perfume-pin",
+        action="store_true",
+        help="pin each pytest-xdist worker to a CPU of its own",
+    )
+
+
+def pytest_configure(config):
+    if not config.getoption("perfume_pin"):
+        return
+
+    if not hasattr(os, "sched_setaffinity"):
+        return
+
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    if worker is None and getattr(config.option, "numprocesses", None):
+        # The xdist controller doesn't run tests itself.
+        return
+
+    cpus = sorted(os.sched_getaffinity(0))
+    index = int(worker[2:]) if worker is not None else 0
+    os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+
+
+class _Quiet(object):
+    # Stands in for perfume.display.Display, showing nothing.
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def elapsed_rendering_ratio(self):
+        return 1.
+
+    def update(self, samples):
+        pass
+
+
+class Result(object):
+    """The samples from a benchmark run by the ``perfume`` fixture.
+
+    Attributes
+    ----------
+    samples : pandas.DataFrame
+        The samples, as returned by :func:`perfume.bench`.
+    timings : pandas.Series
+        The function's latencies, in nanoseconds, without warm-up.
+    baseline_timings : pandas.Series
+        The baseline's latencies, if one was benchmarked alongside.
+    """
+
+    def __init__(self, samples, name, baseline=None):
+        from perfume import analyze
+
+        t = analyze.timings(samples)
+        self.samples = samples
+        self.timings = t[name].dropna()
+        self.baseline_timings = None
+        if baseline is not None:
+            self.baseline_timings = t[baseline].dropna()
+
+    def quantile(self, q):
+        """Returns the ``q``'th quantile of latency, in nanoseconds."""
+        return self.timings.quantile(q)
+
+    def slower_than_baseline(self, tolerance=0.):
+        """Tests whether the function is slower than the baseline.
+
+        Runs a one-sided two-sample Kolmogorov-Smirnov test of the
+        hypothesis that the function's latencies are stochastically
+        larger than the baseline's, each scaled up by ``1 +
+        tolerance``.  A positive ``tolerance`` overlooks slowdowns
+        smaller than that fraction.
+
+        Returns
+        -------
+        (float, float)
+            The K-S statistic and its p-value.
+        """
+        from scipy import stats
+
+        if self.baseline_timings is None:
+            raise ValueError("No baseline was benchmarked")
+
+        statistic, pvalue = stats.ks_2samp(
+            self.timings,
+            self.baseline_timings * (1. + tolerance),
+            alternative="less",
+        )
+        return statistic, pvalue
+
+    def assert_not_slower(self, alpha=0.01, tolerance=0.):
+        """Fails unless the function is no slower than the baseline.
+
+        See :meth:`slower_than_baseline`.  Fails if its p-value is
+        below ``alpha``.
+        """
+        statistic, pvalue = self.slower_than_baseline(tolerance)
+        if pvalue < alpha:
+            raise AssertionError(
+                "Slower than baseline: K-S statistic {:.3f}, p-value {:.3g} "
+                "< {}, medians {:.0f} ns vs {:.0f} ns".format(
+                    statistic,
+                    pvalue,
+                    alpha,
+                    self.timings.median(),
+                    self.baseline_timings.median(),
+                )
+            )
+
+    def summary(self):
+        """Returns the number of samples and :data:`QUANTILES` of
+        latency, as plain numbers."""
+        ret = {"samples": int(len(self.timings))}
+        for q in QUANTILES:
+            ret["p{:g}".format(q * 100)] = float(self.quantile(q))
+        return ret
+
+
+def _renamed(fn, name):
+    def wrapper(*args):
+        return fn(*args)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+class Runner(object):
+    """Benchmarks functions for a test, as the ``perfume`` fixture.
+
+    Each call benchmarks ``fn``, and ``baseline`` alongside it if
+    given, with :func:`perfume.bench`, passing it ``options``.  By
+    default, each call stops after ``--perfume-budget`` seconds, but
+    ``max_seconds`` and the other stop conditions may be passed as
+    options.  Returns a :class:`Result`.
+    """
+
+    def __init__(self, request):
+        self._request = request
+        self._budget = request.config.getoption("perfume_budget")
+
+    def __call__(self, fn, baseline=None, **options):
+        from perfume.perfume import bench
+
+        fns = [fn]
+        if baseline is not None:
+            fns.append(baseline)
+            if fn.__name__ == baseline.__name__:
+                # Wrap both, so the wrapper's cost doesn't skew the
+                # comparison.
+                fns = [
+                    _renamed(fn, fn.__name__),
+                    _renamed(baseline, "baseline"),
+                ]
+        options.setdefault("max_seconds", self._budget)
+        samples = bench(*fns, display=_Quiet, **options)
+        result = Result(
+            samples,
+            fns[0].__name__,
+            fns[1].__name__ if baseline is not None else None,
+        )
+        self._request.node.user_properties.append(
+            ("perfume", dict(result.summary(), name=fns[0].__name__))
+        )
+        return result
+
+
+@pytest.fixture
+def perfume(request):
+    """Benchmarks functions within the test's time budget.
+
+    See :class:`Runner`.  With ``--perfume-skip``, tests using this
+    fixture are skipped.
+    """
+    if request.config.getoption("perfume_skip"):
+        pytest.skip("perfume benchmarks are skipped")
+
+    return Runner(request)
+
+
+def _format_summary(summary):
+    from perfume import analyze
+
+    unit = analyze.pick_unit([summary["p50"]])
+    return "{}: {} samples, {}".format(
+        summary["name"],
+        summary["samples"],
+        ", ".join(
+            "p{:g} {:.4g} {}".format(
+                q * 100,
+                analyze.in_unit(summary["p{:g}".format(q * 100)], unit),
+                unit,
+            )
+            for q in QUANTILES
+        ),
+    )
+
+
+def pytest_terminal_summary(terminalreporter):
+    lines = []
+    for outcome in ("passed", "failed"):
+        for report in terminalreporter.stats.get(outcome, []):
+            if getattr(report, "when", None) != "call":
+                continue
+
+            for name, summary in report.user_properties:
+                if name == "perfume":
+                    lines.append(
+                        "{} {}".format(report.nodeid, _format_summary(summary))
+                    )
+    if lines:
+        terminalreporter.section("perfume")
+        for line in lines:
+            terminalreporter.write_line(line)
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.samples` contains storage for collected samples.
+
+:func:`perfume.bench` writes into a :class:`SampleBuffer` as it runs,
+and only builds the :class:`~pandas.DataFrame` it returns at the end.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class SampleBuffer(object):
+    """Growable, columnar storage for benchmark samples.
+
+    Samples live in one preallocated, Fortran-ordered array with a
+    column per ``(function, timing)`` pair, so each column is
+    contiguous in memory.  When the array fills up, its capacity is
+    doubled, so appends are amortized constant time.
+
+    Usually every function has the same number of samples, one per
+    row.  When functions are sampled independently (for instance, in
+    separate processes), each function's columns fill up at their own
+    rate, and :meth:`frame` marks the cells past a function's last
+    sample as missing.
+
+    Once older samples are kept elsewhere, such as in a
+    :class:`~perfume.store.SampleStore`, :meth:`discard` drops them
+    from memory.  Samples keep their numbering: :attr:`sizes` and
+    ``len`` still count every sample, and the ``start`` of a range of
+    samples counts from the first one ever appended.
+
+    Parameters
+    ----------
+    names : list of str
+        Names of the functions being benchmarked.
+    fields : tuple of str
+        Values recorded per function per sample.
+    capacity : int
+        Number of samples to preallocate room for.
+    dtype : numpy.dtype
+        Type of the values stored.
+    """
+
+    def __init__(
+        self, names, fields=("begin", "end"), capacity=1024, dtype=np.int64
+    ):
+        self._names = list(names)
+        self._fields = list(fields)
+        self._columns = pd.MultiIndex.from_product(
+            [self._names, self._fields], names=("function", "timing")
+        )
+        self._width = len(fields)
+        self._array = np.empty(
+            (max(capacity, 1), len(self._columns)), dtype=dtype, order="F"
+        )
+        # Number of samples in memory, after the first discarded ones.
+        self._size = 0
+        # Per-function sizes, only once functions are sampled
+        # independently.
+        self._sizes = None
+        self._discarded = 0
+
+    @classmethod
+    def from_frame(cls, samples, fields=None, defaults=None, dtype=np.int64):
+        """Builds a buffer holding a copy of ``samples``.
+
+        ``samples`` is a :class:`~pandas.DataFrame` as returned by
+        :func:`perfume.bench`.  If ``fields`` is given, the buffer
+        records those fields, and any that ``samples`` lacks are
+        filled in from ``defaults``, or 0.
+        """
+        names = list(samples.columns.unique(level=0))
+        if fields is None:
+            fields = list(samples.columns.unique(level=1))
+        buf = cls(names, fields, capacity=2 * len(samples.index), dtype=dtype)
+        if samples.columns.equals(buf.columns) and all(
+            kind in "iu" for kind in samples.dtypes.map(lambda t: t.kind)
+        ):
+            # Already laid out like the buffer, with no missing
+            # values, so copy it over in one go.
+            buf.extend(samples.values)
+            return buf
+
+        frame = samples.reindex(columns=buf.columns)
+        for field in fields:
+            if field not in samples.columns.unique(level=1):
+                value = (defaults or {}).get(field, 0)
+                for name in names:
+                    frame[(name, field)] = value
+        if not frame.isnull().values.any():
+            buf.extend(frame.values)
+            return buf
+
+        for i, name in enumerate(names):
+            rows = frame[name]
+            rows = rows[rows["end"].notnull()]
+            buf.extend_function(i, rows.values)
+        return buf
+
+    @property
+    def columns(self):
+        """The :class:`~pandas.MultiIndex` used for the sample frame."""
+        return self._columns
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    @property
+    def fields(self):
+        return list(self._fields)
+
+    @property
+    def capacity(self):
+        return len(self._array)
+
+    @property
+    def first(self):
+        """The number of the first sample still in memory."""
+        return self._discarded
+
+    @property
+    def sizes(self):
+        """The number of samples recorded for each function."""
+        if self._sizes is None:
+            return np.full(
+                len(self._names), self._discarded + self._size, dtype=np.int64
+            )
+
+        return self._discarded + self._sizes
+
+    def __len__(self):
+        return self._discarded + self._size
+
+    def _row(self, start):
+        if start < self._discarded:
+            raise ValueError(
+                "Samples before {} were discarded".format(self._discarded)
+            )
+
+        return start - self._discarded
+
+    def _reserve(self, size):
+        if size <= len(self._array):
+            return
+
+        capacity = len(self._array)
+        while capacity < size:
+            capacity *= 2
+        array = np.empty(
+            (capacity, self._array.shape[1]),
+            dtype=self._array.dtype,
+            order="F",
+        )
+        array[:self._size] = self._array[:self._size]
+        self._array = array
+
+    def _check_rectangular(self):
+        if self._sizes is not None:
+            raise ValueError(
+                "Can't append whole samples after sampling functions "
+                "independently"
+            )
+
+    def append(self, row):
+        """Appends one sample, a sequence with a value per column."""
+        self._check_rectangular()
+        if self._size == len(self._array):
+            self._reserve(self._size + 1)
+        self._array[self._size] = row
+        self._size += 1
+
+    def extend(self, rows):
+        """Appends several samples, given as a 2-d array."""
+        self._check_rectangular()
+        rows = np.asarray(rows)
+        self._reserve(self._size + len(rows))
+        self._array[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    def extend_function(self, index, rows):
+        """Appends samples of the ``index``'th function only.
+
+        ``rows`` is a 2-d array with a column per field.
+        """
+        rows = np.asarray(rows)
+        if self._sizes is None:
+            self._sizes = np.full(len(self._names), self._size, np.int64)
+        begin = int(self._sizes[index])
+        self._reserve(begin + len(rows))
+        col = index * self._width
+        self._array[begin:begin + len(rows), col:col + self._width] = rows
+        self._sizes[index] += len(rows)
+        self._size = max(self._size, begin + len(rows))
+        if (self._sizes == self._size).all():
+            # Every function caught up, so they share rows again.
+            self._sizes = None
+
+    def clear(self):
+        """Forgets all samples, keeping the allocated capacity."""
+        self._size = 0
+        self._sizes = None
+        self._discarded = 0
+
+    def truncate(self, size):
+        """Drops every function's samples past the first ``size``."""
+        if size >= len(self):
+            return
+
+        row = self._row(size)
+        if self._sizes is not None:
+            self._sizes = np.minimum(self._sizes, row)
+            if (self._sizes == row).all():
+                self._sizes = None
+        self._size = row
+
+    def discard(self, count):
+        """Drops the oldest ``count`` samples in memory.
+
+        Every function must have at least that many samples in memory.
+        The rest are copied to a new array with room to double, so
+        views and frames taken before stay valid.
+        """
+        if count <= 0:
+            return
+
+        sizes = self._sizes if self._sizes is not None else [self._size]
+        if count > min(sizes):
+            raise ValueError("Can't discard samples that weren't recorded")
+
+        size = self._size - count
+        array = np.empty(
+            (max(2 * size, 1024), self._array.shape[1]),
+            dtype=self._array.dtype,
+            order="F",
+        )
+        array[:size] = self._array[count:self._size]
+        self._array = array
+        if self._sizes is not None:
+            self._sizes = self._sizes - count
+        self._size = size
+        self._discarded += count
+
+    def view(self):
+        """Returns the samples so far as an array, without copying.
+
+        This is safe to call from another thread while samples are
+        being appended: rows are written before the size is bumped,
+        and growing copies every counted row before swapping arrays,
+        so reading the size first always gives a complete snapshot.
+
+        If functions were sampled independently, cells past each
+        function's own :attr:`sizes` hold garbage.
+        """
+        size = self._size
+        return self._array[:size]
+
+    def function_view(self, index, start=None):
+        """Returns the ``index``'th function's samples, without copying.
+
+        By default, returns every sample still in memory.
+        """
+        start = self._row(self._discarded if start is None else start)
+        size = self.sizes[index] - self._discarded
+        col = index * self._width
+        return self._array[start:size, col:col + self._width]
+
+    def function_field(self, index, field, start=0):
+        """Returns one field of the ``index``'th function's samples."""
+        col = index * self._width + self.fields.index(field)
+        return self._array[
+            self._row(start):self.sizes[index] - self._discarded, col
+        ]
+
+    def fill_function(self, index, field, value, start=0, stop=None):
+        """Sets one field of a range of the ``index``'th function's
+        samples to ``value``."""
+        if stop is None:
+            stop = self.sizes[index]
+        col = index * self._width + self.fields.index(field)
+        self._array[self._row(start):stop - self._discarded, col] = value
+
+    def function_timings(self, index, start=0):
+        """Returns the ``index``'th function's latencies as an array.
+
+        Only samples from ``start`` on are included.  Like
+        :func:`perfume.analyze.timings`, batched samples give the mean
+        latency per call, and samples with an ``intended`` start are
+        timed from it.
+        """
+        fields = self.fields
+        rows = self.function_view(index, start)
+        begin = "intended" if "intended" in fields else "begin"
+        ret = rows[:, fields.index("end")] - rows[:, fields.index(begin)]
+        if "batch" in fields:
+            return ret / rows[:, fields.index("batch")]
+
+        return ret
+
+    def frame(self):
+        """Returns the samples so far as a DataFrame.
+
+        If every function has the same number of samples, the frame
+        shares memory with the buffer, so it should be treated as
+        read-only.  Samples appended later don't show up in it.
+
+        Otherwise, the frame is a ``float64`` copy, with NaN marking
+        cells past each function's last sample.  This is exact as long
+        as timestamps stay under :math:`2^{53}` nanoseconds.
+
+        Rows are numbered from :attr:`first`, so discarded samples
+        leave a gap at the front.
+        """
+        size = self._size
+        sizes = self._sizes
+        first = self._discarded
+        # Functions only start being sampled independently after
+        # _sizes is set, so if it's unset now, size was read while
+        # all functions had the same number of samples.
+        if sizes is None:
+            view = self._array[:size]
+            return pd.DataFrame(
+                view,
+                index=pd.RangeIndex(first, first + len(view)),
+                columns=self._columns,
+                copy=False,
+            )
+
+        sizes = sizes.copy()
+        view = self._array[:sizes.max(initial=0)]
+
+        array = view.astype(np.float64)
+        for i, size in enumerate(sizes):
+            col = i * self._width
+            array[size:, col:col + self._width] = np.nan
+        return pd.DataFrame(
+            array,
+            index=pd.RangeIndex(first, first + len(array)),
+            columns=self._columns,
+        )
+
+    def to_frame(self):
+        """Returns a copy of the samples so far as a DataFrame."""
+        frame = self.frame()
+        if np.shares_memory(frame.values, self._array):
+            return frame.copy()
+
+        return frame
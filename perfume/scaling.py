@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.scaling` measures how latency grows with input size.
+
+:func:`sweep` benchmarks one function at several input sizes, and
+:func:`fit` fits the usual complexity classes to quantiles of the
+latencies, to catch algorithms that are fast on small inputs and blow
+up on big ones.
+"""
+
+import collections
+import functools
+
+import numpy as np
+import pandas as pd
+from scipy import optimize
+
+from perfume import allocate
+from perfume import analyze
+from perfume import collect
+from perfume import stop
+from perfume.samples import SampleBuffer
+
+#: Complexity classes :func:`fit` tries, simplest first, as functions
+#: of the input size.
+MODELS = collections.OrderedDict(
+    [
+        ("O(1)", lambda n: np.zeros_like(n)),
+        ("O(log n)", np.log),
+        ("O(n)", lambda n: n),
+        ("O(n log n)", lambda n: n * np.log(n)),
+        ("O(n^2)", np.square),
+    ]
+)
+
+
+def sweep(
+    fn,
+    sizes,
+    setup=None,
+    max_samples=100,
+    max_seconds=None,
+    converge=None,
+    batch=None,
+    gc=None,
+    allocation=None,
+    order="fixed",
+):
+    """Benchmarks ``fn`` at each of several input sizes.
+
+    Each size is benchmarked as if it were a separate function passed
+    to :func:`perfume.bench`, with the same collector, but without a
+    live display.
+
+    Parameters
+    ----------
+    fn : callable
+        Function to benchmark.  Called with the size, or with the
+        input ``setup`` makes.
+    sizes : list of int
+        Positive input sizes to benchmark at.
+    setup : callable
+        If given, called with the size before each call, outside the
+        timed region, to make a fresh input to pass to ``fn``.
+    max_samples, max_seconds, converge
+        Stop conditions, as for :func:`perfume.bench`.  By default,
+        stops once every size has 100 samples.
+    batch, gc, allocation, order
+        As for :func:`perfume.bench`.  ``allocation="quantile"`` saves
+        time by calling the slow sizes only as often as needed.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The samples, as for :func:`perfume.bench`, with a group of
+        columns per size instead of per function.
+    """
+    sizes = list(sizes)
+    if setup is None:
+        fns = [functools.partial(fn, size) for size in sizes]
+        setups = None
+    else:
+        fns = [fn] * len(sizes)
+        setups = [functools.partial(setup, size) for size in sizes]
+    buf = SampleBuffer(
+        sizes,
+        collect.fields(
+            batch=batch, gc_mode=gc, order=order, fixture=setup is not None
+        ),
+    )
+    collector = collect.Collector(
+        fns,
+        buf,
+        batch=batch,
+        gc_mode=gc,
+        allocation=allocate.allocation(allocation),
+        order=order,
+        setups=setups,
+    )
+    stops = stop.conditions(max_samples, max_seconds, converge)
+    try:
+        while not any(condition(buf) for condition in stops):
+            collector.collect()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.close()
+    return buf.to_frame()
+
+
+def _fit_model(sizes, t, basis):
+    # Least squares on relative errors, since timings at different
+    # sizes differ by orders of magnitude, with nonnegative
+    # coefficients.
+    design = np.column_stack([np.ones_like(sizes), basis]) / t[:, None]
+    (a, b), _ = optimize.nnls(design, np.ones_like(t))
+    return a, b, a + b * basis
+
+
+def _goodness(t, predicted):
+    relative = (predicted - t) / t
+    total = np.square(t - t.mean()).sum()
+    residual = np.square(t - predicted).sum()
+    return (
+        1. - residual / total if total > 0 else np.nan,
+        np.sqrt(np.mean(np.square(relative))),
+    )
+
+
+def fit(samples, quantiles=(0.5, 0.99), tolerance=0.05):
+    """Fits complexity classes to quantiles of latency by size.
+
+    For each quantile, each of :data:`MODELS` is fit as
+    :math:`t = a + b f(n)`, and a power law :math:`t = a n^b` is fit
+    in log space.  The best model is the simplest one whose relative
+    RMS error is at most ``tolerance`` more than the smallest, so
+    noise doesn't make a constant look logarithmic.
+
+    Parameters
+    ----------
+    samples : pandas.DataFrame
+        Samples as returned by :func:`sweep`, whose function names are
+        the input sizes.
+    quantiles : list of float
+        Quantiles of the latency to fit.
+    tolerance : float
+        How much larger a simpler model's relative RMS error may be,
+        for it to still be preferred.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by quantile and model, with the fitted ``a`` and
+        ``b``, the ``r2`` and relative RMS error ``rel_rmse`` of the
+        fit, and whether it's the ``best`` model for that quantile.
+    """
+    t = analyze.timings(samples)
+    sizes = np.asarray(t.columns, dtype=np.float64)
+    if len(sizes) < 2:
+        raise ValueError("Need at least two sizes to fit")
+
+    rows = []
+    for q in quantiles:
+        y = t.quantile(q).values.astype(np.float64)
+        fits = []
+        for model, basis in MODELS.items():
+            a, b, predicted = _fit_model(sizes, y, basis(sizes))
+            fits.append((q, model, a, b) + _goodness(y, predicted))
+        errors = [row[-1] for row in fits]
+        best = next(
+            i
+            for i, error in enumerate(errors)
+            if error <= min(errors) + tolerance
+        )
+        rows.extend(row + (i == best,) for i, row in enumerate(fits))
+        b, log_a = np.polyfit(np.log(sizes), np.log(y), 1)
+        predicted = np.exp(log_a) * sizes ** b
+        rows.append(
+            (q, "power", np.exp(log_a), b)
+            + _goodness(y, predicted)
+            + (False,)
+        )
+    return pd.DataFrame.from_records(
+        rows,
+        columns=["quantile", "model", "a", "b", "r2", "rel_rmse", "best"],
+        index=["quantile", "model"],
+    )
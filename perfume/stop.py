@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.stop` decides when :func:`perfume.bench` is done.
+
+Each stop condition is called with the
+:class:`~perfume.samples.SampleBuffer` being filled, and returns
+whether to stop collecting.
+"""
+
+import math
+import time
+
+from perfume.histogram import FunctionHistograms
+
+
+class MaxSamples(object):
+    """Stops once every function has ``count`` samples."""
+
+    def __init__(self, count):
+        self.count = count
+
+    def __call__(self, buf):
+        return len(buf) >= self.count and buf.sizes.min() >= self.count
+
+
+class MaxSeconds(object):
+    """Stops ``seconds`` after the first check."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._deadline = None
+
+    def __call__(self, buf):
+        now = time.perf_counter()
+        if self._deadline is None:
+            self._deadline = now + self.seconds
+        return now >= self._deadline
+
+
+class Converged(object):
+    """Stops once a quantile of every function is known precisely.
+
+    Each function's latencies are fed into a
+    :class:`~perfume.histogram.Histogram` as they arrive, and the
+    :meth:`~perfume.histogram.Histogram.quantile_interval` of
+    ``quantile`` is checked against ``rel_tol``.  Only new samples are
+    read, and the interval is only checked after the number of
+    samples has grown by ``check_growth``, so the cost per sample is
+    constant.
+
+    Parameters
+    ----------
+    quantile : float
+        Quantile to estimate, e.g. ``0.5`` or ``0.99``.
+    rel_tol : float
+        Largest acceptable width of the confidence interval, relative
+        to the estimate.
+    z : float
+        Normal quantile for the confidence level; 1.96 gives 95%.
+    min_samples : int
+        Never stop before every function has this many samples.
+    check_growth : float
+        Relative growth in samples between checks.
+    """
+
+    def __init__(
+        self,
+        quantile=0.5,
+        rel_tol=0.01,
+        z=1.96,
+        min_samples=100,
+        check_growth=0.05,
+    ):
+        self.quantile = quantile
+        self.rel_tol = rel_tol
+        self.z = z
+        self.min_samples = min_samples
+        self.check_growth = check_growth
+        # Enough precision that buckets don't dominate the interval.
+        self._histograms = FunctionHistograms(
+            max(2, int(math.ceil(-math.log10(rel_tol))) + 1)
+        )
+        self._next_check = min_samples
+
+    def intervals(self):
+        """Returns each function's current confidence interval."""
+        return [
+            h.quantile_interval(self.quantile, self.z)
+            for h in self._histograms.histograms
+        ]
+
+    def __call__(self, buf):
+        # Read every call, so no sample is missed if the buffer
+        # discards old ones.
+        self._histograms.update(buf)
+        if len(buf) < self._next_check:
+            return False
+
+        fewest = min(self._histograms.counts)
+        self._next_check = max(
+            len(buf) + 1, int(len(buf) * (1 + self.check_growth))
+        )
+        if fewest < self.min_samples:
+            return False
+
+        for low, high in self.intervals():
+            estimate = (low + high) / 2
+            if estimate > 0 and (high - low) / estimate > self.rel_tol:
+                return False
+
+        return True
+
+
+def conditions(max_samples=None, max_seconds=None, converge=None):
+    """Builds the stop conditions for :func:`perfume.bench`.
+
+    ``converge`` may be a :class:`Converged`, or a ``(quantile,
+    rel_tol)`` tuple to build one from.
+    """
+    ret = []
+    if max_samples is not None:
+        ret.append(MaxSamples(max_samples))
+    if max_seconds is not None:
+        ret.append(MaxSeconds(max_seconds))
+    if converge is not None:
+        if not isinstance(converge, Converged):
+            converge = Converged(*converge)
+        ret.append(converge)
+    return ret
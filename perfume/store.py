@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.store` keeps samples on disk as they are collected.
+
+A :class:`SampleStore` is a directory of chunks, each a ``.npy`` file
+holding a run of one function's samples, plus a small JSON manifest
+listing them.  Chunks are only ever added, and each is complete on
+disk before the manifest names it, so if the process dies, at most
+the chunk being filled is lost.  Chunks are memory-mapped when read
+back, so reading doesn't need to fit the whole store in memory.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from perfume.samples import SampleBuffer
+
+#: Name of the manifest file in a store's directory.
+MANIFEST = "manifest.json"
+
+#: Version of the manifest format.
+VERSION = 1
+
+#: When a :class:`SampleStore` syncs what it writes to disk.
+FSYNC_POLICIES = ("chunk", "close", "never")
+
+
+def _fsync_directory(path):
+    # Makes renames in the directory durable.  Not possible on every
+    # platform.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SampleStore(object):
+    """Append-only, chunked storage for samples on disk.
+
+    Use :meth:`create` to start a new store and :meth:`open` to read
+    an existing one.  :meth:`write` appends a
+    :class:`~perfume.samples.SampleBuffer`'s new samples, a chunk of
+    ``chunk_rows`` samples per function at a time, and :meth:`close`
+    appends whatever is left.
+
+    Samples flagged as warm-up may be unflagged later, once their
+    function reaches steady state (see :mod:`perfume.warmup`), so
+    rather than rewriting chunks, the store records where each
+    function's warm-up ended in :attr:`warmup`, and applies it to the
+    ``warmup`` field when reading.
+
+    Parameters
+    ----------
+    path : str
+        Directory holding the store.
+    manifest : dict
+        The store's manifest.
+    fsync : str
+        ``"chunk"`` syncs every chunk and the manifest to disk as they
+        are written, so a crash of the whole machine loses at most one
+        chunk too.  ``"close"`` syncs everything once, on
+        :meth:`close`, and ``"never"`` leaves it to the OS.
+    """
+
+    def __init__(self, path, manifest, fsync="chunk"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy: {!r}".format(fsync))
+
+        self.path = path
+        self.fsync = fsync
+        self._manifest = manifest
+        self._sizes = np.array(
+            [sum(rows for _, rows in chunks) for chunks in manifest["chunks"]],
+            dtype=np.int64,
+        )
+        self._unsynced = set()
+
+    @classmethod
+    def create(cls, path, names, fields, chunk_rows=65536, fsync="chunk"):
+        """Starts a new, empty store in the directory ``path``.
+
+        The directory is created if needed, and must not already hold
+        a store.
+        """
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be positive")
+
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            raise ValueError("{} already holds samples".format(path))
+
+        os.makedirs(path, exist_ok=True)
+
+        store = cls(
+            path,
+            {
+                "version": VERSION,
+                "names": list(names),
+                "fields": list(fields),
+                "dtype": np.dtype(np.int64).str,
+                "chunk_rows": int(chunk_rows),
+                "chunks": [[] for _ in names],
+                "warmup": [None for _ in names],
+            },
+            fsync=fsync,
+        )
+        store._write_manifest()
+        return store
+
+    @classmethod
+    def open(cls, path, fsync="chunk"):
+        """Opens the existing store in the directory ``path``."""
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != VERSION:
+            raise ValueError(
+                "Unknown store version: {!r}".format(manifest.get("version"))
+            )
+
+        return cls(path, manifest, fsync=fsync)
+
+    @property
+    def names(self):
+        return list(self._manifest["names"])
+
+    @property
+    def fields(self):
+        return list(self._manifest["fields"])
+
+    @property
+    def chunk_rows(self):
+        return self._manifest["chunk_rows"]
+
+    @property
+    def sizes(self):
+        """The number of samples stored for each function."""
+        return self._sizes.copy()
+
+    @property
+    def warmup(self):
+        """The number of warm-up samples of each function, or ``None``
+        for those still warming up."""
+        return list(self._manifest["warmup"])
+
+    @warmup.setter
+    def warmup(self, boundaries):
+        self._manifest["warmup"] = [
+            None if boundary is None else int(boundary)
+            for boundary in boundaries
+        ]
+
+    def _replace(self, tmp, path):
+        # Moves a fully written file into place, syncing it first if
+        # the policy says to.
+        if self.fsync == "chunk":
+            with open(tmp, "rb+") as f:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if self.fsync == "close":
+            self._unsynced.add(path)
+
+    def _write_manifest(self):
+        path = os.path.join(self.path, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self._manifest, f)
+        self._replace(path + ".tmp", path)
+        if self.fsync == "chunk":
+            _fsync_directory(self.path)
+
+    def _write_chunk(self, index, rows):
+        chunks = self._manifest["chunks"][index]
+        filename = "{:03d}-{:06d}.npy".format(index, len(chunks))
+        path = os.path.join(self.path, filename)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(rows))
+        self._replace(path + ".tmp", path)
+        chunks.append([filename, len(rows)])
+        self._sizes[index] += len(rows)
+
+    def write(self, buf, final=False):
+        """Appends samples from ``buf`` that aren't stored yet.
+
+        ``buf`` must hold this store's functions and fields, and still
+        have in memory the samples past those already stored.  Only
+        whole chunks are written, unless ``final``.  Returns the
+        number of chunks written.
+        """
+        written = 0
+        for i, (stored, size) in enumerate(zip(self.sizes, buf.sizes)):
+            while size - stored >= self.chunk_rows or (
+                final and size > stored
+            ):
+                rows = buf.function_view(i, stored)[:self.chunk_rows]
+                self._write_chunk(i, rows)
+                stored += len(rows)
+                written += 1
+        if written:
+            self._write_manifest()
+        return written
+
+    def close(self, buf=None):
+        """Writes the rest of ``buf``'s samples, if given, and syncs
+        everything written if the fsync policy is ``"close"``."""
+        if buf is not None:
+            self.write(buf, final=True)
+        self._write_manifest()
+        if self.fsync == "close":
+            for path in sorted(self._unsynced):
+                with open(path, "rb+") as f:
+                    os.fsync(f.fileno())
+            self._unsynced = set()
+            _fsync_directory(self.path)
+
+    def chunks(self, index):
+        """Yields the ``index``'th function's chunks, memory-mapped."""
+        for filename, _ in self._manifest["chunks"][index]:
+            yield np.load(os.path.join(self.path, filename), mmap_mode="r")
+
+    def function_samples(self, index):
+        """Returns the ``index``'th function's samples as an array, with
+        warm-up flags applied."""
+        width = len(self.fields)
+        chunks = list(self.chunks(index))
+        ret = (
+            np.concatenate(chunks)
+            if chunks
+            else np.empty((0, width), dtype=np.int64)
+        )
+        if "warmup" in self.fields:
+            boundary = self._manifest["warmup"][index]
+            if boundary is not None:
+                col = self.fields.index("warmup")
+                ret[:, col] = np.arange(len(ret)) < boundary
+        return ret
+
+    def to_buffer(self):
+        """Reads every sample into a new
+        :class:`~perfume.samples.SampleBuffer`.
+
+        Each chunk is copied straight from disk into the buffer, which
+        has room for as many samples again, to continue benchmarking.
+        """
+        fields = self.fields
+        buf = SampleBuffer(
+            self.names, fields, capacity=2 * int(self._sizes.max(initial=0))
+        )
+        for i, boundary in enumerate(self._manifest["warmup"]):
+            for chunk in self.chunks(i):
+                buf.extend_function(i, chunk)
+            if "warmup" in fields and boundary is not None:
+                boundary = min(boundary, int(buf.sizes[i]))
+                buf.fill_function(i, "warmup", 1, 0, boundary)
+                buf.fill_function(i, "warmup", 0, boundary)
+        return buf
+
+    def to_frame(self):
+        """Reads every sample into a :class:`~pandas.DataFrame`, like
+        :func:`perfume.bench` returns."""
+        return self.to_buffer().frame()
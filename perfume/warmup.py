@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.warmup` finds where each function reaches steady state.
+
+The first calls to a function pay for imports, filling caches, growing
+the allocator's arenas and faulting in pages, so they are slower than
+the rest, and skew statistics computed over every sample.  A
+:class:`WarmupDetector` watches each function's latencies as they
+arrive, and flags the samples taken before it settled down in a
+``warmup`` column, which :mod:`perfume.analyze` leaves out.
+"""
+
+import numpy as np
+
+
+def mser(values, batch_size=5, min_batches=5):
+    """Finds the end of the warm-up period with the MSER rule.
+
+    The Marginal Standard Error Rule averages ``values`` in batches of
+    ``batch_size``, and picks the number of batches to drop from the
+    front that minimizes the standard error of the mean of the rest,
+    trading off bias from warm-up against variance from having fewer
+    samples.
+
+    Values are first clipped to their 99th percentile, so a few late
+    outliers can't make dropping everything before them look
+    worthwhile.
+
+    Returns
+    -------
+    int or None
+        The number of values to drop, or ``None`` if the best
+        truncation is in the second half, meaning the series hasn't
+        reached steady state yet.
+    """
+    count = len(values) // batch_size
+    if count < 2 * min_batches:
+        return None
+
+    values = np.asarray(values[:count * batch_size], dtype=np.float64)
+    values = np.minimum(values, np.percentile(values, 99))
+    means = values.reshape(count, batch_size).mean(axis=1)
+    # Centering keeps the sums of squares from losing precision.
+    means -= means.mean()
+    remaining = np.arange(count, 0, -1)
+    sums = np.cumsum(means[::-1])[::-1]
+    squares = np.cumsum(np.square(means)[::-1])[::-1]
+    errors = (squares - np.square(sums) / remaining) / np.square(remaining)
+    truncate = int(np.argmin(errors[:count - min_batches]))
+    if truncate > count // 2:
+        return None
+
+    return truncate * batch_size
+
+
+class WarmupDetector(object):
+    """Flags each function's samples until it reaches steady state.
+
+    Called with the :class:`~perfume.samples.SampleBuffer` being
+    filled, after each round.  Until a function is found to be
+    steady, all its samples are flagged.  The :func:`mser` rule is
+    rerun every time the function's samples grow by ``check_growth``,
+    and once it finds a truncation point, the samples after it are
+    unflagged, and so is every later sample.
+
+    Parameters
+    ----------
+    min_samples : int
+        Don't look for steady state before this many samples.
+    check_growth : float
+        Relative growth in samples between checks.
+    batch_size : int
+        Batch size for :func:`mser`.
+    """
+
+    def __init__(self, min_samples=50, check_growth=0.1, batch_size=5):
+        self.min_samples = min_samples
+        self.check_growth = check_growth
+        self.batch_size = batch_size
+        self.boundaries = None
+        self._flagged = None
+        self._next_check = None
+
+    def __call__(self, buf):
+        if self.boundaries is None:
+            self.boundaries = [None] * len(buf.names)
+            self._flagged = [0] * len(buf.names)
+            self._next_check = [self.min_samples] * len(buf.names)
+        for i, size in enumerate(buf.sizes):
+            size = int(size)
+            if self.boundaries[i] is not None:
+                buf.fill_function(i, "warmup", 0, self._flagged[i], size)
+                self._flagged[i] = size
+                continue
+
+            buf.fill_function(i, "warmup", 1, self._flagged[i], size)
+            self._flagged[i] = size
+            if size < self._next_check[i]:
+                continue
+
+            self._next_check[i] = max(
+                size + 1, int(size * (1 + self.check_growth))
+            )
+            boundary = mser(
+                buf.function_timings(i)[:size], batch_size=self.batch_size
+            )
+            if boundary is not None:
+                self.boundaries[i] = boundary
+                buf.fill_function(i, "warmup", 0, boundary, size)
+
+
+def detector(warmup):
+    """Builds the warm-up detector for :func:`perfume.bench`.
+
+    ``warmup`` may be ``True`` for the default detector, a
+    :class:`WarmupDetector`, or a false value for none.
+    """
+    if not warmup:
+        return None
+
+    if warmup is True:
+        return WarmupDetector()
+
+    return warmup
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+""":mod:`perfume.workers` benchmarks functions in separate processes.
+
+Each worker process runs one function (or one replica of a function)
+in its own interpreter, so functions don't share a heap, caches or GC
+pressure, and can be spread across cores.  Workers stream their
+samples back to the parent in chunks.
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+import traceback
+
+from perfume import collect
+from perfume.samples import SampleBuffer
+
+
+def _context():
+    # Forking lets workers run closures and other unpicklable
+    # functions.
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+
+    return multiprocessing.get_context()
+
+
+def pick_cpus(count):
+    """Picks ``count`` distinct CPUs this process may run on.
+
+    If there are CPUs to spare, the first is left for the parent
+    process.
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        raise ValueError("Pinning workers to CPUs requires Linux")
+
+    available = sorted(os.sched_getaffinity(0))
+    if len(available) > count:
+        available = available[1:]
+    if len(available) < count:
+        raise ValueError(
+            "Can't pin {} workers to dedicated CPUs, only {} are "
+            "available".format(count, len(available))
+        )
+
+    return available[:count]
+
+
+def _work(conn, stop, fn, name, fields, worker, cpu, options, chunk_seconds):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    buf = SampleBuffer([name], fields)
+    try:
+        collector = collect.Collector([fn], buf, worker=worker, **options)
+        last_send = time.perf_counter()
+        # Samples at least once, even if stopped already, so a function
+        # that raises always does.
+        while True:
+            collector.collect()
+            if stop.is_set():
+                break
+
+            now = time.perf_counter()
+            if now - last_send >= chunk_seconds:
+                conn.send(buf.view().copy())
+                buf.clear()
+                last_send = now
+        collector.close()
+    except Exception:
+        # Exceptions may not pickle, so the parent gets the traceback.
+        conn.send(traceback.format_exc())
+    else:
+        conn.send(buf.view().copy())
+        conn.send(None)
+    conn.close()
+
+
+class WorkerError(Exception):
+    """Raised when a worker process fails."""
+
+
+class WorkerPool(object):
+    """Runs each function under test in its own worker processes.
+
+    Parameters
+    ----------
+    fns : list of callable
+        Functions to benchmark.
+    buf : perfume.samples.SampleBuffer
+        Where to record samples, with columns for
+        :func:`perfume.collect.fields` including ``worker``.
+    replicas : int
+        Number of worker processes per function.
+    cpus : bool or list of int
+        If true, pin each worker to its own CPU, picked with
+        :func:`pick_cpus`.  If a list, the CPUs to pin workers to, in
+        order.
+    chunk_seconds : float
+        How often workers send their samples to the parent.
+    options : dict
+        Passed to each worker's :class:`perfume.collect.Collector`.
+
+    If a worker raises, or dies, :meth:`poll` raises a
+    :class:`WorkerError`.
+    """
+
+    def __init__(
+        self, fns, buf, replicas=1, cpus=None, chunk_seconds=0.05, **options
+    ):
+        self._buf = buf
+        count = len(fns) * replicas
+        if cpus is True:
+            cpus = pick_cpus(count)
+        elif cpus:
+            cpus = list(cpus)
+            if len(cpus) < count:
+                raise ValueError(
+                    "Need {} CPUs to pin workers to, got {}".format(
+                        count, len(cpus)
+                    )
+                )
+
+        setups = options.pop("setups", None) or [None] * len(fns)
+        teardowns = options.pop("teardowns", None) or [None] * len(fns)
+        ctx = _context()
+        self._stop = ctx.Event()
+        # The function and process of each worker still sending.
+        self._conns = {}
+        self._processes = []
+        for i, (fn, name) in enumerate(zip(fns, buf.names)):
+            for replica in range(replicas):
+                worker = i * replicas + replica
+                recv, send = ctx.Pipe(duplex=False)
+                process = ctx.Process(
+                    target=_work,
+                    name="perfume-{}-{}".format(name, replica),
+                    args=(
+                        send,
+                        self._stop,
+                        fn,
+                        name,
+                        buf.fields,
+                        worker,
+                        cpus[worker] if cpus else None,
+                        dict(
+                            options,
+                            setups=[setups[i]],
+                            teardowns=[teardowns[i]],
+                        ),
+                        chunk_seconds,
+                    ),
+                    daemon=True,
+                )
+                self._conns[recv] = (i, process)
+                self._processes.append(process)
+                process.start()
+                send.close()
+
+    def __len__(self):
+        return len(self._processes)
+
+    def poll(self, timeout=None):
+        """Appends samples sent by workers, waiting up to ``timeout``.
+
+        Returns the number of workers still running.
+        """
+        if not self._conns:
+            return 0
+
+        for conn in multiprocessing.connection.wait(
+            list(self._conns), timeout
+        ):
+            i, process = self._conns[conn]
+            try:
+                rows = conn.recv()
+            except EOFError:
+                # Died without saying goodbye.
+                del self._conns[conn]
+                process.join()
+                raise WorkerError(
+                    "Worker {} exited with code {}".format(
+                        process.name, process.exitcode
+                    )
+                )
+
+            if isinstance(rows, str):
+                del self._conns[conn]
+                raise WorkerError(
+                    "Worker {} failed:\n{}".format(process.name, rows)
+                )
+
+            if rows is None:
+                del self._conns[conn]
+            elif len(rows):
+                self._buf.extend_function(i, rows)
+        return len(self._conns)
+
+    def stop(self):
+        """Stops all workers and collects their remaining samples."""
+        self._stop.set()
+        error = None
+        while self._conns:
+            try:
+                self.poll()
+            except WorkerError as e:
+                # Keep draining the others, so none blocks sending.
+                error = error or e
+        for process in self._processes:
+            process.join()
+        if error is not None:
+            raise error
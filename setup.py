@@ -45,11 +45,14 @@ setup(
     entry_points={
         'console_scripts': [
             'perfume=perfume.cli:main'
-        ]
+        ],
+        'pytest11': [
+            'perfume=perfume.pytest_plugin'
+        ],
     },
     include_package_data=True,
     install_requires=requirements,
-    python_requires='>=3.4, <4',
+    python_requires='>=3.7, <4',
     license="BSD license",
     zip_safe=False,
     keywords='perfume python performance benchmarking jupyter interactive',
@@ -9,6 +9,18 @@ test the transformations in analyze somewhat.
 """
 
 
+import asyncio
+import contextlib
+import functools
+import gc
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
 
 import numpy as np
@@ -16,7 +28,24 @@ import numpy.testing as npt
 import pandas as pd
 import pandas.util.testing as pdt
 
+import perfume
+from perfume import aggregate
+from perfume import aio
+from perfume import allocate
 from perfume import analyze
+from perfume import cli
+from perfume import collect
+from perfume import histogram
+from perfume import load
+from perfume import scaling
+from perfume import stop
+from perfume import store
+from perfume import warmup
+from perfume import workers
+from perfume.histogram import FunctionHistograms
+from perfume.histogram import Histogram
+from perfume.samples import SampleBuffer
+from perfume.sketch import KLL
 
 
 class TestAnalyze(unittest.TestCase):
@@ -24,17 +53,17 @@ class TestAnalyze(unittest.TestCase):
 
     def setUp(self):
         samples = []
-        t = 1.0
+        t = 1000000000
         for i in range(20):
             sample = []
             sample.append(t)
-            t += 1.1
+            t += 1100000000
             sample.append(t)
-            t += 0.2
+            t += 200000000
             sample.append(t)
-            t += 1.5
+            t += 1500000000
             sample.append(t)
-            t += 0.1
+            t += 100000000
             samples.append(sample)
         self.samples = pd.DataFrame(
             data=samples,
@@ -55,8 +84,8 @@ class TestAnalyze(unittest.TestCase):
             set(timings.columns), set(self.samples.columns.get_level_values(0))
         )
         self.assertEqual(len(timings.columns), len(self.samples.columns) / 2)
-        npt.assert_array_almost_equal(timings["fn1"], 1.1)
-        npt.assert_array_almost_equal(timings["fn2"], 1.5)
+        npt.assert_array_equal(timings["fn1"], 1100000000)
+        npt.assert_array_equal(timings["fn2"], 1500000000)
 
     def test_isolate(self):
         """Test that isolate gives us the right results."""
@@ -66,17 +95,17 @@ class TestAnalyze(unittest.TestCase):
         pdt.assert_frame_equal(
             analyze.timings(isolated), analyze.timings(self.samples)
         )
-        npt.assert_array_almost_equal(
-            isolated["fn1"]["begin"], np.arange(20) * 1.1
+        npt.assert_array_equal(
+            isolated["fn1"]["begin"], np.arange(20) * 1100000000
         )
-        npt.assert_array_almost_equal(
-            isolated["fn1"]["end"], 1.1 + (np.arange(20) * 1.1)
+        npt.assert_array_equal(
+            isolated["fn1"]["end"], 1100000000 + (np.arange(20) * 1100000000)
         )
-        npt.assert_array_almost_equal(
-            isolated["fn2"]["begin"], np.arange(20) * 1.5
+        npt.assert_array_equal(
+            isolated["fn2"]["begin"], np.arange(20) * 1500000000
         )
-        npt.assert_array_almost_equal(
-            isolated["fn2"]["end"], 1.5 + (np.arange(20) * 1.5)
+        npt.assert_array_equal(
+            isolated["fn2"]["end"], 1500000000 + (np.arange(20) * 1500000000)
         )
 
     def test_timings_in_context(self):
@@ -87,7 +116,7 @@ class TestAnalyze(unittest.TestCase):
         # same DataFrame, which should be what timings_in_context
         # gives us.
         fn1_expected = pd.Series(
-            1.1,
+            1.1e9,
             index=pd.timedelta_range(
                 freq=pd.Timedelta("1.1s"),
                 start="1.1s",
@@ -96,7 +125,7 @@ class TestAnalyze(unittest.TestCase):
             ),
         )
         fn2_expected = pd.Series(
-            1.5,
+            1.5e9,
             index=pd.timedelta_range(
                 freq=pd.Timedelta("1.5s"),
                 start="1.5s",
@@ -106,3 +135,1141 @@ class TestAnalyze(unittest.TestCase):
         )
         expected = pd.DataFrame({"fn1": fn1_expected, "fn2": fn2_expected})
         pdt.assert_frame_equal(in_context, expected)
+
+    def test_units(self):
+        """Test that timings are reported in a sensible unit."""
+        timings = analyze.timings(self.samples)
+        self.assertEqual(analyze.pick_unit(timings), "s")
+        self.assertEqual(analyze.pick_unit(timings / 1000), "ms")
+        self.assertEqual(analyze.pick_unit(timings / 10 ** 9), "ns")
+        npt.assert_array_almost_equal(
+            analyze.in_unit(timings, "ms")["fn1"], 1100.0
+        )
+
+
+class TestSampleBuffer(unittest.TestCase):
+    """Tests for `perfume.samples` module."""
+
+    def test_append_grows(self):
+        """Test that appending past capacity keeps all samples."""
+        buf = SampleBuffer(["fn1", "fn2"], capacity=2)
+        for i in range(10):
+            buf.append([i, i + 1, i + 2, i + 3])
+        self.assertEqual(len(buf), 10)
+        self.assertGreaterEqual(buf.capacity, 10)
+        npt.assert_array_equal(buf.view()[:, 0], np.arange(10))
+        npt.assert_array_equal(buf.view()[:, 3], np.arange(10) + 3)
+
+    def test_frame_is_a_view(self):
+        """Test that frame shares memory with the buffer."""
+        buf = SampleBuffer(["fn1", "fn2"])
+        buf.extend(np.arange(20).reshape(5, 4))
+        frame = buf.frame()
+        self.assertTrue(np.shares_memory(frame.values, buf.view()))
+        self.assertEqual(frame.dtypes.unique().tolist(), [np.int64])
+        npt.assert_array_equal(analyze.timings(frame), 1)
+
+    def test_from_frame(self):
+        """Test that a buffer round-trips through a DataFrame."""
+        buf = SampleBuffer(["fn1", "fn2"])
+        buf.extend(np.arange(20).reshape(5, 4))
+        copy = SampleBuffer.from_frame(buf.to_frame())
+        pdt.assert_frame_equal(copy.to_frame(), buf.to_frame())
+        self.assertFalse(np.shares_memory(buf.to_frame().values, buf.view()))
+
+    def test_ragged_frame(self):
+        """Test that functions sampled independently pad with NaN."""
+        buf = SampleBuffer(["fn1", "fn2"])
+        buf.extend_function(0, [[0, 10], [10, 30], [30, 60]])
+        buf.extend_function(1, [[0, 5]])
+        npt.assert_array_equal(buf.sizes, [3, 1])
+        frame = buf.frame()
+        self.assertEqual(len(frame.index), 3)
+        npt.assert_array_equal(
+            analyze.timings(frame)["fn2"], [5, np.nan, np.nan]
+        )
+        with self.assertRaises(ValueError):
+            buf.append([0, 1, 2, 3])
+        copy = SampleBuffer.from_frame(frame)
+        npt.assert_array_equal(copy.sizes, [3, 1])
+        npt.assert_array_equal(copy.function_view(0), buf.function_view(0))
+
+    def test_view_while_appending(self):
+        """Test that views taken from another thread are complete."""
+        buf = SampleBuffer(["fn1"], capacity=1)
+        done = threading.Event()
+
+        def write():
+            for i in range(1, 100001):
+                buf.append([i, i])
+            done.set()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        while not done.is_set():
+            view = buf.view()
+            npt.assert_array_equal(view[:, 0], np.arange(1, len(view) + 1))
+        writer.join()
+        self.assertEqual(len(buf), 100000)
+
+    def test_discard(self):
+        """Test that discarded samples keep their row numbers."""
+        buf = SampleBuffer(["fn1"])
+        buf.extend([[i, i + 1] for i in range(10)])
+        buf.discard(4)
+        self.assertEqual(len(buf), 10)
+        self.assertEqual(buf.first, 4)
+        npt.assert_array_equal(buf.view()[:, 0], np.arange(4, 10))
+        self.assertEqual(list(buf.frame().index), list(range(4, 10)))
+        npt.assert_array_equal(buf.function_view(0, 6)[:, 0], [6, 7, 8, 9])
+        with self.assertRaises(ValueError):
+            buf.function_view(0, 2)
+
+    def test_truncate(self):
+        """Test that truncating evens out functions sampled apart."""
+        buf = SampleBuffer(["fn1", "fn2"])
+        buf.extend_function(0, [[i, i + 1] for i in range(5)])
+        buf.extend_function(1, [[i, i + 2] for i in range(3)])
+        buf.truncate(4)
+        npt.assert_array_equal(buf.sizes, [4, 3])
+        buf.truncate(3)
+        self.assertEqual(len(buf), 3)
+        buf.append([0, 1, 0, 2])
+        npt.assert_array_equal(analyze.timings(buf.frame())["fn2"], 2)
+
+
+class TestCollect(unittest.TestCase):
+    """Tests for `perfume.collect` module."""
+
+    def test_batched_timings(self):
+        """Test that batched samples report latency per call."""
+        buf = SampleBuffer(["fn1"], collect.fields(batch=4))
+        buf.extend([[0, 400, 4], [400, 1200, 8]])
+        frame = buf.frame()
+        npt.assert_array_equal(analyze.timings(frame)["fn1"], [100, 100])
+        npt.assert_array_equal(analyze.durations(frame)["fn1"], [400, 800])
+
+    def test_collector_batches(self):
+        """Test that the collector records batch sizes."""
+        calls = []
+        buf = SampleBuffer(["append"], collect.fields(batch=5))
+        collector = collect.Collector([lambda: calls.append(1)], buf, batch=5)
+        for _ in range(3):
+            collector.collect()
+        self.assertEqual(len(calls), 15)
+        npt.assert_array_equal(buf.frame()[("append", "batch")], 5)
+
+    def test_autorange(self):
+        """Test that the batch follows the latency of one call."""
+        autorange = collect.Autorange(target_ns=1000, alpha=1.0)
+        self.assertEqual(autorange.observe(10, 1), 128)
+        # Staying within a factor of a few of the target keeps the batch.
+        self.assertEqual(autorange.observe(128 * 12, 128), 128)
+        self.assertEqual(autorange.observe(128 * 100, 128), 16)
+
+    def test_calibration(self):
+        """Test that calibration measures a plausible timer overhead."""
+        calibration = collect.Calibration.measure(count=100, warmup=10)
+        self.assertEqual(len(calibration.overhead_ns), 100)
+        self.assertGreaterEqual(calibration.median_overhead_ns, 0)
+        self.assertGreater(calibration.resolution_ns, 0)
+
+    def test_subtract_overhead(self):
+        """Test that subtracting overhead never makes a sample negative."""
+        buf = SampleBuffer(["noop"])
+        collector = collect.Collector([lambda: None], buf, overhead_ns=10 ** 9)
+        collector.collect()
+        npt.assert_array_equal(analyze.timings(buf.frame()), 0)
+
+    def test_near_resolution(self):
+        """Test flagging functions too fast for the clock."""
+        t = pd.DataFrame({"fast": [50, 60, 70], "slow": [10 ** 6] * 3})
+        self.assertEqual(analyze.near_resolution(t, 1), ["fast"])
+        self.assertEqual(analyze.near_resolution(t, 10 ** 5), ["fast", "slow"])
+
+    def test_gc_record(self):
+        """Test that collections during a call are recorded."""
+        buf = SampleBuffer(["collect"], collect.fields(gc_mode="record"))
+        collector = collect.Collector(
+            [lambda: gc.collect(1)], buf, gc_mode="record"
+        )
+        try:
+            collector.collect()
+            collector.collect()
+        finally:
+            collector.close()
+        self.assertFalse(
+            any(isinstance(cb, collect.GcRecorder) for cb in gc.callbacks)
+        )
+        frame = buf.frame()
+        npt.assert_array_equal(analyze.gc_generations(frame)["collect"], 1)
+        self.assertTrue((analyze.gc_durations(frame)["collect"] > 0).all())
+        npt.assert_array_equal(frame[("collect", "gc2")], 0)
+
+    def test_gc_record_teardown(self):
+        """Test that collections during teardown aren't recorded."""
+        buf = SampleBuffer(["fn1"], collect.fields(gc_mode="record"))
+        collector = collect.Collector(
+            [lambda: None],
+            buf,
+            teardowns=[lambda: gc.collect()],
+            gc_mode="record",
+        )
+        try:
+            collector.collect()
+        finally:
+            collector.close()
+        self.assertEqual(analyze.gc_generations(buf.frame())["fn1"][0], -1)
+
+    def test_gc_disable(self):
+        """Test that the GC is off only during timed calls."""
+        enabled = []
+        buf = SampleBuffer(["check"])
+        collector = collect.Collector(
+            [lambda: enabled.append(gc.isenabled())], buf, gc_mode="disable"
+        )
+        collector.collect()
+        collector.close()
+        self.assertEqual(enabled, [False])
+        self.assertTrue(gc.isenabled())
+
+        def boom():
+            raise ValueError("boom")
+
+        collector = collect.Collector([boom], buf, gc_mode="disable")
+        with self.assertRaises(ValueError):
+            collector.collect()
+        collector.close()
+        self.assertTrue(gc.isenabled())
+
+    def test_split_gc(self):
+        """Test splitting timings by the generations collected."""
+        buf = SampleBuffer(["fn1"], collect.fields(gc_mode="record"))
+        buf.extend(
+            [
+                [0, 10, 0, 0, 0],
+                [10, 30, 5, 0, 0],
+                [30, 130, 5, 0, 80],
+            ]
+        )
+        clean, hit = analyze.split_gc(buf.frame(), generation=2)
+        npt.assert_array_equal(clean["fn1"], [10, 20, np.nan])
+        npt.assert_array_equal(hit["fn1"], [np.nan, np.nan, 100])
+        npt.assert_array_equal(
+            analyze.gc_generations(buf.frame())["fn1"], [-1, 0, 2]
+        )
+
+    def test_fixtures(self):
+        """Test that setup and teardown run untimed, around each call."""
+        made, used, cleaned = [], [], []
+
+        def setup():
+            time.sleep(0.005)
+            made.append(len(made))
+            return made[-1]
+
+        buf = SampleBuffer(["use"], collect.fields(batch=2, fixture=True))
+        collector = collect.Collector(
+            [used.append],
+            buf,
+            batch=2,
+            setups=[setup],
+            teardowns=[cleaned.append],
+        )
+        collector.collect()
+        collector.collect()
+        self.assertEqual(made, [0, 1, 2, 3])
+        self.assertEqual(used, made)
+        self.assertEqual(cleaned, made)
+        frame = buf.frame()
+        self.assertTrue((analyze.timings(frame)["use"] < 5 * 10 ** 6).all())
+        self.assertTrue(
+            (analyze.fixture_durations(frame)["use"] >= 10 ** 7).all()
+        )
+
+    def test_memory(self):
+        """Test recording peak and net memory per sample."""
+        kept = []
+        fns = [lambda: bytearray(10 ** 6), lambda: kept.append([0] * 10)]
+        for mode in ("tracemalloc", "blocks"):
+            buf = SampleBuffer(["temp", "keep"], collect.fields(memory=mode))
+            collector = collect.Collector(fns, buf, memory=mode)
+            try:
+                for _ in range(5):
+                    collector.collect()
+            finally:
+                collector.close()
+            memory = analyze.memory_use(buf.frame())
+            if mode == "tracemalloc":
+                self.assertTrue((memory["temp"] >= 10 ** 6).all())
+                self.assertTrue((memory["keep"] < 10 ** 4).all())
+            else:
+                # The list is kept, the bytearray is freed.
+                self.assertGreater(
+                    memory["keep"].median(), memory["temp"].median()
+                )
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_cpu_time(self):
+        """Test splitting calls into on-CPU and off-CPU time."""
+        fns = [lambda: time.sleep(0.002), lambda: sum(range(10 ** 5))]
+        buf = SampleBuffer(["sleep", "spin"], collect.fields(cpu_time=True))
+        collector = collect.Collector(fns, buf, cpu_time=True)
+        for _ in range(5):
+            collector.collect()
+        on, off = analyze.split_cpu(buf.frame())
+        self.assertGreater(off["sleep"].median(), on["sleep"].median())
+        self.assertGreater(on["spin"].median(), off["spin"].median())
+        process = analyze.cpu_times(buf.frame(), clock="process")
+        self.assertTrue((process >= 0).all().all())
+
+    def test_rusage(self):
+        """Test recording page faults and context switches."""
+        fns = [lambda: time.sleep(0.001), lambda: bytearray(10 ** 7)]
+        buf = SampleBuffer(["sleep", "alloc"], collect.fields(rusage=True))
+        collector = collect.Collector(fns, buf, rusage=True)
+        for _ in range(5):
+            collector.collect()
+        samples = buf.frame()
+        switches = samples.xs("nvcsw", axis=1, level=1)
+        self.assertTrue((switches["sleep"] > 0).all())
+        faulted = analyze.page_faulted(samples, minor=True)
+        self.assertTrue(faulted["alloc"].any())
+        clean, hit = analyze.split_os_noise(samples, minor_faults=True)
+        npt.assert_array_equal(clean.count() + hit.count(), [5, 5])
+        tail = analyze.os_noise_in_tail(samples)
+        self.assertEqual(list(tail.index), ["sleep", "alloc"])
+
+    def test_latin_order(self):
+        """Test that every function takes every position in turn."""
+        calls = []
+        fns = [
+            lambda: calls.append("a"),
+            lambda: calls.append("b"),
+            lambda: calls.append("c"),
+        ]
+        buf = SampleBuffer(list("abc"), collect.fields(order="latin"))
+        collector = collect.Collector(fns, buf, order="latin")
+        for _ in range(3):
+            collector.collect()
+        self.assertEqual("".join(calls), "abcbcacab")
+        positions = buf.frame().xs("position", axis=1, level=1)
+        npt.assert_array_equal(positions["a"], [0, 2, 1])
+
+    def test_blocked_order(self):
+        """Test that blocked rounds call each function several times."""
+        calls = []
+        fns = [lambda: calls.append("a"), lambda: calls.append("b")]
+        buf = SampleBuffer(list("ab"), collect.fields(order="blocked"))
+        collector = collect.Collector(fns, buf, order=("blocked", 3))
+        collector.collect()
+        self.assertEqual("".join(calls), "aaabbb")
+        self.assertEqual(len(buf), 3)
+        npt.assert_array_equal(buf.frame()[("b", "position")], [3, 4, 5])
+        with self.assertRaises(ValueError):
+            collect.Collector(fns, buf, order="sorted")
+
+    def test_order_effects(self):
+        """Test detecting timings that depend on call position."""
+        rng = np.random.RandomState(0)
+        first = rng.randint(100, 110, size=50)
+        buf = SampleBuffer(["fn1", "fn2"], collect.fields(order="shuffle"))
+        for i, t in enumerate(first):
+            slow = i % 2
+            buf.append([0, t + 50 * slow, slow, 0, t, 1 - slow])
+        frame = buf.frame()
+        medians = analyze.position_timings(frame)
+        self.assertGreater(medians.loc[1, "fn1"], medians.loc[0, "fn1"])
+        effects = analyze.order_effects(frame)
+        self.assertLess(effects.loc["fn1", "pvalue"], 0.001)
+        self.assertGreater(effects.loc["fn2", "pvalue"], 0.001)
+
+    def test_render_thread_final_update(self):
+        """Test that a render thread's display ends up up to date."""
+        updates = []
+
+        class Recorder(object):
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def update(self, samples):
+                updates.append(len(samples.index))
+
+        def noop():
+            pass
+
+        samples = perfume.bench(
+            noop,
+            max_samples=10 ** 5,
+            calibrate=False,
+            render="thread",
+            display=Recorder,
+        )
+        self.assertEqual(updates[-1], len(samples))
+
+
+class TestHistogram(unittest.TestCase):
+    """Tests for `perfume.histogram` module."""
+
+    def setUp(self):
+        self.values = np.random.RandomState(0).lognormal(10, 1, 10000)
+        self.histogram = Histogram(significant_digits=2)
+        self.histogram.record(self.values.astype(np.int64))
+
+    def test_precision(self):
+        """Test that buckets are within the requested precision."""
+        lower, upper, counts = self.histogram.buckets()
+        self.assertEqual(counts.sum(), len(self.values))
+        self.assertTrue(((upper - lower) / np.maximum(lower, 1) <= .01).all())
+        for q in (.25, .5, .99):
+            self.assertAlmostEqual(
+                self.histogram.quantile(q) / np.quantile(self.values, q),
+                1.,
+                places=2,
+            )
+
+    def test_exact_moments(self):
+        """Test that the mean and standard deviation are exact."""
+        values = self.values.astype(np.int64)
+        self.assertAlmostEqual(self.histogram.mean, values.mean())
+        self.assertAlmostEqual(self.histogram.std / values.std(ddof=1), 1.)
+        self.assertEqual(self.histogram.min, values.min())
+        self.assertEqual(self.histogram.max, values.max())
+
+    def test_merge(self):
+        """Test that merging equals recording everything in one."""
+        other = Histogram(significant_digits=2)
+        other.record(np.arange(10 ** 6, 2 * 10 ** 6, 1000))
+        merged = Histogram(significant_digits=2)
+        merged.merge(self.histogram)
+        merged.merge(other)
+        both = Histogram(significant_digits=2)
+        both.record(self.values.astype(np.int64))
+        both.record(np.arange(10 ** 6, 2 * 10 ** 6, 1000))
+        for a, b in zip(merged.buckets(), both.buckets()):
+            npt.assert_array_equal(a, b)
+        self.assertEqual(merged.max, both.max)
+
+    def test_density(self):
+        """Test that bins regrouped from buckets match numpy's."""
+        values = self.values.astype(np.int64)
+        density, edges = self.histogram.density(max_bins=50)
+        self.assertEqual(len(density), 50)
+        self.assertEqual(edges[0], values.min())
+        self.assertEqual(edges[-1], values.max())
+        expected, _ = np.histogram(values, bins=edges, density=True)
+        npt.assert_allclose(density, expected, atol=density.max() / 100)
+
+    def test_ks_test(self):
+        """Test that K-S tests on histograms match the samples'."""
+        rng = np.random.RandomState(0)
+        t = pd.DataFrame(
+            {
+                "fn1": rng.lognormal(10, 1, 5000),
+                "fn2": rng.lognormal(10.1, 1, 5000),
+                "fn3": rng.lognormal(10, 1, 5000),
+            }
+        )
+        histograms = [Histogram() for _ in t.columns]
+        for h, name in zip(histograms, t.columns):
+            h.record(t[name].values)
+        pdt.assert_frame_equal(
+            histogram.ks_test(t.columns, histograms),
+            analyze.ks_test(t),
+            atol=.05,
+        )
+
+    def test_update_frame(self):
+        """Test that overlapping frames record each sample once."""
+        buf = SampleBuffer(["fn1"], ["begin", "end", "warmup"])
+        buf.extend([[0, 100, 1], [0, 10, 0], [0, 20, 0]])
+        histograms = FunctionHistograms()
+        histograms.update_frame(buf.frame())
+        buf.extend([[0, 30, 1]])
+        histograms.update_frame(buf.frame())
+        self.assertEqual(histograms.counts, [2])
+        buf.fill_function(0, "warmup", 0, 3)
+        buf.extend([[0, 40, 0]])
+        histograms.update_frame(buf.frame().iloc[2:])
+        self.assertEqual(histograms.counts, [4])
+        stats = histograms.describe()
+        self.assertEqual(stats.loc["max", "fn1"], 40)
+        self.assertEqual(stats.loc["mean", "fn1"], 25)
+
+
+class TestSketch(unittest.TestCase):
+    """Tests for `perfume.sketch` module."""
+
+    def setUp(self):
+        self.values = np.random.RandomState(0).lognormal(10, 1, 100000)
+
+    def test_accuracy(self):
+        """Test that quantiles are close in rank, and moments exact."""
+        sketch = KLL(seed=0)
+        sketch.update(self.values)
+        self.assertLess(len(sketch), 1000)
+        qs = np.array([.01, .5, .99])
+        ranks = np.searchsorted(np.sort(self.values), sketch.quantile(qs))
+        npt.assert_allclose(ranks / len(self.values), qs, atol=.01)
+        self.assertAlmostEqual(sketch.cdf(np.median(self.values)), .5, 2)
+        self.assertAlmostEqual(sketch.mean / self.values.mean(), 1.)
+        self.assertEqual(sketch.max, self.values.max())
+        self.assertEqual(sketch.quantile(0.), self.values.min())
+
+    def test_merge(self):
+        """Test that merged sketches summarize every value."""
+        merged = KLL(seed=0)
+        for part in np.array_split(self.values, 10):
+            sketch = KLL.from_dict(KLL(seed=1).to_dict())
+            sketch.update(part)
+            merged.merge(KLL.from_dict(sketch.to_dict()))
+        self.assertEqual(merged.count, len(self.values))
+        rank = np.searchsorted(np.sort(self.values), merged.quantile(.9))
+        self.assertAlmostEqual(rank / len(self.values), .9, 2)
+        with self.assertRaises(ValueError):
+            merged.merge(KLL(k=100))
+
+    def test_analyze(self):
+        """Test sketching, merging and describing runs of samples."""
+        buf = SampleBuffer(["fn1", "fn2"])
+        buf.extend([[0, i, 0, 2 * i] for i in range(1, 101)])
+        runs = [
+            analyze.sketches(buf.frame().iloc[:50]),
+            analyze.sketches(buf.frame().iloc[50:]),
+        ]
+        stats = analyze.describe_sketches(analyze.merge_sketches(*runs))
+        self.assertEqual(list(stats.columns), ["fn1", "fn2"])
+        npt.assert_array_equal(stats.loc["count"], [100, 100])
+        npt.assert_array_equal(stats.loc["max"], [100, 200])
+        self.assertEqual(stats.loc["50%", "fn1"], 50)
+        self.assertEqual(runs[0]["fn1"].count, 50)
+
+
+class TestStop(unittest.TestCase):
+    """Tests for `perfume.stop` module."""
+
+    def test_max_samples(self):
+        """Test stopping after a number of samples."""
+        buf = SampleBuffer(["fn1", "fn2"])
+        condition = stop.MaxSamples(2)
+        buf.append([0, 1, 0, 1])
+        self.assertFalse(condition(buf))
+        buf.append([0, 1, 0, 1])
+        self.assertTrue(condition(buf))
+
+    def test_max_samples_exact(self):
+        """Test that bench returns no more than max_samples."""
+
+        def noop():
+            pass
+
+        async def async_noop():
+            pass
+
+        display = functools.partial(cli.TerminalDisplay, interval=float("inf"))
+        options = {"max_samples": 200, "calibrate": False, "display": display}
+        self.assertEqual(len(perfume.bench(noop, threads=2, **options)), 200)
+        self.assertEqual(len(perfume.bench(noop, rate=1e4, **options)), 200)
+        self.assertEqual(
+            len(asyncio.run(perfume.bench_async(async_noop, **options))), 200
+        )
+
+    def test_converged(self):
+        """Test stopping once a quantile is known precisely."""
+        rng = np.random.RandomState(0)
+        buf = SampleBuffer(["fn1"])
+        condition = stop.Converged(0.5, rel_tol=0.05, min_samples=10)
+        stopped_at = None
+        for i in range(100):
+            begin = rng.randint(0, 10 ** 6, size=100)
+            latency = rng.normal(10000, 2000, size=100).astype(np.int64)
+            buf.extend(np.stack([begin, begin + latency], axis=1))
+            if condition(buf):
+                stopped_at = len(buf)
+                break
+        self.assertIsNotNone(stopped_at)
+        self.assertGreater(stopped_at, 100)
+        (low, high), = condition.intervals()
+        self.assertLess(low, 10000)
+        self.assertGreater(high, 10000)
+
+
+class TestWarmup(unittest.TestCase):
+    """Tests for `perfume.warmup` module."""
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.timings = np.concatenate(
+            [
+                np.linspace(5000, 1000, 100),
+                rng.normal(1000, 20, 900),
+            ]
+        ).astype(np.int64)
+
+    def test_mser(self):
+        """Test finding the end of a decaying warm-up."""
+        boundary = warmup.mser(self.timings)
+        self.assertGreaterEqual(boundary, 50)
+        self.assertLessEqual(boundary, 150)
+        # Still decaying, so not steady yet.
+        self.assertIsNone(warmup.mser(self.timings[:100]))
+
+    def test_detector(self):
+        """Test that warm-up samples stay flagged and are left out."""
+        buf = SampleBuffer(["fn1"], collect.fields(warmup=True))
+        detector = warmup.WarmupDetector()
+        histograms = FunctionHistograms()
+        end = np.cumsum(self.timings)
+        for i in range(0, len(end), 10):
+            rows = np.zeros((10, 3), dtype=np.int64)
+            rows[:, 0] = end[i:i + 10] - self.timings[i:i + 10]
+            rows[:, 1] = end[i:i + 10]
+            buf.extend(rows)
+            detector(buf)
+            histograms.update(buf)
+        boundary = detector.boundaries[0]
+        self.assertIsNotNone(boundary)
+        flags = analyze.warmup_flags(buf.frame())["fn1"]
+        self.assertEqual(flags.sum(), boundary)
+        self.assertTrue(flags[:boundary].all())
+        t = analyze.timings(buf.frame())["fn1"]
+        self.assertEqual(t.count(), len(self.timings) - boundary)
+        self.assertEqual(histograms.counts[0], t.count())
+
+
+class TestAllocate(unittest.TestCase):
+    """Tests for `perfume.allocate` module."""
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.buf = SampleBuffer(["steady", "noisy"])
+        begin = np.zeros(1000, dtype=np.int64)
+        steady = rng.normal(10000, 10, size=1000).astype(np.int64)
+        noisy = rng.normal(10000, 3000, size=1000).astype(np.int64)
+        self.buf.extend(np.stack([begin, steady, begin, noisy], axis=1))
+
+    def _chosen(self, allocation, rounds=100):
+        counts = np.zeros(2, dtype=np.int64)
+        for _ in range(rounds):
+            counts[list(allocation.choose(self.buf))] += 1
+        return counts
+
+    def test_quantile_uncertainty(self):
+        """Test that the noisier function is called more."""
+        counts = self._chosen(allocate.QuantileUncertainty())
+        self.assertEqual(counts[1], 100)
+        self.assertLess(counts[0], 20)
+
+    def test_ks_uncertainty(self):
+        """Test that similar functions keep both being called."""
+        counts = self._chosen(allocate.KsUncertainty())
+        self.assertEqual(counts.max(), 100)
+        self.assertGreater(counts.min(), 50)
+
+    def test_collector(self):
+        """Test that allocation samples functions independently."""
+        buf = SampleBuffer(["fn1", "fn2"])
+        allocation = allocate.QuantileUncertainty(min_samples=10)
+        collector = collect.Collector(
+            [lambda: None, lambda: sum(range(100))], buf, allocation=allocation
+        )
+        for _ in range(100):
+            collector.collect()
+        # Every round calls at least one function, but not always both.
+        self.assertGreaterEqual(buf.sizes.sum(), 100)
+        self.assertLess(buf.sizes.sum(), 200)
+        self.assertGreaterEqual(buf.sizes.min(), 10)
+
+
+class TestScaling(unittest.TestCase):
+    """Tests for `perfume.scaling` module."""
+
+    @staticmethod
+    def _samples(sizes, latency):
+        rng = np.random.RandomState(0)
+        buf = SampleBuffer(sizes)
+        ends = np.cumsum(
+            [
+                latency(np.array(sizes, dtype=np.float64))
+                * rng.uniform(0.95, 1.05, len(sizes))
+                for _ in range(50)
+            ],
+            axis=0,
+        ).astype(np.int64)
+        begins = np.vstack([np.zeros((1, len(sizes)), np.int64), ends[:-1]])
+        buf.extend(np.dstack([begins, ends]).reshape(50, -1))
+        return buf.frame()
+
+    def test_fit(self):
+        """Test picking the right complexity class."""
+        sizes = [10, 100, 1000, 10000]
+        for model, latency in [
+            ("O(1)", lambda n: 500 + 0 * n),
+            ("O(n)", lambda n: 100 + 5 * n),
+            ("O(n log n)", lambda n: 3 * n * np.log(n)),
+            ("O(n^2)", lambda n: 1000 + n * n),
+        ]:
+            fits = scaling.fit(self._samples(sizes, latency), [0.5])
+            best = fits[fits["best"]].index.get_level_values("model")
+            self.assertEqual(list(best), [model])
+        fits = scaling.fit(self._samples(sizes, lambda n: n ** 1.5), [0.5])
+        self.assertAlmostEqual(fits.loc[(0.5, "power"), "b"], 1.5, places=1)
+
+    def test_sweep(self):
+        """Test benchmarking a function across sizes."""
+        samples = perfume.sweep(
+            lambda data: sorted(data),
+            [10, 100],
+            setup=lambda n: list(range(n, 0, -1)),
+            max_samples=5,
+        )
+        self.assertEqual(list(samples.columns.unique(level=0)), [10, 100])
+        self.assertEqual(len(samples), 5)
+
+
+class TestAio(unittest.TestCase):
+    """Tests for `perfume.aio` module."""
+
+    def test_collector(self):
+        """Test awaiting coroutines from several tasks."""
+        calls = []
+
+        async def sleep():
+            calls.append(1)
+            await asyncio.sleep(0.001)
+
+        buf = SampleBuffer(["sleep"], collect.fields(worker=True, lag=True))
+        collector = aio.AsyncCollector(
+            [sleep], buf, concurrency=3, chunk_seconds=0.01
+        )
+        asyncio.run(collector.collect())
+        frame = buf.frame()
+        self.assertEqual(len(buf), len(calls))
+        self.assertEqual(set(frame[("sleep", "worker")]), {0, 1, 2})
+        self.assertTrue((analyze.timings(frame)["sleep"] >= 10 ** 6).all())
+        lag = frame[("sleep", "lag")]
+        self.assertTrue((lag >= 0).all())
+        self.assertTrue((lag < analyze.timings(frame)["sleep"]).all())
+
+    def test_lag_excludes_own_work(self):
+        """Test that a call blocking the loop isn't its own lag."""
+
+        async def spin():
+            deadline = time.perf_counter() + 0.002
+            while time.perf_counter() < deadline:
+                pass
+
+        buf = SampleBuffer(["spin"], collect.fields(lag=True))
+        collector = aio.AsyncCollector([spin], buf, chunk_seconds=0.02)
+        asyncio.run(collector.collect())
+        frame = buf.frame()
+        self.assertTrue((analyze.timings(frame)["spin"] >= 2 * 10 ** 6).all())
+        self.assertTrue((frame[("spin", "lag")] < 10 ** 6).all())
+
+    def test_bench_rejects_coroutines(self):
+        """Test that coroutine functions aren't silently never awaited."""
+
+        async def noop():
+            pass
+
+        with self.assertRaises(TypeError):
+            perfume.bench(noop)
+
+
+class TestLoad(unittest.TestCase):
+    """Tests for `perfume.load` module."""
+
+    def test_closed_loop(self):
+        """Test that threads overlap calls and raise throughput."""
+        buf = SampleBuffer(["sleep"], collect.fields(worker=True))
+        driver = load.ClosedLoop(
+            [lambda: time.sleep(0.001)], buf, threads=4, chunk_seconds=0.05
+        )
+        driver.collect()
+        frame = buf.frame()
+        self.assertEqual(set(frame[("sleep", "worker")]), {0, 1, 2, 3})
+        # Four callers sleeping 1ms each can't exceed 4000 calls/s.
+        calls = analyze.throughput(frame)["sleep"]
+        self.assertGreater(calls, 1500)
+        self.assertLess(calls, 4000)
+
+    def test_errors(self):
+        """Test that a load thread's exception is raised by collect."""
+
+        def boom():
+            raise ValueError("boom")
+
+        fields = collect.fields(worker=True, intended=True)
+        for driver in (
+            load.ClosedLoop([boom], SampleBuffer(["boom"], fields), 2),
+            load.OpenLoop([boom], SampleBuffer(["boom"], fields), 1000),
+        ):
+            with self.assertRaisesRegex(ValueError, "boom"):
+                driver.collect()
+
+    def test_overlapping_isolate(self):
+        """Test isolating and placing overlapping calls per worker."""
+        buf = SampleBuffer(["fn1"], collect.fields(worker=True))
+        buf.extend(
+            [
+                [0, 10, 0],
+                [5, 15, 1],
+                [12, 20, 0],
+                [15, 25, 1],
+            ]
+        )
+        iso = analyze.isolate(buf.frame())
+        npt.assert_array_equal(iso[("fn1", "begin")], [0, 0, 10, 10])
+        npt.assert_array_equal(iso[("fn1", "end")], [10, 10, 18, 20])
+        in_context = analyze.timings_in_context(buf.frame())
+        self.assertEqual(len(in_context), 4)
+        npt.assert_array_equal(in_context["fn1"], [10, 10, 8, 10])
+        self.assertEqual(analyze.throughput(buf.frame())["fn1"], 4 / 25e-9)
+
+    def test_open_loop(self):
+        """Test that calls are started on schedule, however slow."""
+        fields = collect.fields(worker=True, intended=True)
+        buf = SampleBuffer(["fast", "slow"], fields)
+        driver = load.OpenLoop(
+            [lambda: None, lambda: time.sleep(0.004)],
+            buf,
+            rate=500,
+            chunk_seconds=0.04,
+        )
+        for _ in range(8):
+            driver.collect()
+        frame = buf.frame()
+        self.assertEqual(buf.sizes[0], 80)
+        npt.assert_array_equal(
+            np.diff(frame[("fast", "intended")].iloc[:20]), 2 * 10 ** 6
+        )
+        # Each 4ms call falls further behind its 2ms schedule, the wait
+        # counts towards latency, and the backlog carries over from
+        # one turn to the next.
+        self.assertLess(buf.sizes[1], 60)
+        latency = analyze.timings(frame)["slow"].dropna()
+        service = analyze.service_times(frame)["slow"].dropna()
+        self.assertTrue((latency >= service).all())
+        self.assertGreater(latency.iloc[-1], 60 * 10 ** 6)
+        self.assertLess(service.max(), 30 * 10 ** 6)
+
+    def test_open_loop_wakes_on_time(self):
+        """Test that late wake-ups aren't counted as latency."""
+        buf = SampleBuffer(
+            ["noop"], collect.fields(worker=True, intended=True)
+        )
+        driver = load.OpenLoop(
+            [lambda: None], buf, rate=200, chunk_seconds=0.1
+        )
+        driver.collect()
+        frame = buf.frame()
+        wait = analyze.timings(frame) - analyze.service_times(frame)
+        self.assertLess(wait["noop"].median(), 50 * 10 ** 3)
+        # Throughput counts only time calls were in flight, so it's
+        # the rate calls are served at, far above the rate offered.
+        self.assertGreater(analyze.throughput(frame)["noop"], 2000)
+
+
+class TestWorkers(unittest.TestCase):
+    """Tests for `perfume.workers` module."""
+
+    def test_pool(self):
+        """Test that workers stream samples back for every function."""
+        buf = SampleBuffer(["fn1", "fn2"], collect.fields(worker=True))
+        pool = workers.WorkerPool(
+            [lambda: None, lambda: None], buf, replicas=2, chunk_seconds=0.01
+        )
+        self.assertEqual(len(pool), 4)
+        deadline = time.perf_counter() + 10
+        while (buf.sizes == 0).any() and time.perf_counter() < deadline:
+            pool.poll(0.01)
+        pool.stop()
+        frame = buf.frame()
+        self.assertTrue((buf.sizes > 0).all())
+        self.assertLessEqual(set(frame["fn1"]["worker"].dropna()), {0, 1})
+        self.assertLessEqual(set(frame["fn2"]["worker"].dropna()), {2, 3})
+
+    def test_failure(self):
+        """Test that a worker's exception is raised in the parent."""
+
+        def boom():
+            raise ValueError("boom")
+
+        buf = SampleBuffer(["fn1"], collect.fields(worker=True))
+        pool = workers.WorkerPool([boom], buf, replicas=2, chunk_seconds=0.01)
+        with self.assertRaisesRegex(workers.WorkerError, "ValueError: boom"):
+            pool.stop()
+
+
+class TestStore(unittest.TestCase):
+    """Tests for `perfume.store` module."""
+
+    def test_round_trip(self):
+        """Test that ragged samples and warm-up flags read back."""
+        buf = SampleBuffer(["fn1", "fn2"], ["begin", "end", "warmup"])
+        buf.extend_function(0, [[i, i + 1, 1] for i in range(7)])
+        buf.extend_function(1, [[i, i + 2, 1] for i in range(3)])
+        with tempfile.TemporaryDirectory() as directory:
+            s = store.SampleStore.create(
+                directory, buf.names, buf.fields, chunk_rows=2
+            )
+            self.assertEqual(s.write(buf), 4)
+            npt.assert_array_equal(s.sizes, [6, 2])
+            s.warmup = [3, None]
+            s.close(buf)
+            frame = store.SampleStore.open(directory).to_frame()
+        npt.assert_array_equal(frame[("fn1", "warmup")], [1] * 3 + [0] * 4)
+        npt.assert_array_equal(frame[("fn2", "warmup")].dropna(), [1] * 3)
+        npt.assert_array_equal(analyze.timings(frame)["fn1"][3:], 1)
+        self.assertEqual(frame[("fn2", "begin")].count(), 3)
+
+    def test_crash(self):
+        """Test that a store left unclosed keeps its whole chunks."""
+        buf = SampleBuffer(["fn1"])
+        buf.extend([[i, i + 1] for i in range(25)])
+        with tempfile.TemporaryDirectory() as directory:
+            s = store.SampleStore.create(
+                directory, buf.names, buf.fields, chunk_rows=10
+            )
+            s.write(buf)
+            # A chunk whose manifest update never happened.
+            with open(os.path.join(directory, "000-000002.npy"), "wb"):
+                pass
+            reopened = store.SampleStore.open(directory)
+            npt.assert_array_equal(reopened.sizes, [20])
+            npt.assert_array_equal(
+                reopened.function_samples(0)[:, 0], np.arange(20)
+            )
+            with self.assertRaises(ValueError):
+                store.SampleStore.create(directory, buf.names, buf.fields)
+
+    def test_resume(self):
+        """Test that bench resumes from a store and goes on filling it."""
+
+        def noop():
+            pass
+
+        buf = SampleBuffer(["noop"], collect.fields())
+        buf.extend([[i, i + 1] for i in range(50)])
+        with tempfile.TemporaryDirectory() as directory:
+            store.SampleStore.create(directory, buf.names, buf.fields).close(
+                buf
+            )
+            samples = perfume.bench(
+                noop,
+                samples=directory,
+                max_samples=80,
+                calibrate=False,
+                display=functools.partial(
+                    cli.TerminalDisplay, interval=float("inf")
+                ),
+            )
+            sizes = store.SampleStore.open(directory).sizes
+        npt.assert_array_equal(sizes, [len(samples)])
+        self.assertGreaterEqual(len(samples), 80)
+        pdt.assert_frame_equal(samples.iloc[:50], buf.to_frame())
+
+    def test_bench(self):
+        """Test that bench streams samples out of memory and back."""
+
+        def noop():
+            pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            s = store.SampleStore.create(
+                directory,
+                ["noop"],
+                collect.fields(),
+                chunk_rows=100,
+                fsync="never",
+            )
+            samples = perfume.bench(
+                noop,
+                max_samples=1000,
+                calibrate=False,
+                display=functools.partial(
+                    cli.TerminalDisplay, interval=float("inf")
+                ),
+                store=s,
+            )
+            npt.assert_array_equal(s.sizes, [len(samples)])
+        self.assertGreaterEqual(len(samples), 1000)
+        self.assertEqual(list(samples.index), list(range(len(samples))))
+        self.assertTrue((analyze.timings(samples)["noop"] > 0).all())
+
+    def test_bad_options(self):
+        """Test that failing to set up bench leaves nothing behind."""
+
+        def noop():
+            pass
+
+        def display(*args, **kwargs):
+            raise ValueError("Can't display")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "store")
+            for options in (
+                {"processes": 1, "threads": 1},
+                {"rate": -1},
+                {"gc": "bogus"},
+                {"subtract_overhead": True, "calibrate": False},
+                {"gc": "record", "display": display, "calibrate": False},
+            ):
+                with self.assertRaises(ValueError):
+                    perfume.bench(noop, store=path, **options)
+                self.assertFalse(os.path.exists(path))
+                self.assertFalse(
+                    any(
+                        isinstance(cb, collect.GcRecorder)
+                        for cb in gc.callbacks
+                    )
+                )
+
+
+class TestAggregate(unittest.TestCase):
+    """Tests for `perfume.aggregate` module."""
+
+    def test_windows(self):
+        """Test that latencies are split into windows by end time."""
+        buf = SampleBuffer(["fn1"], ["begin", "end", "warmup"])
+        buf.extend([[0, 10 ** 9, 1]])
+        buf.extend([[i * 10 ** 8, i * 10 ** 8 + i, 0] for i in range(1, 30)])
+        agg = aggregate.Aggregate(window_seconds=1, reservoir=5, seed=0)
+        agg.update(buf)
+        self.assertEqual(agg.counts, [29])
+        self.assertEqual(agg.windows, [0, 1, 2])
+        stats = agg.describe(window=1)
+        self.assertEqual(stats.loc["count", "fn1"], 10)
+        self.assertEqual(stats.loc["max", "fn1"], 20)
+        p50 = agg.quantiles(0.5)["fn1"]
+        self.assertEqual(list(p50.index.total_seconds()), [0, 1, 2])
+        reservoir = agg.reservoir_frame()
+        self.assertEqual(len(reservoir), 5)
+        self.assertTrue(reservoir["fn1"]["begin"].is_monotonic_increasing)
+        self.assertFalse(reservoir[("fn1", "warmup")].any())
+
+    def test_bench(self):
+        """Test that bench keeps histograms and a reservoir only."""
+
+        def noop():
+            pass
+
+        agg = aggregate.Aggregate(reservoir=100, recent=100)
+        samples = perfume.bench(
+            noop,
+            max_samples=2000,
+            calibrate=False,
+            display=functools.partial(
+                cli.TerminalDisplay, interval=float("inf")
+            ),
+            aggregate=agg,
+        )
+        self.assertEqual(len(samples), 100)
+        self.assertGreaterEqual(agg.counts[0], 2000)
+        self.assertEqual(agg.describe().loc["count", "noop"], agg.counts[0])
+
+
+class TestCli(unittest.TestCase):
+    """Tests for `perfume.cli` module."""
+
+    def test_no_notebook_imports(self):
+        """Test that the command runs without Bokeh or IPython."""
+        code = (
+            "import sys, perfume.cli; "
+            "print(sorted({m.split('.')[0] for m in sys.modules}))"
+        )
+        modules = subprocess.check_output(
+            [sys.executable, "-c", code], universal_newlines=True
+        )
+        self.assertNotIn("'bokeh'", modules)
+        self.assertNotIn("'IPython'", modules)
+
+    def test_display_import(self):
+        """Test that Display is still importable from its old place."""
+        try:
+            from perfume.display import Display
+        except ImportError:
+            self.skipTest("needs Bokeh and IPython")
+        self.assertIs(perfume.perfume.Display, Display)
+        with self.assertRaises(AttributeError):
+            perfume.perfume.Nothing
+
+    def test_main(self):
+        """Test benchmarking a module's functions and saving samples."""
+        with tempfile.TemporaryDirectory() as directory:
+            module = os.path.join(directory, "perfume_cli_example.py")
+            with open(module, "w") as f:
+                f.write("def bench_a():\n    pass\n\n")
+                f.write("def bench_b():\n    pass\n\n")
+                f.write("def helper():\n    pass\n")
+            output = os.path.join(directory, "samples.csv")
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                cli.main([module, "--max-samples", "20", "-q", "-o", output])
+            samples = pd.read_csv(output, header=[0, 1], index_col=0)
+        self.assertEqual(
+            list(samples.columns.unique(level=0)), ["bench_a", "bench_b"]
+        )
+        self.assertEqual(len(samples), 20)
+        self.assertIn("busy calls/s", stdout.getvalue())
+
+    def test_bad_options(self):
+        """Test that options bench rejects are reported as usage errors."""
+        with tempfile.TemporaryDirectory() as directory:
+            module = os.path.join(directory, "perfume_cli_options.py")
+            with open(module, "w") as f:
+                f.write("def bench_a():\n    pass\n")
+            stderr = io.StringIO()
+            with contextlib.redirect_stderr(stderr):
+                with self.assertRaises(SystemExit) as exit:
+                    cli.main([module, "--processes", "2", "--threads", "2"])
+        self.assertEqual(exit.exception.code, 2)
+        self.assertIn("either processes or threads", stderr.getvalue())
+
+
+class TestPytestPlugin(unittest.TestCase):
+    """Tests for `perfume.pytest_plugin` module."""
+
+    def test_fixture(self):
+        """Test benchmarking and asserting in tests with the fixture."""
+        tests = (
+            "def test_fast(perfume):\n"
+            "    assert perfume(lambda: None).quantile(0.5) < 1e9\n"
+            "\n"
+            "def test_slower(perfume):\n"
+            "    def new():\n"
+            "        sum(range(2000))\n"
+            "    def old():\n"
+            "        sum(range(100))\n"
+            "    perfume(new, baseline=old).assert_not_slower()\n"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test_example.py")
+            with open(path, "w") as f:
+                f.write(tests)
+            run = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "pytest",
+                    "-p",
+                    "perfume.pytest_plugin",
+                    "-p",
+                    "no:cacheprovider",
+                    "--perfume-budget",
+                    "0.2",
+                    path,
+                ],
+                cwd=directory,
+                env=dict(
+                    os.environ,
+                    PYTHONPATH=os.path.dirname(
+                        os.path.dirname(os.path.abspath(perfume.__file__))
+                    ),
+                ),
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+            )
+        self.assertIn("1 failed, 1 passed", run.stdout)
+        self.assertIn("Slower than baseline", run.stdout)
+        self.assertIn("test_example.py::test_fast <lambda>:", run.stdout)